@@ -1,180 +1,593 @@
 #!/usr/bin/env python3
-import glob
+import argparse
 import os.path
-from tempfile import TemporaryFile
-from time import perf_counter
-from playwright.sync_api import sync_playwright
-import urllib3
+from contextlib import ExitStack
+from time import perf_counter, time
 
-# IMPORT PROJECTS PARTS
+# IMPORT PROJECTS PARTS(NO SIDE EFFECTS ON IMPORT, CREDENTIALS ARE LOADED ON FIRST USE)
 from project_static import (
     appname,
     start_date_n_time,
+    setup_logging,
     logging,
     logs_dir,
     logs_to_keep,
     data_files,
-    pki_url,
-    pki_user,
-    pki_pass,
     script_data,
-    results_dir,
+    results_dir as default_results_dir,
     template,
     cer_ext,
     pfx_pass,
     openssl_bin,
     cns_data,
+    issuer_engine,
+    http_templates,
+    browser_templates,
+    certsrv_form_cache,
+    certsrv_form_ttl,
+    local_ca_dir,
+    local_ca_key_type,
+    local_ca_templates,
+    proxies,
+    keygen_workers,
+    keygen_processes,
+    crypto_backend,
+    issuer_concurrency,
+    issuer_timeout,
+    run_mode,
+    pfx_workers,
+    stage_queue_size,
+    stage_report_interval,
+    service_listen,
+    service_token_file,
+    service_priority,
+    service_jobs_kept,
+    key_pool_enabled,
+    key_pool_dir,
+    key_pool_size,
+    resume_mode,
+    renew_mode,
+    renew_key_types,
+    key_type,
+    job_store_enabled,
+    job_store_db,
+    run_report_json,
+    prom_file,
+    ca_max_attempts,
+    ca_backoff_base,
+    ca_backoff_max,
+    ca_breaker_threshold,
+    ca_breaker_reset,
+    ca_adaptive_concurrency,
+    ca_min_concurrency,
+    ca_latency_tolerance,
+    mail_notify_cns,
+    mail_digest_interval,
+    script_dir,
+    results_retention_enabled,
+    results_keep,
+    results_keep_days,
+    results_archive_dir,
+    archive_compression,
+    archive_keep_days,
 )
 
-from app_scripts.project_helper import files_rotate, check_create_dir, func_decor, check_file
+from app_scripts.project_helper import check_create_dir, func_decor, check_file
+from app_scripts.structured_log import log_fields
 
-from app_scripts.app_functions import (
-    create_cert,
-    make_pfx,
-    make_csr
-)
+# TEMPLATE NAMES OF ISSUER ENGINE(CN INPUT ROW TEMPLATES ARE CHECKED AGAINST THEM)
+engine_templates = {'http': http_templates, 'local': local_ca_templates}.get(issuer_engine, browser_templates)
 
 # MAILING IMPORTS(IF YOU NEED)
 # from project_static import smtp_server, smtp_port, smtp_from_addr, mail_list_users
 # from app_scripts.project_mailing import send_mail_report
 
-# DISABLE SSL WARNINGS
-urllib3.disable_warnings()
-
-# STARTED TEMP FILE FOR USER REPORT
-user_report = TemporaryFile(mode='w+t')
-
-# SCRIPT STARTED ALERT
-logging.info(f'{appname}: SCRIPT WORK STARTED')
-logging.info(f'Script Starting Date&Time is: {str(start_date_n_time)}')
-logging.info('----------------------------\n')
-
-
-# START PERF COUNTER
-start_time_counter = perf_counter()
-
-
-# CHECK DATA DIR EXIST/CREATE
-func_decor(f'checking {data_files} dir exists and create if not')(check_create_dir)(data_files)
-
-
-# CHECKING DATA DIRS & FILES
-func_decor(f'checking {script_data} file exist', 'crit')(check_file)(script_data)
-func_decor(f'checking {script_data} file exist', 'crit')(check_file)(cns_data)
-func_decor(f'checking {results_dir} dir exist/create', 'crit')(check_create_dir)(results_dir)
-
-# CHECK MAILING DATA EXIST(IF YOU NEED MAILING)
-# func_decor(f'checking {mailing_data} exists', 'crit')(check_file)(mailing_data)
-
-"""
-OTHER CODE GOES HERE
-"""
-user_report.write(f'{appname}: {str(start_date_n_time)}\n')
-user_report.write('----------------------------\n')
-
-# report lists
-total_cn_to_process = []
-failed_cn_to_process = []
-successfully_processed = []
-pfx_failed = []
-csr_file_path = ""
-key_file_path = ""
-cer_file_path = ""
-
-# GET CNS_LIST
-with open(cns_data, 'r') as file:
-    cns_list = [i.strip() for i in file.readlines()]
-
-# CREATING DIRS FOR CNS IN CNS_LIST AND MAKING CSR AND KEYS
-for cn in cns_list:
-    # making separate dir for cn
-    cn_path = f'{results_dir}/{cn}'
-    try:
-        os.mkdir(cn_path)
-    except FileExistsError:
-        logging.info(f'{cn_path} alreade exists, moving on')
-    except Exception as e:
-        logging.warning(f'failed to create dir {cn_path}:\n\t{e}')
-        continue
-
-    # creating csr & key
-    try:
-        make_csr(openssl_bin, cn, cn_path, cn_path)
-    except Exception as e:
-        logging.warning(f'failed to make csr&key for {cn}:\n\t{e}\nskipping this cn')
-        continue
-    logging.info(f'Finished to make csr & key files for {cn}')
-
-    # getting csr file path inside csr dir
-    for file in glob.iglob(f'{cn_path}/*.csr'):
-        csr_file_path = file
-        break
-    # getting key file path inside csr dir
-    for file in glob.iglob(f'{cn_path}/*.key'):
-        key_file_path = file
-        break
-
-    # CREATING CERTS
-    downloaded_certs_pathes = []
-    with sync_playwright() as playwright:
-        try:
-            create_cert(
-                pki_url,
-                pki_user,
-                pki_pass,
-                csr_file_path,
-                template,
-                cn,
-                cer_ext,
-                cn_path,
-                playwright
+
+# COMMAND LINE ARGS
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Get cert from MS PKI server and make .pfx file')
+    parser.add_argument('--force', action='store_true',
+                        help='redo all steps(key, csr, cert, pfx) for every CN, even already finished ones')
+    parser.add_argument('--results-dir', help='results dir to make/resume(default: RESULTS_<today>)')
+    parser.add_argument('--renew', action='store_true',
+                        help='reuse latest key(and CSR) of every CN from previous RESULTS_* dirs, new cert & pfx only')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='validate CNs input and show steps to do for every CN, no keys/CA requests/credentials')
+    parser.add_argument('--serve', action='store_true',
+                        help=f'run issuance service: warm CA sessions, jobs over local API({service_listen})')
+    return parser.parse_args(argv)
+
+
+# DRY RUN: VALIDATE INPUT AND SHOW PLAN
+def dry_run(results_dir: str, force: bool, renew: bool = False):
+    """
+    Read & validate CNs input, print steps to do for every CN(resume state from results dir files).
+    Nothing is written, no credentials are loaded, no browser/CA session is started.
+
+    Args:
+        results_dir: str, results dir to check
+        force: bool, plan all steps for every CN
+        renew: bool, show keys of previous runs to renew CNs with
+
+    Returns:
+        dict, stage -> CNs count to do
+    """
+    from app_scripts.crypto_backend import get_crypto_backend, key_types
+    from app_scripts.cn_input import read_cn_rows
+    from app_scripts.resume import plan_job, stages, previous_cn_dirs, plan_renewal
+
+    backend = get_crypto_backend(crypto_backend, openssl_bin)
+    renew_dirs = previous_cn_dirs(os.path.dirname(results_dir), results_dir) if renew else None
+    todo_total = dict.fromkeys(stages, 0)
+    cns_total = 0
+    for row in read_cn_rows(cns_data, templates=engine_templates, key_types=key_types):
+        job = plan_job(backend, results_dir, row['cn'], cer_ext, force)
+        if renew_dirs is not None:
+            plan_renewal(backend, job, renew_dirs, renew_key_types, row.get('key_type'), row.get('sans'))
+        todo = [stage for stage in stages if stage not in job['skip']]
+        if job.get('renew_from'):
+            todo[0] = f'keygen(renew: key{" & csr" if job["renew_csr"] else ""} of {job["renew_from"]})'
+        for stage in todo:
+            todo_total[stage] += 1
+        cns_total += 1
+        options = ', '.join(f'{name}={value}' for name, value in row.items() if name not in ('cn', 'pfx_pass'))
+        print(f'{row["cn"]}: {", ".join(todo) or "all done"}' + (f' ({options})' if options else ''))
+    print(f'{cns_total} CNs, to do: ' + ', '.join(f'{stage} {count}' for stage, count in todo_total.items()))
+    return todo_total
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results_dir = os.path.abspath(args.results_dir) if args.results_dir else default_results_dir
+    setup_logging()
+
+    if args.dry_run:
+        func_decor(f'checking {cns_data} file exist', 'crit')(check_file)(cns_data)
+        dry_run(results_dir, args.force or not resume_mode, args.renew or renew_mode)
+        return
+
+    # RUN PARTS(IMPORTED FOR REAL RUN ONLY: CRYPTO LIBS, REQUESTS, PLAYWRIGHT ARE LOADED BELOW AS NEEDED)
+    import urllib3
+    from app_scripts.crypto_backend import get_crypto_backend, key_types
+    from app_scripts.cn_input import read_cn_rows
+    from app_scripts.keygen import make_csrs_parallel
+    from app_scripts.pipeline import make_issuance_pipeline
+    from app_scripts.key_pool import KeyPool
+    from app_scripts.resume import plan_job, previous_cn_dirs, plan_renewal
+    from app_scripts.certsrv_form import FormCache
+    from app_scripts.job_store import JobStore
+    from app_scripts.run_metrics import RunMetrics
+    from app_scripts.ca_controller import SubmissionController
+    from app_scripts.issuers import get_issuer
+    if issuer_engine == 'http':
+        from app_scripts.certsrv_http import make_certsrv_session
+
+    # DISABLE SSL WARNINGS
+    urllib3.disable_warnings()
+
+    # SCRIPT STARTED ALERT
+    logging.info('%s: SCRIPT WORK STARTED', appname, extra=log_fields('run_started'))
+    logging.info('Script Starting Date&Time is: %s', start_date_n_time)
+    logging.info('----------------------------\n')
+
+    # START PERF COUNTER
+    start_time_counter = perf_counter()
+
+    # CHECK DATA DIR EXIST/CREATE
+    func_decor(f'checking {data_files} dir exists and create if not')(check_create_dir)(data_files)
+
+    # CHECKING DATA DIRS & FILES
+    if issuer_engine != 'local':
+        func_decor(f'checking {script_data} file exist', 'crit')(check_file)(script_data)
+    if not args.serve:
+        func_decor(f'checking {script_data} file exist', 'crit')(check_file)(cns_data)
+    func_decor(f'checking {results_dir} dir exist/create', 'crit')(check_create_dir)(results_dir)
+
+    # PKI CREDENTIALS & CA ENDPOINTS(script_data IS READ HERE, ON FIRST USE; LOCAL ENGINE: ONE LOCAL CA)
+    pki_endpoints = [{'name': 'local'}]
+    pki_url = pki_user = pki_pass = None
+    if issuer_engine != 'local':
+        from project_static import pki_endpoints
+        # first endpoint is default for engines(endpoints without own values)
+        pki_url, pki_user, pki_pass = (pki_endpoints[0][key] for key in ('url', 'user', 'password'))
+
+    # CHECK MAILING DATA EXIST(IF YOU NEED MAILING)
+    # func_decor(f'checking {mailing_data} exists', 'crit')(check_file)(mailing_data)
+
+    """
+    OTHER CODE GOES HERE
+    """
+    # report lists
+    total_cn_to_process = []
+    failed_cn_to_process = []
+    successfully_processed = []
+    pfx_failed = []
+    # service mode: counters only(lists would grow for the whole service life, per-CN state is in service jobs)
+    service_totals = {'cns_total': 0, 'cns_succeeded': 0, 'cns_failed': 0, 'pfx_failed': 0}
+
+    # CNS INPUT(STREAMED, VALIDATED, DEDUPLICATED; PLAIN LIST, CSV OR JSONL WITH PER-ROW OPTIONS)
+    cn_rows = read_cn_rows(cns_data, templates=engine_templates, key_types=key_types)
+
+    # CRYPTO BACKEND FOR KEY/CSR/PFX
+    backend = get_crypto_backend(crypto_backend, openssl_bin)
+    logging.info('using %s crypto backend', backend.name)
+
+    # PRE-GENERATED KEYS POOL(REFILLED IN BACKGROUND DURING THE RUN)
+    key_pool = None
+    if key_pool_enabled:
+        key_pool = KeyPool(key_pool_dir, key_pool_size, backend, key_type=key_type)
+        logging.info('using key pool %s: %s keys ready', key_pool_dir, key_pool.count())
+        key_pool.start_refill()
+
+    # JOB-STATE STORE(CN STATES, ARTIFACTS, CA REQUEST IDS, TIMINGS)
+    store = JobStore(job_store_db, start_date_n_time.isoformat()) if job_store_enabled else None
+
+    # RUN METRICS(STAGE/STEP TIMINGS FOR RUN REPORT)
+    metrics = RunMetrics(appname, start_date_n_time.isoformat(), service_jobs_kept if args.serve else None)
+    listeners = [store.record_stage] if store else []
+
+    # MAIL DISPATCHER(PER-CN NOTIFICATION DIGESTS & USER REPORT OVER ONE SMTP CONNECTION)
+    mailer = None
+    if mail_notify_cns:
+        from project_static import smtp_server, smtp_port, smtp_login, smtp_pass, smtp_from_addr, mail_list_users
+        from app_scripts.mail_dispatcher import MailDispatcher, cn_notifier
+
+        mailer = MailDispatcher(smtp_server, smtp_port, smtp_from_addr, smtp_login, smtp_pass, appname,
+                                mail_digest_interval)
+        mailer.start()
+        listeners.append(cn_notifier(mailer, mail_list_users))
+    stage_listeners = [metrics] + listeners
+
+    # CA SUBMISSION CONTROLLER(RETRIES, CIRCUIT BREAKER, ADAPTIVE CONCURRENCY UP TO issuer_concurrency,
+    # HEALTH/LATENCY-AWARE DISTRIBUTION OVER CA ENDPOINTS)
+    controller = SubmissionController(
+        issuer_concurrency,
+        ca_min_concurrency,
+        ca_adaptive_concurrency,
+        ca_latency_tolerance,
+        ca_max_attempts,
+        ca_backoff_base,
+        ca_backoff_max,
+        ca_breaker_threshold,
+        ca_breaker_reset,
+        endpoints=pki_endpoints
+    )
+    # CA submissions in flight over all endpoints
+    issue_concurrency = controller.max_concurrency
+    if len(controller.endpoints) > 1:
+        logging.info('CA endpoints: %s', ', '.join(f'{e.name}({e.url})' for e in controller.endpoints))
+
+    # PLAYWRIGHT ENGINE: CACHED CERTSRV REQUEST FORM(FORM PAGE IS OPENED DIRECTLY, NO HOME/LINK PAGES)
+    form_cache = FormCache(certsrv_form_cache, certsrv_form_ttl) if issuer_engine == 'playwright' else None
+
+    # ISSUER: CA SUBMISSION OF ONE CN(PLAYWRIGHT/HTTP CERTSRV OR LOCAL CA), SAME FOR ALL RUN MODES
+    issuer = get_issuer(
+        issuer_engine,
+        pki_url,
+        pki_user,
+        pki_pass,
+        template,
+        cer_ext,
+        http_templates=http_templates,
+        form_cache=form_cache,
+        browser_templates=browser_templates,
+        on_browser_start=lambda duration: metrics.observe_step('issue', 'browser_start', duration),
+        local_ca_dir=local_ca_dir,
+        local_ca_templates=local_ca_templates,
+        local_ca_key_type=local_ca_key_type
+    )
+    logging.info('using %s issuer', issuer.name)
+
+    # HTTP ENGINE: ONE POOLED SESSION PER CA ENDPOINT(OWN CREDENTIALS)
+    def start_http_sessions():
+        for endpoint in controller.endpoints:
+            endpoint.http_session = make_certsrv_session(
+                endpoint.user, endpoint.password, proxies, pool_size=endpoint.max_concurrency
             )
-        except Exception as e:
-            logging.warning(f'FAILED: creating cert for {cn}, \n{e}, \nskipping\n')
+
+    def close_http_sessions():
+        for endpoint in controller.endpoints:
+            if endpoint.http_session:
+                endpoint.http_session.close()
+
+    def record_stage(job, stage, started_at, error=None, duration=None):
+        if duration is None:
+            duration = time() - started_at
+        for listener in stage_listeners:
+            listener(job, stage, started_at, duration, error)
+
+    # CN JOBS: SKIP STEPS ALREADY DONE IN RESULTS DIR(RESUME MODE), REDO ALL WITH --force
+    force = args.force or not resume_mode
+    if force:
+        logging.info('resume is off, all steps are done for every CN')
+
+    # RENEWAL: KEYS(AND CSRS) OF PREVIOUS RUNS INSTEAD OF NEW KEYS
+    renew_dirs = None
+    if args.renew or renew_mode:
+        renew_dirs = previous_cn_dirs(os.path.dirname(results_dir), results_dir)
+        logging.info('renewal mode: %s CNs found in previous results dirs', len(renew_dirs))
+
+    def plan_cn_job(row, redo=False):
+        if args.serve:
+            service_totals['cns_total'] += 1
+        else:
+            total_cn_to_process.append(row['cn'])
+        job = plan_job(backend, results_dir, row['cn'], cer_ext, force or redo, store)
+        if renew_dirs is not None:
+            plan_renewal(backend, job, renew_dirs, renew_key_types, row.get('key_type'), row.get('sans'))
+            if job.get('renew_from'):
+                logging.info('%s: renewal with key of %s', row['cn'], job['renew_from'],
+                             extra=log_fields('renewal_planned', cn=row['cn']))
+        job.update(row)
+        if job['skip']:
+            logging.info('%s: already done %s, skipping these steps', row['cn'], sorted(job['skip']),
+                         extra=log_fields('steps_skipped', cn=row['cn']))
+            metrics.skipped(job)
+        return job
+
+    def cn_jobs():
+        for row in cn_rows:
+            yield plan_cn_job(row)
+
+    # CN without cert(failed at keygen, issue or service planning) is failed, cert without PFX is PFX failure
+    def collect_result(job):
+        if args.serve:
+            service_totals['cns_succeeded'] += 'cer' in job
+            service_totals['cns_failed'] += 'cer' not in job
+            service_totals['pfx_failed'] += job.get('failed_stage') == 'pfx'
+            return
+        if 'cer' in job:
+            successfully_processed.append(job['cn'])
+        else:
+            failed_cn_to_process.append(job['cn'])
+        if job.get('failed_stage') == 'pfx':
+            pfx_failed.append(job['cn'])
+
+    # STAGED MODE: KEYGEN, CA SUBMISSION AND PFX PACKAGING OVERLAP(STAGES CONNECTED BY BOUNDED QUEUES)
+    # SERVICE MODE: SAME PIPELINE RUNS UNTIL STOPPED, JOBS COME OVER LOCAL API BY PRIORITY
+    if run_mode == 'staged' or args.serve:
+        if issuer_engine == 'http':
+            start_http_sessions()
+
+        pipeline = make_issuance_pipeline(
+            backend,
+            results_dir,
+            issuer_engine,
+            pki_url,
+            pki_user,
+            pki_pass,
+            template,
+            cer_ext,
+            pfx_pass,
+            keygen_workers,
+            issue_concurrency,
+            pfx_workers,
+            stage_queue_size,
+            http_templates=http_templates,
+            report_interval=stage_report_interval,
+            key_pool=key_pool,
+            listeners=listeners,
+            metrics=metrics,
+            controller=controller,
+            form_cache=form_cache,
+            browser_templates=browser_templates,
+            key_type=key_type,
+            issuer=issuer,
+            priority_queues=args.serve,
+            keygen_processes=keygen_processes
+        )
+        if args.serve:
+            from app_scripts.issuance_service import IssuanceService, run_service
+
+            service = IssuanceService(
+                pipeline, plan_cn_job, engine_templates, key_types, service_priority, service_jobs_kept, collect_result
+            )
+            run_service(service, service_listen, service_token_file)
         else:
-            successfully_processed.append(cn)
-            logging.info(f'DONE: creating cert for {cn}\n')
-
-    # getting certificate file path inside csr dir
-    for file in glob.iglob(f'{cn_path}/*.{cer_ext}'):
-        cer_file_path = file
-        break
-    if not cer_file_path:
-        logging.warning(f"no CRT file found in {cn_path}, skipping")
-        failed_cn_to_process.append(cn)
-        continue
-
-    # making pfx (Windows ver of OpenSSL generate NOT VALID pfx to use for MACOS!!!)
-    try:
-        make_pfx(openssl_bin, cn, cer_file_path, key_file_path, cn_path, pfx_pass)
-    except Exception as e:
-        logging.warning(f'FAILED: to create PFX file for {cn}, \n{e}, skipping')
-        pfx_failed.append(cn)
-        continue
-    logging.info(f'DONE: create PFX file for {cn}')
-
-# report
-if len(failed_cn_to_process) > 0:
-    logging.warning(f'failures for: {failed_cn_to_process}')
-if len(successfully_processed) == len(total_cn_to_process):
-    logging.info('all CNs processed successfully!')
-if len(pfx_failed) > 0:
-    logging.warning(f'failures for PFX: {pfx_failed}')
-
-# SENDING FINAL USER REPORT
-user_report.seek(0)
-# (func_decor('sending user report')(send_mail_report)
-#  (appname, mail_list_users, smtp_from_addr, smtp_server, smtp_port, mail_body=user_report.read()))
-
-
-# POST-WORK PROCEDURES
-
-# FINISH JOBS
-logging.info('#########################')
-logging.info('SUCCEEDED: Script job done!')
-logging.info(f'Estimated time is: {perf_counter() - start_time_counter}')
-logging.info('----------------------------\n')
-files_rotate(logs_dir, logs_to_keep)
-
-# (func_decor('sending Script Final LOG')(send_mail_report)
-#     (appname, mail_list_admins, smtp_from_addr, smtp_server, smtp_port, log_file=app_log_name, report='f'))
+            for job in pipeline.run(cn_jobs()):
+                collect_result(job)
+
+        if issuer_engine == 'http':
+            close_http_sessions()
+
+    # BATCH MODE: ALL KEYS, THEN ALL CERTS, THEN ALL PFX
+    else:
+        jobs = {job['cn']: job for job in cn_jobs()}
+        async_issuing = issue_concurrency > 1
+        if async_issuing:
+            from app_scripts.async_issuer import issue_certs
+
+        # ONE BROWSER/HTTP & CA SESSION FOR THE WHOLE RUN, CLOSED ON ANY EXIT(NO LEFT CHROMIUM/LOCKS ON ERROR)
+        # (async mode with playwright engine starts its own async browser)
+        with ExitStack() as run_sessions:
+            if issuer_engine == 'http':
+                start_http_sessions()
+                run_sessions.callback(close_http_sessions)
+            issuer_state = run_sessions.enter_context(issuer.worker_context()) if not async_issuing else None
+
+            # CREATING DIRS FOR CNS IN CNS_LIST AND MAKING CSR AND KEYS(ALL CNS AT ONCE, ON WORKERS POOL)
+            keygen_timings = {}
+            csr_done, csr_failed = make_csrs_parallel(
+                backend,
+                [cn for cn, job in jobs.items() if 'keygen' not in job['skip']],
+                results_dir,
+                keygen_workers,
+                key_pool,
+                {cn for cn, job in jobs.items() if job.get('reuse_key')},
+                {cn: job['sans'] for cn, job in jobs.items() if job.get('sans')},
+                keygen_timings,
+                {cn: (job['renew_from'], job['renew_csr']) for cn, job in jobs.items() if job.get('renew_from')},
+                key_type,
+                {cn: job['key_type'] for cn, job in jobs.items() if job.get('key_type')},
+                jobs,
+                keygen_processes
+            )
+            for cn in csr_done:
+                record_stage(jobs[cn], 'keygen', keygen_timings[cn][0], duration=keygen_timings[cn][1])
+            for cn, error in csr_failed.items():
+                record_stage(jobs[cn], 'keygen', keygen_timings[cn][0], error, keygen_timings[cn][1])
+            csr_done.update({cn: job['cn_path'] for cn, job in jobs.items() if 'keygen' in job['skip']})
+
+            # CREATING CERTS FOR ALL CNS AT ONCE(ASYNC MODE, UP TO issue_concurrency IN FLIGHT)
+            if async_issuing:
+                issue_timings = {}
+                issued_by = {}
+                issued = issue_certs(
+                    [
+                        (cn, jobs[cn]['csr'], cn_path, jobs[cn].get('template')) for cn, cn_path in csr_done.items()
+                        if 'issue' not in jobs[cn]['skip']
+                    ],
+                    issuer_engine,
+                    pki_url,
+                    pki_user,
+                    pki_pass,
+                    template,
+                    cer_ext,
+                    issue_concurrency,
+                    issuer_timeout,
+                    http_templates=http_templates,
+                    timings=issue_timings,
+                    controller=controller,
+                    issued_by=issued_by,
+                    form_cache=form_cache,
+                    browser_templates=browser_templates,
+                    issuer=issuer if issuer_engine != 'playwright' else None,
+                    artifacts=jobs
+                )
+                for cn, result in issued.items():
+                    started_at, duration = issue_timings.get(cn, (time(), 0))
+                    if cn in issued_by:
+                        jobs[cn]['ca_endpoint'] = issued_by[cn]
+                    if isinstance(result, Exception):
+                        record_stage(jobs[cn], 'issue', started_at, result, duration)
+                    else:
+                        jobs[cn]['cer'] = result
+                        record_stage(jobs[cn], 'issue', started_at, duration=duration)
+                        successfully_processed.append(cn)
+
+            # CREATING CERTS & PFX FOR CNS WITH CSR AND KEYS
+            for cn in jobs:
+                # key/CSR not made(failure is logged & recorded by keygen step above)
+                if cn not in csr_done:
+                    failed_cn_to_process.append(cn)
+                    continue
+                cn_path = csr_done[cn]
+                job = jobs[cn]
+
+                # CREATING CERTS(ONE BY ONE, SYNC MODE)
+                if not async_issuing and 'issue' not in job['skip']:
+                    issue_started = time()
+                    try:
+                        job['cer'] = controller.submit(
+                            lambda endpoint: issuer.issue(endpoint, job, issuer_state), cn, job
+                        )
+                    except Exception as e:
+                        logging.warning('FAILED: creating cert for %s, \n%s, \nskipping\n', cn, e,
+                                        extra=log_fields('stage_failed', cn=cn, stage='issue', error=str(e)))
+                        record_stage(job, 'issue', issue_started, e)
+                    else:
+                        successfully_processed.append(cn)
+                        record_stage(job, 'issue', issue_started)
+                        logging.info('DONE: creating cert for %s\n', cn,
+                                     extra=log_fields('stage_done', cn=cn, stage='issue'))
+
+                # cert of this CN only(made now, by async mode or in previous run)
+                if not job.get('cer'):
+                    logging.warning('no CRT file found in %s, skipping', cn_path,
+                                    extra=log_fields('cert_missing', cn=cn, stage='pfx'))
+                    failed_cn_to_process.append(cn)
+                    continue
+
+                if 'pfx' in job['skip']:
+                    continue
+
+                # making pfx (Windows ver of OpenSSL generate NOT VALID pfx to use for MACOS!!!)
+                # from key & cert buffers of keygen/issue steps if made in this run
+                job.pop('csr_pem', None)
+                pfx_started = time()
+                try:
+                    backend.make_pfx(cn, job['cer'], job['key'], cn_path, job.get('pfx_pass', pfx_pass),
+                                     job.pop('cer_pem', None), job.pop('key_pem', None))
+                except Exception as e:
+                    logging.warning('FAILED: to create PFX file for %s, \n%s, skipping', cn, e,
+                                    extra=log_fields('stage_failed', cn=cn, stage='pfx', error=str(e)))
+                    record_stage(job, 'pfx', pfx_started, e)
+                    pfx_failed.append(cn)
+                    continue
+                job['pfx'] = f'{cn_path}/{cn}.pfx'
+                record_stage(job, 'pfx', pfx_started)
+                logging.info('DONE: create PFX file for %s', cn, extra=log_fields('stage_done', cn=cn, stage='pfx'))
+
+    # STOP KEY POOL REFILL
+    if key_pool:
+        key_pool.stop()
+
+    # CLOSE JOB STORE
+    if store:
+        store.close()
+
+    # report
+    if len(failed_cn_to_process) > 0:
+        logging.warning('failures for: %s', failed_cn_to_process, extra=log_fields('run_failures'))
+    if len(successfully_processed) == len(total_cn_to_process) and not args.serve:
+        logging.info('all CNs processed successfully!')
+    if len(pfx_failed) > 0:
+        logging.warning('failures for PFX: %s', pfx_failed, extra=log_fields('run_failures', stage='pfx'))
+
+    # RUN REPORT: JSON IN RESULTS DIR, PROMETHEUS TEXTFILE, USER REPORT SUMMARY
+    metrics.finish(perf_counter() - start_time_counter)
+    run_totals = {
+        'cns_total': len(total_cn_to_process),
+        'cns_succeeded': len(successfully_processed),
+        'cns_failed': len(failed_cn_to_process),
+        'pfx_failed': len(pfx_failed),
+        'ca_retries': controller.retries,
+        'ca_circuit_opens': controller.circuit_opens
+    }
+    if args.serve:
+        run_totals.update(service_totals)
+    logging.info('CA submission controller: %s', controller.stats(), extra=log_fields('controller_stats'))
+    func_decor(f'writing run report {results_dir}/{run_report_json}')(metrics.write_json)(
+        f'{results_dir}/{run_report_json}', run_totals
+    )
+    if prom_file:
+        func_decor(f'writing prometheus metrics {prom_file}')(metrics.write_prometheus)(prom_file, run_totals)
+    user_report = metrics.summary_text(run_totals)
+    logging.info('RUN SUMMARY:\n%s', user_report, extra=log_fields('run_summary'))
+
+    # SENDING FINAL USER REPORT(QUEUED, CN DIGESTS ARE FLUSHED & MAIL QUEUE IS DRAINED BY mailer.close)
+    if mailer:
+        mailer.send(mail_list_users, f'{appname} - Script Report({start_date_n_time})', user_report)
+        mailer.close()
+    # (func_decor('sending user report')(send_mail_report)
+    #  (appname, mail_list_users, smtp_from_addr, smtp_server, smtp_port, mail_body=user_report))
+
+    # POST-WORK PROCEDURES
+
+    # FINISH JOBS
+    logging.info('#########################')
+    logging.info('SUCCEEDED: Script job done!')
+    run_duration = perf_counter() - start_time_counter
+    logging.info('Estimated time is: %s', run_duration, extra=log_fields('run_done', duration=round(run_duration, 3)))
+    logging.info('----------------------------\n')
+
+    # RETENTION: LOGS ROTATION, OLD RESULTS DIRS ARCHIVED & PURGED(CURRENT RESULTS DIR IS NEVER TOUCHED)
+    from app_scripts.retention import apply_retention
+    func_decor('logs & results retention')(apply_retention)(
+        logs_dir,
+        logs_to_keep,
+        script_dir if results_retention_enabled else None,
+        results_keep,
+        results_keep_days,
+        results_archive_dir,
+        archive_keep_days,
+        archive_compression,
+        exclude=[results_dir]
+    )
+
+    # (func_decor('sending Script Final LOG')(send_mail_report)
+    #     (appname, mail_list_admins, smtp_from_addr, smtp_server, smtp_port, log_file=app_log_name, report='f'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,270 @@
+"""
+Asyncio issuance mode:
+ - N CA submissions in flight at once(semaphore)
+ - per-CN timeout with cancellation(timed out attempt is not retried if CSR was already sent
+   or may still be sent: worker thread issuers can't be stopped)
+ - playwright engine: async Playwright API, one browser/context(per CA endpoint credentials), page per CN
+ - http engine: certsrv_http calls on worker threads sharing pooled requests.Session(per CA endpoint)
+ - other issuers(issuers.LocalCaIssuer): issuer.issue calls on worker threads
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter, time
+from urllib.parse import urljoin
+
+from project_static import logging
+from app_scripts.structured_log import log_fields, ca_log
+from app_scripts.certsrv_form import (
+    request_link_name, submit_link_name, parse_form, resolve_template, result_title_re, result_req_id
+)
+from app_scripts.ca_controller import CaEndpoint, CaRequestError
+from app_scripts.app_functions import read_csr_body, save_cert
+
+
+# CREATING CERT FILE(ASYNC PLAYWRIGHT)
+async def create_cert_async(
+        url: str,
+        csr_file: str,
+        template: str,
+        cn: str,
+        cer_ext: str,
+        path_to_save_cer: str,
+        page,
+        form_cache=None,
+        templates: dict = None,
+        cert_info: dict = None
+) -> str:
+    """
+    (CA server, async Playwright)Same flow as app_functions.create_cert on async Page.
+
+    :param url: url of PKI server
+    :param csr_file: full path to csr file
+    :param template: template name to use for PKI
+    :param cn: cn to use in result cert name
+    :param cer_ext: certificate extension
+    :param path_to_save_cer: str, downloads dir for certs
+    :param page: playwright.async_api Page(already authenticated context)
+    :param form_cache: certsrv_form.FormCache, optional, see app_functions.create_cert
+    :param templates: dict, template name -> form option label(project_static.browser_templates)
+    :param cert_info: dict, optional, CSR PEM is taken from its "csr_pem", CA request ID & cert PEM are saved to it
+        as "ca_request_id" & "cer_pem", "ca_submitted" is set before submit click
+    :return: str, cert's download path
+    """
+    from playwright.async_api import expect
+
+    csr_body = read_csr_body(csr_file, cert_info)
+
+    form = form_cache.get(url) if form_cache else None
+    if form is not None:
+        await page.goto(form['form_url'])
+        if not await page.locator(form['request_selector']).count():
+            form_cache.invalidate(url)
+            form = None
+    if form is None:
+        await page.goto(url)
+        await page.get_by_role('link', name=request_link_name).click()
+        await page.get_by_role('link', name=submit_link_name).click()
+        form = parse_form(await page.content(), page.url)
+        if form_cache:
+            form_cache.put(url, form)
+
+    await page.locator(form['request_selector']).fill(csr_body)
+    await page.locator(form['template_selector']).select_option(label=resolve_template(form, template, templates))
+    # CSR is sent: errors from here on are not retried(no duplicate CA requests)
+    if cert_info is not None:
+        cert_info['ca_submitted'] = True
+    await page.locator(form['submit_selector']).click()
+    try:
+        await expect(page.locator('#locPageTitle')).to_have_text(result_title_re)
+    except AssertionError as e:
+        raise CaRequestError(f'CSR SENT, NO CERTSRV RESULT PAGE, check CA before submitting again\n{e}',
+                             'unknown') from e
+    req_id = result_req_id(await page.content())
+    if cert_info is not None:
+        cert_info['ca_request_id'] = req_id
+
+    # base64 cert into memory over page context, no browser download temp file
+    try:
+        response = await page.request.get(urljoin(page.url, f'certnew.cer?ReqID={req_id}&Enc=b64'))
+        cert_body = await response.body()
+        if not response.ok or b'-----BEGIN CERTIFICATE-----' not in cert_body:
+            raise Exception('response is not a base64 certificate')
+        return save_cert(cert_body, cn, cer_ext, path_to_save_cer, cert_info)
+    except Exception as e:
+        raise CaRequestError(f'CERT FOR {cn} ISSUED(ReqID={req_id}), BUT NOT SAVED\n{e}', 'issued', req_id) from e
+
+
+# ISSUE ONE CN UNDER SEMAPHORE & TIMEOUT
+async def _issue_one(semaphore, timeout, cn, issue_coro_factory, timings=None, controller=None,
+                     default_endpoint=None, issued_by=None, cert_info=None, cancellable=True):
+    cert_info = {} if cert_info is None else cert_info
+
+    async def attempt(endpoint):
+        cert_info.pop('ca_submitted', None)
+        try:
+            return await asyncio.wait_for(issue_coro_factory(endpoint), timeout)
+        except asyncio.TimeoutError:
+            if cert_info.get('ca_submitted'):
+                raise CaRequestError(f'TIMEOUT: CSR for {cn} sent, CA answer not received in {timeout}s, '
+                                     f'check CA before submitting again', 'unknown')
+            if not cancellable:
+                # wait_for drops only the future: worker thread goes on and can still send CSR
+                raise CaRequestError(f'TIMEOUT: cert for {cn} not issued in {timeout}s, issuing thread is still '
+                                     f'running and may send CSR, check CA before submitting again', 'unknown')
+            raise Exception(f'TIMEOUT: cert for {cn} not issued in {timeout}s, cancelled')
+
+    async with semaphore:
+        started_at = time()
+        start = perf_counter()
+        record = {}
+        try:
+            return await (controller.submit_async(attempt, cn, record) if controller else attempt(default_endpoint))
+        finally:
+            if timings is not None:
+                timings[cn] = (started_at, perf_counter() - start)
+            if issued_by is not None and record.get('ca_endpoint'):
+                issued_by[cn] = record['ca_endpoint']
+
+
+# ISSUE CERTS FOR ALL JOBS
+async def issue_certs_async(
+        jobs: list,
+        engine: str,
+        url: str,
+        user: str,
+        password: str,
+        template: str,
+        cer_ext: str,
+        concurrency: int,
+        timeout: float,
+        http_session=None,
+        http_templates: dict = None,
+        timings: dict = None,
+        controller=None,
+        issued_by: dict = None,
+        form_cache=None,
+        browser_templates: dict = None,
+        issuer=None,
+        artifacts: dict = None
+) -> dict:
+    """
+    Issue certs for all jobs keeping up to <concurrency> CA submissions in flight.
+
+    :param jobs: list of tuples(cn, csr_file_path, cn_path[, cn_template])
+    :param engine: str, playwright, http or local(project_static.issuer_engine), not used if issuer is set
+    :param url: url of PKI server
+    :param user: username to auth on PKI server
+    :param password: password to auth on PKI server
+    :param template: default template name to use for PKI
+    :param cer_ext: certificate extension
+    :param concurrency: int, max CA submissions in flight
+    :param timeout: float, per-CN timeout, seconds(CN submission is cancelled after it, worker thread issuers:
+        timed out CN is failed as unknown CA answer, not retried)
+    :param http_session: requests.Session from certsrv_http.make_certsrv_session(http engine only)
+    :param http_templates: dict, project_static.http_templates(http engine only)
+    :param timings: dict, optional, filled with cn -> (start timestamp, duration), semaphore wait excluded
+    :param controller: ca_controller.SubmissionController, optional, retries/circuit breaker/adaptive
+        concurrency(up to <concurrency>) & CA endpoints(url/user/password/http_session are defaults for endpoints
+        without them), timeout is per attempt then
+    :param issued_by: dict, optional, filled with cn -> name of CA endpoint which issued cert(controller only)
+    :param form_cache: certsrv_form.FormCache, optional, cached request form of CA urls(playwright engine only)
+    :param browser_templates: dict, project_static.browser_templates(playwright engine only)
+    :param issuer: issuers object for non-playwright engines, default: issuers.HttpIssuer for http engine
+    :param artifacts: dict, optional, CN -> job dict(i.e. app CN jobs): CSR PEM is taken from its "csr_pem",
+        CA request ID & cert PEM are saved to it
+    :return: dict, cn -> cert path or Exception
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    results = {}
+    default_endpoint = CaEndpoint('default', url, user, password, concurrency)
+
+    # CN -> job dict shared by issue call & timeout check("ca_submitted")
+    cert_infos = artifacts if artifacts is not None else {}
+
+    async def run_all(factory_for, cancellable=True):
+        tasks = {
+            job[0]: asyncio.create_task(_issue_one(
+                semaphore, timeout, job[0], factory_for(*job), timings, controller, default_endpoint, issued_by,
+                cert_infos.setdefault(job[0], {}), cancellable
+            ))
+            for job in jobs
+        }
+        for cn, task in tasks.items():
+            try:
+                results[cn] = await task
+            except Exception as e:
+                ca_log.warning('FAILED: creating cert for %s, \n%s, \nskipping\n', cn, e,
+                               extra=log_fields('stage_failed', cn=cn, stage='issue', error=str(e)))
+                results[cn] = e
+            else:
+                duration = timings[cn][1] if timings and cn in timings else None
+                logging.info('DONE: creating cert for %s\n', cn, extra=log_fields(
+                    'stage_done', cn=cn, stage='issue', duration=round(duration, 3) if duration is not None else None,
+                    endpoint=(issued_by or {}).get(cn)
+                ))
+
+    if issuer is None and engine == 'http':
+        from app_scripts.issuers import HttpIssuer
+
+        issuer = HttpIssuer(url, template, cer_ext, http_session, http_templates)
+
+    if issuer is not None and issuer.name != 'playwright':
+        # own pool: default executor may have less threads than concurrency
+        # on timeout the thread itself is not interrupted, only its result is dropped: timeout is never retried
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            def thread_factory(cn, csr_file, cn_path, cn_template=None):
+                job = cert_infos.setdefault(cn, {})
+                job.update(cn=cn, csr=csr_file, cn_path=cn_path, template=cn_template or template)
+                return lambda endpoint: loop.run_in_executor(executor, issuer.issue, endpoint, job)
+            await run_all(thread_factory, cancellable=False)
+        return results
+
+    from playwright.async_api import async_playwright
+
+    async with async_playwright() as playwright:
+        browser = await playwright.chromium.launch(headless=True)
+        # credentials -> context creation task(one context per CA endpoint credentials, made on first use)
+        contexts = {}
+
+        async def context_for(endpoint):
+            credentials = (endpoint.user or user, endpoint.password or password)
+            if credentials not in contexts:
+                contexts[credentials] = asyncio.ensure_future(browser.new_context(
+                    http_credentials={
+                        "username": credentials[0],
+                        "password": credentials[1]
+                    },
+                    ignore_https_errors=True,
+                    accept_downloads=True
+                ))
+            return await contexts[credentials]
+
+        def playwright_factory(cn, csr_file, cn_path, cn_template=None):
+            async def issue(endpoint):
+                page = await (await context_for(endpoint)).new_page()
+                try:
+                    return await create_cert_async(
+                        endpoint.url or url, csr_file, cn_template or template, cn, cer_ext, cn_path, page,
+                        form_cache, browser_templates, cert_infos.setdefault(cn, {})
+                    )
+                finally:
+                    await page.close()
+            return issue
+        try:
+            await run_all(playwright_factory)
+        finally:
+            for context in contexts.values():
+                if context.done() and not context.cancelled() and context.exception() is None:
+                    await context.result().close()
+            await browser.close()
+    return results
+
+
+# SYNC ENTRY POINT
+def issue_certs(*args, **kwargs) -> dict:
+    """
+    asyncio.run wrapper for issue_certs_async, same args.
+    """
+    return asyncio.run(issue_certs_async(*args, **kwargs))
@@ -0,0 +1,139 @@
+"""
+Long-lived Playwright browser/session for the whole run:
+ - one Chromium + one authenticated context per run(per credentials for several CA endpoints)
+ - fresh page for every create_cert call
+ - relaunch on browser crash/disconnect
+ - clean shutdown at the end of the run
+"""
+
+from contextlib import contextmanager
+from time import perf_counter
+
+from playwright.sync_api import sync_playwright, Error as PlaywrightError
+
+from project_static import logging
+from app_scripts.structured_log import log_fields
+
+
+# BROWSER SESSION MANAGER
+class BrowserSession:
+    """
+    Keep one browser & CA session alive for the whole batch.
+
+    Usage:
+        with BrowserSession(user, password) as session:
+            with session.page() as page:
+                create_cert(..., page)
+
+    Args:
+        user: str, username to auth on PKI server
+        password: str, password to auth on PKI server
+        headless: bool, run Chromium headless(default)
+        max_restarts: int, how many times in a row browser may be relaunched(budget is reset after page is used
+            without error, so crashes spread over long service life do not add up)
+        on_start: callable(duration), optional, called after every browser(re)start(i.e. run metrics)
+    """
+    def __init__(self, user, password, headless=True, max_restarts=3, on_start=None):
+        self.user = user
+        self.password = password
+        self.headless = headless
+        self.max_restarts = max_restarts
+        self.on_start = on_start
+        self.restarts = 0
+        self._playwright = None
+        self._browser = None
+        self._contexts = {}
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    # START PLAYWRIGHT, BROWSER & AUTH CONTEXT
+    def start(self):
+        start = perf_counter()
+        if self._playwright is None:
+            self._playwright = sync_playwright().start()
+        self._browser = self._playwright.chromium.launch(headless=self.headless)
+        self._context(self.user, self.password)
+        duration = perf_counter() - start
+        logging.info('browser session started in %.2fs', duration,
+                     extra=log_fields('browser_started', duration=round(duration, 3)))
+        if self.on_start:
+            self.on_start(duration)
+
+    # AUTH CONTEXT FOR CREDENTIALS(MADE ON FIRST USE)
+    def _context(self, user, password):
+        # context keeps http auth & keep-alive connections between pages
+        if (user, password) not in self._contexts:
+            self._contexts[(user, password)] = self._browser.new_context(
+                http_credentials={
+                    "username": user,
+                    "password": password
+                },
+                ignore_https_errors=True,
+                accept_downloads=True
+            )
+        return self._contexts[(user, password)]
+
+    # CHECK BROWSER IS ALIVE
+    def is_alive(self):
+        return self._browser is not None and self._browser.is_connected()
+
+    # RELAUNCH BROWSER AFTER CRASH
+    def restart(self):
+        if self.restarts >= self.max_restarts:
+            raise Exception(f'browser session restarted {self.restarts} times already, giving up')
+        self.restarts += 1
+        logging.warning('restarting browser session (%s/%s)', self.restarts, self.max_restarts,
+                        extra=log_fields('browser_restart', attempt=self.restarts))
+        self._close_browser()
+        self.start()
+
+    # GET FRESH PAGE FOR ONE CERT
+    @contextmanager
+    def page(self, user=None, password=None):
+        """
+        Yield fresh page of the shared context, page is always closed afterwards.
+        If browser is dead(crashed/disconnected) - relaunch it first.
+        user/password: other CA endpoint credentials(own context), default - session credentials.
+        """
+        credentials = (user or self.user, password or self.password)
+        if not self.is_alive():
+            self.restart()
+        try:
+            new_page = self._context(*credentials).new_page()
+        except PlaywrightError:
+            self.restart()
+            new_page = self._context(*credentials).new_page()
+        try:
+            yield new_page
+            # browser works again: restart budget is for crashes in a row
+            self.restarts = 0
+        finally:
+            try:
+                new_page.close()
+            except PlaywrightError:
+                # page already gone with crashed browser, next page() call relaunches it
+                pass
+
+    def _close_browser(self):
+        for obj in (*self._contexts.values(), self._browser):
+            if obj is None:
+                continue
+            try:
+                obj.close()
+            except PlaywrightError:
+                pass
+        self._contexts = {}
+        self._browser = None
+
+    # STOP EVERYTHING
+    def close(self):
+        self._close_browser()
+        if self._playwright is not None:
+            self._playwright.stop()
+            self._playwright = None
+        logging.info('browser session closed')
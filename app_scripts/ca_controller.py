@@ -0,0 +1,505 @@
+"""
+CA submission controller:
+ - retry transient failures(timeouts, connection errors, 5xx before CSR is sent) with jittered exponential backoff,
+   request CA answered(pending/denied) or lost after it was sent is never submitted again
+ - circuit breaker: pause submissions after repeated transient failures, probe CA before resuming
+ - AIMD concurrency limit: +1 in flight per window of fast successes, halve on error or high CA latency
+ - several CA endpoints(own credentials, limit, breaker each): submission goes to healthy endpoint
+   with least expected latency, failed submission is retried on other endpoint
+ - same controller for sync(pipeline/batch) and asyncio issuing
+"""
+
+import asyncio
+import random
+import time
+from threading import Condition, Lock
+
+from app_scripts.structured_log import log_fields, ca_log
+
+
+# CA CIRCUIT IS OPEN TOO LONG
+class CircuitOpenError(Exception):
+    pass
+
+
+# CSR WAS SENT TO CA: REQUEST IS NOT SUBMITTED AGAIN(NO DUPLICATE CA REQUESTS/CERTS)
+class CaRequestError(Exception):
+    """
+    Args:
+        message: str
+        outcome: str, pending/denied - CA decision, issued - cert issued but not downloaded/saved(get it by req_id),
+            unknown - request sent, CA answer is lost(timeout/connection drop, check CA before submitting again)
+        req_id: str, CA request ID if known
+    """
+    def __init__(self, message, outcome, req_id=None):
+        super().__init__(message)
+        self.outcome = outcome
+        self.req_id = req_id
+
+
+# TRANSIENT(RETRYABLE) ERROR CHECK
+def is_transient(error: Exception) -> bool:
+    """
+    Transient CA errors(raised before CSR is sent): timeouts(Playwright navigation, requests connect, async TIMEOUT),
+    connection errors, HTTP 408/429/5xx error pages. CA answers(pending/denied), errors after CSR is sent
+    (CaRequestError), bad template, missing CSR and local file errors are not retried.
+    """
+    if isinstance(error, (CircuitOpenError, CaRequestError)):
+        return False
+    response = getattr(error, 'response', None)
+    status_code = getattr(response, 'status_code', None)
+    if status_code:
+        return status_code >= 500 or status_code in (408, 429)
+    if isinstance(error, (TimeoutError, ConnectionError, asyncio.TimeoutError)):
+        return True
+    # requests.ConnectionError/Timeout, Playwright TimeoutError & navigation network errors(net::ERR_...)
+    if any(cls.__name__ == 'ConnectionError' for cls in type(error).__mro__):
+        return True
+    return 'Timeout' in type(error).__name__ or str(error).startswith('TIMEOUT') or 'net::ERR_' in str(error)
+
+
+# JITTERED EXPONENTIAL BACKOFF(FULL JITTER)
+def backoff_delay(attempt: int, base: float, max_delay: float) -> float:
+    return random.uniform(0, min(max_delay, base * 2 ** (attempt - 1)))
+
+
+# CIRCUIT BREAKER
+class CircuitBreaker:
+    """
+    closed -> open after <threshold> consecutive transient failures,
+    open -> half-open after <reset_timeout> seconds(one probe submission is let through),
+    half-open -> closed on probe success, -> open again on probe failure.
+
+    Args:
+        threshold: int, consecutive transient failures to open circuit
+        reset_timeout: float, seconds circuit stays open before probe
+        name: str, CA endpoint name for logs, optional
+    """
+    def __init__(self, threshold=5, reset_timeout=60, name=None):
+        self.threshold = threshold
+        self.name = name
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0
+        self.opens = 0
+        self._probe_in_flight = False
+        self._lock = Lock()
+
+    def wait_time(self) -> float:
+        """
+        Same as before_call, but no state change(open -> half-open, probe claim).
+        """
+        with self._lock:
+            if self.state == 'closed':
+                return 0
+            if self.state == 'open':
+                wait = self.opened_at + self.reset_timeout - time.monotonic()
+                if wait > 0:
+                    return wait
+            return min(1.0, self.reset_timeout) if self._probe_in_flight else 0
+
+    def before_call(self) -> float:
+        """
+        Returns:
+            float, 0 if call is allowed now, otherwise seconds to wait before asking again
+        """
+        with self._lock:
+            if self.state == 'closed':
+                return 0
+            if self.state == 'open':
+                wait = self.opened_at + self.reset_timeout - time.monotonic()
+                if wait > 0:
+                    return wait
+                self.state = 'half-open'
+                ca_log.info('CA circuit half-open, probing CA %s', self.name or '',
+                            extra=log_fields('circuit_half_open', endpoint=self.name))
+            if self._probe_in_flight:
+                return min(1.0, self.reset_timeout)
+            self._probe_in_flight = True
+            return 0
+
+    def record(self, success: bool):
+        with self._lock:
+            probe = self._probe_in_flight
+            self._probe_in_flight = False
+            if success:
+                if self.state != 'closed':
+                    ca_log.info('CA circuit closed, CA %s is back', self.name or '',
+                                extra=log_fields('circuit_closed', endpoint=self.name))
+                self.state = 'closed'
+                self.failures = 0
+                return
+            self.failures += 1
+            if (probe and self.state == 'half-open') or (self.state == 'closed' and self.failures >= self.threshold):
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+                self.opens += 1
+                ca_log.warning('CA circuit OPEN after %s failures, pausing submissions%s for %ss',
+                               self.failures, f' to {self.name}' if self.name else '', self.reset_timeout,
+                               extra=log_fields('circuit_open', endpoint=self.name))
+
+
+# AIMD CONCURRENCY LIMIT
+class AimdLimiter:
+    """
+    Submissions in flight limit between min_limit and max_limit:
+    additive increase(+1 per <limit> successes), multiplicative decrease(x decrease) on transient error
+    or latency above <latency_tolerance> x best latency seen(slowly forgotten: +1% per success).
+    Only one decrease per congestion signal burst: submissions started before the last decrease
+    do not decrease it again.
+
+    Args:
+        max_limit: int, max submissions in flight(project_static.issuer_concurrency)
+        min_limit: int, min submissions in flight
+        initial: int, starting limit(default: max_limit // 2)
+        adaptive: bool, False - fixed limit max_limit
+        latency_tolerance: float, latency above best seen x tolerance is congestion signal
+        decrease: float, limit multiplier on congestion
+        name: str, CA endpoint name for logs, optional
+    """
+    def __init__(self, max_limit, min_limit=1, initial=None, adaptive=True, latency_tolerance=2.0, decrease=0.5,
+                 name=None):
+        self.name = name
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.adaptive = adaptive
+        self.latency_tolerance = latency_tolerance
+        self.decrease = decrease
+        if not adaptive:
+            initial = self.max_limit
+        elif initial is None:
+            initial = max(self.min_limit, self.max_limit // 2)
+        self.limit = float(initial)
+        self.in_flight = 0
+        self.best_latency = None
+        self.last_decrease = 0
+        self._cond = Condition()
+
+    @property
+    def current(self) -> int:
+        return max(self.min_limit, min(self.max_limit, int(self.limit)))
+
+    def try_acquire(self) -> bool:
+        with self._cond:
+            if self.in_flight < self.current:
+                self.in_flight += 1
+                return True
+            return False
+
+    def acquire(self) -> float:
+        """
+        Block until submission slot is free.
+
+        Returns:
+            float, monotonic time of acquire(pass to release)
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self.in_flight < self.current)
+            self.in_flight += 1
+        return time.monotonic()
+
+    async def acquire_async(self, poll=0.05) -> float:
+        while not self.try_acquire():
+            await asyncio.sleep(poll)
+        return time.monotonic()
+
+    def release(self, started: float, latency: float, congestion: bool):
+        """
+        Free slot and adjust limit.
+
+        Args:
+            started: float, acquire() result
+            latency: float, submission duration, seconds(None - no signal, i.e. request denied by CA)
+            congestion: bool, transient error(CA overloaded/unavailable)
+        """
+        with self._cond:
+            self.in_flight -= 1
+            if self.adaptive and (latency is not None or congestion):
+                if not congestion:
+                    self.best_latency = latency if self.best_latency is None \
+                        else min(latency, self.best_latency * 1.01)
+                slow = self.best_latency is not None and latency > self.best_latency * self.latency_tolerance
+                if congestion or slow:
+                    if started >= self.last_decrease:
+                        old = self.current
+                        self.limit = max(self.min_limit, self.limit * self.decrease)
+                        self.last_decrease = time.monotonic()
+                        if self.current != old:
+                            ca_log.info('CA concurrency %s -> %s(%s)', old, self.current,
+                                        'error' if congestion else f'latency {latency:.2f}s',
+                                        extra=log_fields('concurrency_decrease', endpoint=self.name))
+                else:
+                    old = self.current
+                    self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                    if self.current != old:
+                        ca_log.info('CA concurrency %s -> %s', old, self.current,
+                                    extra=log_fields('concurrency_increase', endpoint=self.name))
+            self._cond.notify_all()
+
+
+# ONE CA ENDPOINT
+class CaEndpoint:
+    """
+    CA web enrollment server with own credentials, submissions limit, circuit breaker and latency stats.
+
+    Args:
+        name: str, endpoint name for logs/report
+        url: str, url of PKI server(None - issuer default url)
+        user: str, username to auth on PKI server(None - issuer default)
+        password: str, password to auth on PKI server(None - issuer default)
+        max_concurrency: int, max submissions in flight on this endpoint
+        min_concurrency, adaptive, latency_tolerance: see AimdLimiter
+        breaker_threshold, breaker_reset: see CircuitBreaker
+    """
+    # weight of last submission in latency average
+    latency_alpha = 0.3
+
+    def __init__(self, name='default', url=None, user=None, password=None, max_concurrency=1, min_concurrency=1,
+                 adaptive=True, latency_tolerance=2.0, breaker_threshold=5, breaker_reset=60):
+        self.name = name
+        self.url = url
+        self.user = user
+        self.password = password
+        self.max_concurrency = max(1, max_concurrency)
+        self.limiter = AimdLimiter(self.max_concurrency, min_concurrency, adaptive=adaptive,
+                                   latency_tolerance=latency_tolerance, name=name)
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_reset, name)
+        self.latency = None
+        self.issued = 0
+        self.failed = 0
+        # engine session for this endpoint(i.e. certsrv_http.make_certsrv_session), set by caller
+        self.http_session = None
+
+    # EXPECTED TIME OF ONE MORE SUBMISSION(NO LATENCY YET - 0, NEW ENDPOINT IS TRIED FIRST)
+    def score(self) -> float:
+        return (self.latency or 0) * (self.limiter.in_flight + 1) / self.limiter.current
+
+    def record(self, latency, success: bool):
+        if success:
+            self.issued += 1
+            self.latency = latency if self.latency is None \
+                else self.latency + self.latency_alpha * (latency - self.latency)
+        else:
+            self.failed += 1
+
+    def stats(self) -> dict:
+        return {
+            'url': self.url,
+            'concurrency': self.limiter.current,
+            'latency': round(self.latency, 3) if self.latency is not None else None,
+            'best_latency': round(self.limiter.best_latency, 3) if self.limiter.best_latency else None,
+            'issued': self.issued,
+            'failed': self.failed,
+            'circuit_state': self.breaker.state,
+            'circuit_opens': self.breaker.opens
+        }
+
+
+# CA SUBMISSION CONTROLLER
+class SubmissionController:
+    """
+    Run CA submissions under AIMD limits, circuit breakers and retries, over one or several CA endpoints.
+    Submission goes to endpoint with closed circuit and free slot with least score(latency x load),
+    transient failure is retried on other endpoint(no backoff if it is available) or after backoff.
+
+    Usage:
+        controller = SubmissionController(max_concurrency=8)
+        cer = controller.submit(lambda endpoint: create_cert_http(endpoint.url, ...), cn, job)
+        cer = await controller.submit_async(coro_factory, cn)
+
+    Args:
+        max_concurrency: int, max submissions in flight(default endpoint and endpoints without concurrency)
+        min_concurrency: int, min submissions in flight per endpoint
+        adaptive: bool, AIMD limit(False - fixed max_concurrency)
+        latency_tolerance: float, see AimdLimiter
+        max_attempts: int, attempts per CN(1 - no retries)
+        backoff_base: float, first retry max delay, seconds(doubled every retry, full jitter)
+        backoff_max: float, max retry delay, seconds
+        breaker_threshold: int, consecutive transient failures to open endpoint circuit
+        breaker_reset: float, seconds circuit stays open
+        breaker_max_wait: float, max seconds submission waits for open circuits of all endpoints
+            (default: 5 x breaker_reset), CircuitOpenError after it
+        endpoints: list of dicts(project_static.pki_endpoints): name, url, user, password, concurrency,
+            None - one default endpoint(issuer url & credentials)
+    """
+    def __init__(
+            self,
+            max_concurrency=1,
+            min_concurrency=1,
+            adaptive=True,
+            latency_tolerance=2.0,
+            max_attempts=3,
+            backoff_base=2,
+            backoff_max=60,
+            breaker_threshold=5,
+            breaker_reset=60,
+            breaker_max_wait=None,
+            endpoints=None
+    ):
+        self.endpoints = [
+            CaEndpoint(
+                endpoint.get('name') or endpoint.get('url') or 'default',
+                endpoint.get('url'),
+                endpoint.get('user'),
+                endpoint.get('password'),
+                endpoint.get('concurrency') or max_concurrency,
+                min_concurrency,
+                adaptive,
+                latency_tolerance,
+                breaker_threshold,
+                breaker_reset
+            )
+            for endpoint in (endpoints or [{}])
+        ]
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker_max_wait = breaker_reset * 5 if breaker_max_wait is None else breaker_max_wait
+        self.retries = 0
+        self._cond = Condition()
+
+    # MAX SUBMISSIONS IN FLIGHT OVER ALL ENDPOINTS
+    @property
+    def max_concurrency(self) -> int:
+        return sum(endpoint.max_concurrency for endpoint in self.endpoints)
+
+    @property
+    def circuit_opens(self) -> int:
+        return sum(endpoint.breaker.opens for endpoint in self.endpoints)
+
+    def _pick(self, exclude):
+        """
+        Take slot on best endpoint(endpoints not in exclude first), call under self._cond.
+
+        Returns:
+            tuple(endpoint or None, started, seconds to wait before next try, bool circuits of all endpoints open)
+        """
+        preferred = [endpoint for endpoint in self.endpoints if endpoint.name not in exclude]
+        others = [endpoint for endpoint in self.endpoints if endpoint.name in exclude]
+        circuit_waits = []
+        for endpoint in sorted(preferred, key=CaEndpoint.score) + sorted(others, key=CaEndpoint.score):
+            wait = endpoint.breaker.wait_time()
+            if wait:
+                circuit_waits.append(wait)
+                continue
+            if not endpoint.limiter.try_acquire():
+                continue
+            if endpoint.breaker.before_call():
+                # probe of half-open circuit is taken by other submission
+                endpoint.limiter.release(0, None, False)
+                continue
+            return endpoint, time.monotonic(), 0, False
+        if len(circuit_waits) == len(self.endpoints):
+            return None, None, min(circuit_waits), True
+        # all slots busy: woken up by release(timeout just in case)
+        return None, None, min([1.0, *circuit_waits]), False
+
+    def _acquire(self, cn, exclude):
+        waited = 0
+        with self._cond:
+            while True:
+                endpoint, started, wait, all_open = self._pick(exclude)
+                if endpoint:
+                    return endpoint, started
+                if all_open:
+                    if waited + wait > self.breaker_max_wait:
+                        raise CircuitOpenError(f'CA CIRCUIT OPEN for {waited:.0f}s, {cn} not submitted')
+                    waited += wait
+                self._cond.wait(wait)
+
+    async def _acquire_async(self, cn, exclude, poll=0.05):
+        waited = 0
+        while True:
+            with self._cond:
+                endpoint, started, wait, all_open = self._pick(exclude)
+            if endpoint:
+                return endpoint, started
+            if all_open:
+                if waited + wait > self.breaker_max_wait:
+                    raise CircuitOpenError(f'CA CIRCUIT OPEN for {waited:.0f}s, {cn} not submitted')
+                waited += wait
+            else:
+                wait = poll
+            await asyncio.sleep(wait)
+
+    def _after_call(self, endpoint, started, error, cn, attempt, exclude) -> float:
+        """
+        Record result. Returns retry delay, raises error if it is not retried.
+        """
+        latency = time.monotonic() - started
+        transient = error is not None and is_transient(error)
+        # sent request with lost answer is CA health signal too, but it is not retried
+        congestion = transient or getattr(error, 'outcome', None) == 'unknown'
+        endpoint.limiter.release(started, None if error is not None and not congestion else latency, congestion)
+        # CA answered(issued/pending/denied): circuit is healthy
+        endpoint.breaker.record(not congestion)
+        with self._cond:
+            endpoint.record(latency, error is None)
+            self._cond.notify_all()
+        if error is None:
+            return 0
+        if not transient or attempt >= self.max_attempts:
+            raise error
+        exclude.add(endpoint.name)
+        # other endpoint is ready: fail over now, no backoff
+        other_ready = any(
+            other.name not in exclude and not other.breaker.wait_time() for other in self.endpoints
+        )
+        delay = 0 if other_ready else backoff_delay(attempt, self.backoff_base, self.backoff_max)
+        with self._cond:
+            self.retries += 1
+        ca_log.warning(
+            '%s: CA submission attempt %s/%s on %s failed, retrying %s\n%s', cn, attempt, self.max_attempts,
+            endpoint.name, 'on other endpoint' if other_ready else f'in {delay:.1f}s', error,
+            extra=log_fields('submission_retry', cn=cn, endpoint=endpoint.name, attempt=attempt,
+                             duration=round(latency, 3), error=str(error))
+        )
+        return delay
+
+    def submit(self, func, cn: str, job: dict = None):
+        """
+        Call func(endpoint) with retries, returns its result.
+        job["ca_endpoint"] is set to name of endpoint which issued cert(if job is set).
+        """
+        exclude = set()
+        for attempt in range(1, self.max_attempts + 1):
+            endpoint, started = self._acquire(cn, exclude)
+            error = None
+            try:
+                result = func(endpoint)
+            except Exception as e:
+                error = e
+            delay = self._after_call(endpoint, started, error, cn, attempt, exclude)
+            if error is None:
+                if job is not None:
+                    job['ca_endpoint'] = endpoint.name
+                return result
+            time.sleep(delay)
+
+    async def submit_async(self, coro_factory, cn: str, job: dict = None):
+        """
+        Await coro_factory(endpoint) with retries, returns its result.
+        """
+        exclude = set()
+        for attempt in range(1, self.max_attempts + 1):
+            endpoint, started = await self._acquire_async(cn, exclude)
+            error = None
+            try:
+                result = await coro_factory(endpoint)
+            except Exception as e:
+                error = e
+            delay = self._after_call(endpoint, started, error, cn, attempt, exclude)
+            if error is None:
+                if job is not None:
+                    job['ca_endpoint'] = endpoint.name
+                return result
+            await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        return {
+            'concurrency': sum(endpoint.limiter.current for endpoint in self.endpoints),
+            'retries': self.retries,
+            'circuit_opens': self.circuit_opens,
+            'endpoints': {endpoint.name: endpoint.stats() for endpoint in self.endpoints}
+        }
@@ -0,0 +1,317 @@
+"""
+Certsrv request form metadata:
+ - discover form page url, field selectors & available templates once(home -> "Request a certificate" -> "Submit...")
+ - cache them on disk per CA url with TTL: next submissions open form page directly(two page loads less per cert)
+ - template name -> form option label mapping from project_static.browser_templates, checked against CA templates
+ - result page(certfnsh.asp) outcome: issued(request ID), pending or denied(disposition message)
+ - python3 -m app_scripts.certsrv_form [--refresh] - discover over http & show templates available on CA
+"""
+
+import argparse
+import json
+import os
+import re
+from html.parser import HTMLParser
+from threading import Lock
+from time import time
+from urllib.parse import urljoin
+
+from project_static import logging
+from app_scripts.ca_controller import CaRequestError
+from app_scripts.project_helper import write_file_atomic
+from app_scripts.structured_log import log_fields
+
+# CERTSRV LINKS: HOME -> REQUEST PAGE -> REQUEST FORM
+request_link_name = 'Request a certificate'
+submit_link_name = ('Submit a certificate request by using a base-64-encoded CMC or PKCS #10 file, '
+                    'or submit a renewal request by using a base-64-encoded PKCS #7	file.')
+
+# CERTSRV RESULT PAGE: TITLE(#locPageTitle), DOWNLOAD LINK, PENDING REQUEST ID, DISPOSITION MESSAGE
+result_title_re = re.compile(r'Certificate (Issued|Pending)|Denied|Error', re.IGNORECASE)
+req_id_re = re.compile(r'certnew\.cer\?ReqID=(\d+)')
+pending_re = re.compile(r'Your Request Id is (\d+)', re.IGNORECASE)
+disposition_re = re.compile(r'The disposition message is "([^"]*)"', re.IGNORECASE)
+
+
+# LINKS & REQUEST FORM OF CERTSRV PAGE
+class _PageParser(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.links = []
+        self.action = None
+        self.request = None
+        self.select = None
+        self.submit = None
+        self.options = {}
+        self._link = None
+        self._option = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'a' and attrs.get('href'):
+            self._link = [attrs['href'], '']
+        elif tag == 'form' and self.action is None:
+            self.action = attrs.get('action') or ''
+        elif tag == 'textarea' and self.request is None:
+            self.request = attrs
+        elif tag == 'select' and self.select is None:
+            self.select = attrs
+        elif tag == 'option' and self.select is not None:
+            # option without closing tag(allowed in HTML) ends at next one
+            self.handle_endtag('option')
+            self._option = [attrs.get('value'), '']
+        elif tag == 'input' and attrs.get('type') == 'submit' and self.submit is None:
+            self.submit = attrs
+
+    def handle_data(self, data):
+        for current in (self._link, self._option):
+            if current is not None:
+                current[1] += data
+
+    def handle_endtag(self, tag):
+        if tag == 'a' and self._link is not None:
+            self.links.append((self._link[0], ' '.join(self._link[1].split())))
+            self._link = None
+        elif tag in ('option', 'select') and self._option is not None:
+            label = ' '.join(self._option[1].split())
+            self.options[label] = self._option[0] if self._option[0] is not None else label
+            self._option = None
+
+
+def _parse(page_html):
+    parser = _PageParser()
+    parser.feed(page_html)
+    parser.close()
+    return parser
+
+
+def _selector(attrs, default):
+    if not attrs:
+        return default
+    if attrs.get('id'):
+        return f'#{attrs["id"]}'
+    if attrs.get('name'):
+        return f'[name="{attrs["name"]}"]'
+    return default
+
+
+# FIND LINK BY TEXT
+def find_link(page_html: str, page_url: str, name: str) -> str:
+    """
+    Args:
+        page_html: str, page source
+        page_url: str, page url(relative hrefs are resolved against it)
+        name: str, link text(whitespace-insensitive)
+
+    Returns:
+        str, absolute link url, raises Exception if link is not found
+    """
+    name = ' '.join(name.split())
+    for href, text in _parse(page_html).links:
+        if text == name:
+            return urljoin(page_url, href)
+    raise Exception(f'LINK "{name}" NOT FOUND AT {page_url}')
+
+
+# PARSE REQUEST FORM PAGE
+def parse_form(page_html: str, page_url: str) -> dict:
+    """
+    Args:
+        page_html: str, request form page source
+        page_url: str, request form page url
+
+    Returns:
+        dict, form_url, action(absolute url), request/template/submit selectors,
+        templates(option label -> option value), discovered_at;
+        raises Exception if page has no CSR textarea
+    """
+    parser = _parse(page_html)
+    if parser.request is None:
+        raise Exception(f'CERTSRV REQUEST FORM NOT FOUND AT {page_url}')
+    return {
+        'form_url': page_url,
+        'action': urljoin(page_url, parser.action or ''),
+        'request_selector': _selector(parser.request, '#locTaRequest'),
+        'template_selector': _selector(parser.select, '#lbCertTemplateID'),
+        'submit_selector': _selector(parser.submit, '#btnSubmit'),
+        'templates': parser.options,
+        'discovered_at': time()
+    }
+
+
+# TEMPLATE NAME -> FORM OPTION LABEL
+def resolve_template(form: dict, template: str, templates: dict = None) -> str:
+    """
+    Args:
+        form: dict, parse_form result
+        template: str, template name(cns_data row option or project_static.template)
+        templates: dict, template name -> option label(project_static.browser_templates),
+            name not in dict is used as label as is
+
+    Returns:
+        str, option label, raises Exception if CA form has no such template
+    """
+    label = (templates or {}).get(template, template)
+    if form['templates'] and label not in form['templates']:
+        raise Exception(f'TEMPLATE NOT IN LIST, CHECK TEMPLATE TYPE({template}), '
+                        f'available on CA: {", ".join(form["templates"])}')
+    return label
+
+
+# RESULT PAGE OUTCOME
+def parse_result(page_html: str) -> dict:
+    """
+    Args:
+        page_html: str, certfnsh.asp response(page after request form submit)
+
+    Returns:
+        dict, outcome(issued/pending/denied, None - not a result page), req_id(None if not shown),
+        message(CA disposition message or None)
+    """
+    disposition = disposition_re.search(page_html)
+    result = {'outcome': None, 'req_id': None, 'message': disposition.group(1) if disposition else None}
+    issued = req_id_re.search(page_html)
+    if issued:
+        return {**result, 'outcome': 'issued', 'req_id': issued.group(1)}
+    request_id = pending_re.search(page_html)
+    result['req_id'] = request_id.group(1) if request_id else None
+    text = page_html.lower()
+    if 'certificate pending' in text or 'wait for an administrator' in text:
+        result['outcome'] = 'pending'
+    elif 'denied' in text or disposition:
+        result['outcome'] = 'denied'
+    return result
+
+
+# REQUEST ID OF ISSUED CERT
+def result_req_id(page_html: str) -> str:
+    """
+    Args:
+        page_html: str, certfnsh.asp response
+
+    Returns:
+        str, CA request ID of issued cert; raises ca_controller.CaRequestError for pending/denied/unknown page
+        (CSR is already sent: it is not submitted again)
+    """
+    result = parse_result(page_html)
+    if result['outcome'] == 'issued':
+        return result['req_id']
+    if result['outcome'] == 'pending':
+        raise CaRequestError(f'CERTIFICATE PENDING(ReqID={result["req_id"]}), must be issued by CA manager',
+                             'pending', result['req_id'])
+    if result['outcome'] == 'denied':
+        raise CaRequestError(f'CERTIFICATE NOT ISSUED(ReqID={result["req_id"]}): '
+                             f'{result["message"] or "request denied by CA"}', 'denied', result['req_id'])
+    raise CaRequestError('CERTIFICATE NOT ISSUED: no request ID in certsrv response, '
+                         'check CA before submitting again', 'unknown')
+
+
+# FORM METADATA CACHE
+class FormCache:
+    """
+    parse_form results per CA url, in memory and in JSON file(read once, rewritten on change).
+    Entry older than ttl is not returned(form is discovered again).
+
+    Args:
+        cache_path: str, JSON file(project_static.certsrv_form_cache), None - memory only
+        ttl: float, seconds entry is trusted
+    """
+    def __init__(self, cache_path=None, ttl=86400):
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self._forms = None
+        self._lock = Lock()
+
+    def _load(self):
+        if self._forms is not None:
+            return
+        self._forms = {}
+        if self.cache_path and os.path.isfile(self.cache_path):
+            try:
+                with open(self.cache_path, 'r', encoding='utf-8') as file:
+                    self._forms = json.load(file)
+            except (OSError, ValueError) as e:
+                logging.warning('certsrv form cache %s is not read, forms are discovered again\n%s', self.cache_path, e,
+                                extra=log_fields('form_cache_failed', action='read', error=str(e)))
+
+    def _save(self):
+        if not self.cache_path:
+            return
+        try:
+            write_file_atomic(self.cache_path, json.dumps(self._forms, ensure_ascii=False, indent=2))
+        except OSError as e:
+            logging.warning('certsrv form cache %s is not saved\n%s', self.cache_path, e,
+                            extra=log_fields('form_cache_failed', action='save', error=str(e)))
+
+    def get(self, url: str):
+        with self._lock:
+            self._load()
+            form = self._forms.get(url)
+        if form is None or time() - form.get('discovered_at', 0) > self.ttl:
+            return None
+        return form
+
+    def put(self, url: str, form: dict):
+        with self._lock:
+            self._load()
+            self._forms[url] = form
+            self._save()
+        logging.info('certsrv form of %s cached: %s, %s templates', url, form['form_url'], len(form['templates']),
+                     extra=log_fields('form_cached', endpoint=url))
+
+    def invalidate(self, url: str):
+        with self._lock:
+            self._load()
+            if self._forms.pop(url, None) is not None:
+                self._save()
+        logging.info('certsrv form cache of %s dropped', url, extra=log_fields('form_cache_dropped', endpoint=url))
+
+
+# DISCOVER FORM OVER HTTP(SAME PAGES AS BROWSER GOES THROUGH)
+def discover_form_http(session, url: str, timeout: int = 60) -> dict:
+    """
+    Args:
+        session: requests.Session with CA auth(certsrv_http.make_certsrv_session)
+        url: str, certsrv url
+        timeout: int, seconds per page
+
+    Returns:
+        dict, parse_form result
+    """
+    page_url = url
+    for link_name in (request_link_name, submit_link_name):
+        response = session.get(page_url, timeout=timeout)
+        response.raise_for_status()
+        page_url = find_link(response.text, response.url, link_name)
+    response = session.get(page_url, timeout=timeout)
+    response.raise_for_status()
+    return parse_form(response.text, response.url)
+
+
+# SHOW/REFRESH CACHED FORMS OF CA ENDPOINTS
+if __name__ == '__main__':
+    from project_static import (
+        setup_logging, appname, start_date, logs_dir, pki_endpoints, proxies, certsrv_form_cache, certsrv_form_ttl,
+        browser_templates
+    )
+    from app_scripts.certsrv_http import make_certsrv_session
+
+    parser = argparse.ArgumentParser(description='Discover certsrv request form & templates of CA endpoints')
+    parser.add_argument('--refresh', action='store_true', help='discover again even if cached form is fresh')
+    args = parser.parse_args()
+
+    setup_logging(f'{logs_dir}/{appname}_certsrv_form_{start_date}.log')
+    cache = FormCache(certsrv_form_cache, certsrv_form_ttl)
+    for endpoint in pki_endpoints:
+        form = None if args.refresh else cache.get(endpoint['url'])
+        if form is None:
+            session = make_certsrv_session(endpoint['user'], endpoint['password'], proxies)
+            try:
+                form = discover_form_http(session, endpoint['url'])
+            finally:
+                session.close()
+            cache.put(endpoint['url'], form)
+        print(f'{endpoint["name"]}: {form["form_url"]}')
+        for label, value in form['templates'].items():
+            names = [name for name, mapped in browser_templates.items() if mapped == label]
+            print(f'\t{label}({value})' + (f' <- {", ".join(names)}' if names else ''))
@@ -0,0 +1,158 @@
+"""
+Browserless issuer engine for MS CA Web Enrollment(certsrv):
+ - pooled requests.Session(keep-alive, http auth)
+ - submit PKCS#10 CSR to certfnsh.asp with template attribute
+ - parse request ID from response(pending/denied requests & errors after CSR is sent are not submitted again)
+ - download base64 cert(certnew.cer)
+"""
+
+from time import perf_counter
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+from app_scripts.app_functions import read_csr_body, save_cert
+from app_scripts.ca_controller import CaRequestError
+from app_scripts.certsrv_form import result_req_id
+
+
+# CREATING POOLED CERTSRV SESSION
+def make_certsrv_session(user: str, password: str, proxies: dict = None, pool_size: int = 10) -> requests.Session:
+    """
+    Make requests.Session to reuse for all certsrv calls of the run.
+
+    :param user: username to auth on PKI server
+    :param password: password to auth on PKI server
+    :param proxies: requests proxies dict(project_static.proxies), optional
+    :param pool_size: keep-alive connections to keep in pool
+    :return: requests.Session
+    """
+    session = requests.Session()
+    session.auth = (user, password)
+    # same as ignore_https_errors for Playwright
+    session.verify = False
+    if proxies:
+        session.proxies.update(proxies)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+# SUBMIT CSR AND GET REQUEST ID
+def submit_csr(session: requests.Session, url: str, csr_body: str, ca_template: str, timeout: int = 60) -> str:
+    """
+    Submit CSR to certsrv(same as "Submit a certificate request..." form).
+
+    :param session: requests.Session from make_certsrv_session
+    :param url: url of certsrv(same pki_url as for Playwright engine)
+    :param csr_body: base64 PEM CSR body
+    :param ca_template: CA template name(CertificateTemplate attribute)
+    :param timeout: request timeout, seconds
+    :return: str, CA request ID; raises ca_controller.CaRequestError if request is pending/denied
+        or its answer is lost(read timeout, connection dropped after connect)
+    """
+    try:
+        response = session.post(
+            f'{url.rstrip("/")}/certfnsh.asp',
+            data={
+                'Mode': 'newreq',
+                'CertRequest': csr_body,
+                'CertAttrib': f'CertificateTemplate:{ca_template}',
+                'TargetStoreFlags': '0',
+                'SaveCert': 'yes',
+                'ThumbPrint': ''
+            },
+            timeout=timeout
+        )
+    except requests.ConnectTimeout:
+        # not connected: nothing is sent, retried
+        raise
+    except (requests.ConnectionError, requests.Timeout) as e:
+        reason = getattr(e.args[0], 'reason', None) if e.args else None
+        if isinstance(reason, NewConnectionError):
+            raise
+        raise CaRequestError(f'CSR SENT TO {url}, ANSWER IS LOST, check CA before submitting again\n{e}',
+                             'unknown') from e
+    # HTTP error page(CA/IIS overloaded): request is not taken, retried
+    response.raise_for_status()
+    return result_req_id(response.text)
+
+
+# DOWNLOAD ISSUED CERT
+def download_cert(session: requests.Session, url: str, req_id: str, timeout: int = 60) -> str:
+    """
+    Download base64 encoded cert by request ID.
+
+    :param session: requests.Session from make_certsrv_session
+    :param url: url of certsrv
+    :param req_id: CA request ID
+    :param timeout: request timeout, seconds
+    :return: str, PEM cert body
+    """
+    response = session.get(
+        f'{url.rstrip("/")}/certnew.cer',
+        params={'ReqID': req_id, 'Enc': 'b64'},
+        timeout=timeout
+    )
+    response.raise_for_status()
+    if '-----BEGIN CERTIFICATE-----' not in response.text:
+        raise Exception(f'FAILED TO DOWNLOAD CERT(ReqID={req_id}): response is not a base64 certificate')
+    return response.text
+
+
+# CREATING CERT FILE WITHOUT BROWSER
+def create_cert_http(
+        url: str,
+        csr_file: str,
+        template: str,
+        cn: str,
+        cer_ext: str,
+        path_to_save_cer: str,
+        session: requests.Session,
+        templates: dict,
+        cert_info: dict = None
+) -> str:
+    """
+    (CA server, requests)Create certificate via MS CA server without browser.
+    Returns same artifact as create_cert: <path_to_save_cer>/<cn>.<cer_ext>
+
+    :param url: url of PKI server(certsrv)
+    :param csr_file: full path to csr file
+    :param template: template name to use for PKI(same keys as for create_cert)
+    :param cn: cn to use in result cert name
+    :param cer_ext: certificate extension
+    :param path_to_save_cer: str, downloads dir for certs
+    :param session: requests.Session from make_certsrv_session
+    :param templates: dict, template name -> CA template name(project_static.http_templates)
+    :param cert_info: dict, optional, CA request ID is saved to it as "ca_request_id",
+        steps durations(submit - post CSR & CA issuance, download, seconds) as "step_timings", cert PEM as "cer_pem",
+        "ca_submitted" is set before CSR is sent;
+        its "csr_pem"(keygen stage buffer) is submitted instead of csr_file content
+    :return: str, cert's download path
+    """
+    if template not in templates:
+        raise Exception(f'TEMPLATE NOT IN LIST, CHECK TEMPLATE TYPE({template})')
+
+    csr_body = read_csr_body(csr_file, cert_info)
+
+    step_start = perf_counter()
+    if cert_info is not None:
+        cert_info['ca_submitted'] = True
+    req_id = submit_csr(session, url, csr_body, templates[template])
+    step_timings = {'submit': perf_counter() - step_start}
+    if cert_info is not None:
+        cert_info['ca_request_id'] = req_id
+
+    # CERT IS ISSUED: DOWNLOAD/SAVE ERROR MUST NOT SUBMIT CSR AGAIN
+    step_start = perf_counter()
+    try:
+        cert_body = download_cert(session, url, req_id)
+        download_path = save_cert(cert_body, cn, cer_ext, path_to_save_cer, cert_info)
+    except Exception as e:
+        raise CaRequestError(f'CERT FOR {cn} ISSUED(ReqID={req_id}), BUT NOT SAVED\n{e}', 'issued', req_id) from e
+    step_timings['download'] = perf_counter() - step_start
+    if cert_info is not None:
+        cert_info['step_timings'] = step_timings
+    return download_path
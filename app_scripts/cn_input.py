@@ -0,0 +1,204 @@
+"""
+Streaming CN input reader:
+ - plain list(one CN per line), CSV or JSONL(by file extension)
+ - per-row options: sans, template, key_type, pfx_pass
+ - skip blank lines & comments, validate CN/DNS syntax, dedup by CN(case-insensitive)
+ - lazy: rows are yielded one by one, file is never loaded into memory
+"""
+
+import csv
+import json
+import re
+
+from project_static import logging
+from app_scripts.structured_log import log_fields
+
+# ONE DNS LABEL
+label_re = re.compile(r'^(?!-)[A-Za-z0-9-]{1,63}(?<!-)$')
+
+# PER-ROW OPTIONS(CSV COLUMNS/JSONL KEYS BESIDES "cn")
+row_options = ('sans', 'template', 'key_type', 'pfx_pass')
+
+
+# CHECK CN/DNS NAME SYNTAX
+def validate_dns_name(name: str):
+    """
+    Check DNS name syntax(wildcard "*." prefix allowed).
+
+    Args:
+        name: str, CN or SAN
+
+    Returns:
+        None, raises ValueError if name is not valid
+    """
+    if not name or len(name) > 253:
+        raise ValueError(f'bad length({len(name)})')
+    labels = name.split('.')
+    if labels[0] == '*':
+        labels = labels[1:]
+    if not labels:
+        raise ValueError('wildcard only')
+    for label in labels:
+        if not label_re.match(label):
+            raise ValueError(f'bad label "{label}"')
+
+
+# DEDUP KEY: DNS NAMES ARE CASE-INSENSITIVE(ROW ITSELF KEEPS CN AS GIVEN: SUBJECT, DIR & FILE NAMES)
+def dns_name_key(name) -> str:
+    return str(name or '').strip().casefold()
+
+
+# SPLIT SANS STRING
+def parse_sans(sans) -> list:
+    if isinstance(sans, list):
+        return [str(san).strip() for san in sans if str(san).strip()]
+    return [san for san in re.split(r'[;,\s]+', sans or '') if san]
+
+
+# CNS FILE FORMAT BY EXTENSION(PLAIN IF NO .csv/.jsonl)
+def file_format(file_path: str) -> str:
+    if file_path.endswith('.csv'):
+        return 'csv'
+    if file_path.endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    return 'plain'
+
+
+# RAW ROWS BY FILE FORMAT(BAD ROW IS YIELDED AS ValueError, READING GOES ON)
+def _raw_rows(file, input_format: str):
+    if input_format == 'csv':
+        reader = csv.DictReader(line for line in file if not line.lstrip().startswith('#'))
+        while True:
+            try:
+                yield next(reader)
+            except StopIteration:
+                return
+            except csv.Error as e:
+                yield ValueError(e)
+    elif input_format == 'jsonl':
+        for line in file:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield e
+                continue
+            yield row if isinstance(row, dict) else ValueError('row is not JSON object')
+    else:
+        for line in file:
+            yield {'cn': line}
+
+
+# VALIDATE ONE RAW ROW(FILE ROW OR ISSUANCE SERVICE REQUEST)
+def parse_cn_row(raw: dict, templates=None, key_types=None) -> dict:
+    """
+    Args:
+        raw: dict, "cn" & row options(sans as list or ";"/","-separated string)
+        templates: allowed template names(optional)
+        key_types: allowed key types(optional)
+
+    Returns:
+        dict: {'cn': ..., <row options if set>}, raises ValueError for bad CN/SAN/template/key type
+    """
+    cn = str(raw.get('cn') or '').strip()
+    validate_dns_name(cn)
+    row = {'cn': cn}
+    for option in row_options:
+        value = raw.get(option)
+        if value in (None, '', []):
+            continue
+        if option == 'sans':
+            value = parse_sans(value)
+            for san in value:
+                validate_dns_name(san)
+        else:
+            value = str(value).strip()
+        row[option] = value
+    if templates is not None and row.get('template') and row['template'] not in templates:
+        raise ValueError(f'unknown template "{row["template"]}"')
+    if key_types is not None and row.get('key_type') and row['key_type'] not in key_types:
+        raise ValueError(f'unknown key type "{row["key_type"]}"')
+    return row
+
+
+# READ CNS FILE
+def read_cn_rows(file_path: str, input_format: str = None, templates=None, key_types=None):
+    """
+    Yield valid unique CN rows from CNs file.
+    Invalid and duplicate(case-insensitive) rows are logged(with row number) and skipped.
+    Memory: only set of already seen CNs is kept.
+
+    Args:
+        file_path: str, CNs file(project_static.cns_data)
+        input_format: str, plain/csv/jsonl(default: by extension, plain if no .csv/.jsonl)
+        templates: allowed template names(optional)
+        key_types: allowed key types(optional)
+
+    Returns:
+        generator of dicts: {'cn': ..., <row options if set>}
+    """
+    input_format = input_format or file_format(file_path)
+
+    seen = set()
+    skipped = 0
+    with open(file_path, 'r', encoding='utf-8', newline='' if input_format == 'csv' else None) as file:
+        for row_num, raw in enumerate(_raw_rows(file, input_format), 1):
+            if isinstance(raw, ValueError):
+                logging.warning('%s:%s: bad row, skipping\n\t%s', file_path, row_num, raw,
+                                extra=log_fields('cn_row_skipped', error=str(raw)))
+                skipped += 1
+                continue
+
+            cn = str(raw.get('cn') or '').strip()
+            if not cn or cn.startswith('#'):
+                continue
+            try:
+                if dns_name_key(cn) in seen:
+                    raise ValueError('duplicate')
+                row = parse_cn_row(raw, templates, key_types)
+            except ValueError as e:
+                logging.warning('%s:%s: CN "%s" skipped: %s', file_path, row_num, cn, e,
+                                extra=log_fields('cn_row_skipped', cn=cn, error=str(e)))
+                skipped += 1
+                continue
+            seen.add(dns_name_key(cn))
+            yield row
+
+    logging.info('%s: %s CNs read, %s rows skipped', file_path, len(seen), skipped, extra=log_fields('cns_read'))
+
+
+# WRITE CNS FILE(SAME FORMATS AS read_cn_rows, I.E. RENEWAL LIST FROM INVENTORY)
+def write_cn_rows(file_path: str, rows, output_format: str = None) -> int:
+    """
+    Write CN rows to CNs file readable by read_cn_rows.
+    Plain format keeps CN only, CSV/JSONL keep row options(sans, template, key_type, pfx_pass).
+
+    Args:
+        file_path: str, CNs file
+        rows: iterable of dicts: {'cn': ..., <row options>}
+        output_format: str, plain/csv/jsonl(default: by extension, same as read_cn_rows)
+
+    Returns:
+        int, rows written
+    """
+    output_format = output_format or file_format(file_path)
+
+    written = 0
+    with open(file_path, 'w', encoding='utf-8', newline='' if output_format == 'csv' else None) as file:
+        writer = None
+        if output_format == 'csv':
+            writer = csv.DictWriter(file, fieldnames=('cn', *row_options), extrasaction='ignore')
+            writer.writeheader()
+        for row in rows:
+            if output_format == 'csv':
+                writer.writerow({**row, 'sans': ';'.join(row.get('sans') or ())})
+            elif output_format == 'jsonl':
+                file.write(json.dumps(
+                    {name: row[name] for name in ('cn', *row_options) if row.get(name)}, ensure_ascii=False
+                ) + '\n')
+            else:
+                file.write(f'{row["cn"]}\n')
+            written += 1
+    return written
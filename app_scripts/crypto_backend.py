@@ -0,0 +1,272 @@
+"""
+Pluggable crypto backends for KEY/CSR/PFX:
+ - python: in-process via cryptography lib(no fork per CN, no openssl binary required)
+ - openssl: openssl subprocess(make_csr/make_pfx from app_functions), fallback
+
+Backend interface:
+ - generate_key(key_type) -> PEM bytes, key_type - one of key_types(RSA 2048/3072/4096, ECDSA P-256/P-384, Ed25519)
+ - make_csr(cn, csr_path, key_path, key_pem=None, sans=None, key_type) -> (key PEM, CSR PEM) bytes,
+   key_pem - existing key to use(i.e. from key pool), sans - DNS names for subjectAltName, key_type - type of new key
+ - make_pfx(cn, cer_file_path, key_file_path, out_file_path, pfx_pass, cer_pem=None, key_pem=None),
+   cer_pem/key_pem - buffers of issue/keygen steps, files are read only without them
+Every artifact file is written once via temp file + rename(key & pfx never half-written), keys with 0600.
+ - public_key(file_path) -> public key bytes of PEM key/CSR/cert(comparable within one backend)
+ - key_type(file_path) -> key type name of PEM key(rsa2048, ecdsa-p256, ...)
+"""
+
+import re
+import subprocess
+
+from project_static import logging
+from app_scripts.project_helper import write_file_atomic
+from app_scripts.app_functions import make_csr, make_pfx, CryptoError, openssl_key_options
+
+# OPTIONAL: cryptography lib for in-process backend
+try:
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+    from cryptography.hazmat.primitives.serialization import pkcs12
+    from cryptography.x509.oid import NameOID
+except ImportError:
+    x509 = None
+
+
+# KEY TYPES SUPPORTED BY BACKENDS(project_static.key_type, cns_data key_type option)
+key_types = ('rsa2048', 'rsa3072', 'rsa4096', 'ecdsa-p256', 'ecdsa-p384', 'ed25519')
+default_key_type = 'rsa2048'
+
+# ECDSA KEY TYPE -> cryptography CURVE CLASS NAME
+ec_curves = {
+    'ecdsa-p256': 'SECP256R1',
+    'ecdsa-p384': 'SECP384R1'
+}
+
+# EC CURVE -> KEY TYPE NAME(cryptography curve names & openssl "ASN1 OID" names)
+ec_key_types = {
+    'secp256r1': 'ecdsa-p256',
+    'prime256v1': 'ecdsa-p256',
+    'secp384r1': 'ecdsa-p384',
+    'secp521r1': 'ecdsa-p521'
+}
+
+
+# KEY TYPE NAME OF cryptography PUBLIC KEY
+def key_type_of(public_key) -> str:
+    if isinstance(public_key, rsa.RSAPublicKey):
+        return f'rsa{public_key.key_size}'
+    if isinstance(public_key, ec.EllipticCurvePublicKey):
+        return ec_key_types.get(public_key.curve.name, f'ec-{public_key.curve.name}')
+    if isinstance(public_key, ed25519.Ed25519PublicKey):
+        return 'ed25519'
+    return type(public_key).__name__
+
+
+# SIGNATURE DIGEST FOR cryptography PRIVATE KEY(CSR/CERT SIGNING)
+def sign_hash(private_key):
+    """
+    sha512 for RSA, sha256/sha384 for ECDSA P-256/P-384(sha512 for bigger curves), None for Ed25519(own digest).
+    """
+    if isinstance(private_key, ed25519.Ed25519PrivateKey):
+        return None
+    if isinstance(private_key, ec.EllipticCurvePrivateKey):
+        return {256: hashes.SHA256(), 384: hashes.SHA384()}.get(private_key.curve.key_size, hashes.SHA512())
+    return hashes.SHA512()
+
+
+# WRITE KEY FILE READABLE FOR OWNER ONLY(TEMP FILE + RENAME)
+def write_key_file(key_file_path: str, key_bytes: bytes):
+    write_file_atomic(key_file_path, key_bytes, 0o600)
+
+
+# OPENSSL SUBPROCESS BACKEND
+class OpensslBackend:
+    """
+    KEY/CSR/PFX by openssl binary(one fork/exec per call).
+
+    Args:
+        openssl_bin_path: str, full path to OpenSSL binary
+    """
+    name = 'openssl'
+
+    def __init__(self, openssl_bin_path):
+        self.openssl_bin_path = openssl_bin_path
+
+    def generate_key(self, key_type=default_key_type):
+        algorithm, key_opts, _ = openssl_key_options(key_type)
+        process = subprocess.run(
+            [self.openssl_bin_path, "genpkey", "-algorithm", algorithm, *key_opts],
+            capture_output=True
+        )
+        if process.returncode != 0:
+            raise CryptoError(f'FAILED TO GENERATE KEY(openssl exit code {process.returncode})',
+                              process.returncode, process.stderr)
+        return process.stdout
+
+    def make_csr(self, cn, csr_path, key_path, key_pem=None, sans=None, key_type=default_key_type):
+        # existing key: openssl reads it from its final file
+        if key_pem:
+            write_key_file(key_path + "/" + cn + ".key", key_pem)
+        new_key_pem, csr_pem = make_csr(self.openssl_bin_path, cn, csr_path, key_path, use_existing_key=bool(key_pem),
+                                        sans=sans, key_type=key_type)
+        return key_pem or new_key_pem, csr_pem
+
+    def make_pfx(self, cn, cer_file_path, key_file_path, out_file_path, pfx_pass, cer_pem=None, key_pem=None):
+        # key is read by openssl from its final file, cert buffer goes to stdin
+        make_pfx(self.openssl_bin_path, cn, cer_file_path, key_file_path, out_file_path, pfx_pass, cer_pem)
+
+    def public_key(self, file_path):
+        with open(file_path, 'rb') as pem_file:
+            pem = pem_file.read()
+        if b'PRIVATE KEY' in pem:
+            process_args = [self.openssl_bin_path, "pkey", "-in", file_path, "-pubout"]
+        elif b'CERTIFICATE REQUEST' in pem:
+            process_args = [self.openssl_bin_path, "req", "-in", file_path, "-pubkey", "-noout"]
+        else:
+            process_args = [self.openssl_bin_path, "x509", "-in", file_path, "-pubkey", "-noout"]
+        process = subprocess.run(process_args, capture_output=True)
+        if process.returncode != 0:
+            raise CryptoError(f'FAILED TO READ PUBLIC KEY OF {file_path}(openssl exit code {process.returncode})',
+                              process.returncode, process.stderr)
+        return process.stdout
+
+    def key_type(self, file_path):
+        process = subprocess.run([self.openssl_bin_path, "pkey", "-in", file_path, "-noout", "-text"],
+                                 capture_output=True)
+        if process.returncode != 0:
+            raise CryptoError(f'FAILED TO READ KEY {file_path}(openssl exit code {process.returncode})',
+                              process.returncode, process.stderr)
+        text = process.stdout.decode(errors='replace')
+        if text.startswith('ED25519'):
+            return 'ed25519'
+        curve = re.search(r'ASN1 OID: (\S+)', text)
+        if curve:
+            return ec_key_types.get(curve.group(1), f'ec-{curve.group(1)}')
+        bits = re.search(r'Private-Key: \((\d+) bit', text)
+        if bits and 'modulus' in text:
+            return f'rsa{bits.group(1)}'
+        raise CryptoError(f'UNKNOWN KEY TYPE OF {file_path}', process.returncode, process.stderr)
+
+
+# IN-PROCESS BACKEND
+class PythonBackend:
+    """
+    KEY/CSR/PFX in-process by cryptography lib.
+    Same files as OpensslBackend: <cn>.key(PKCS#8 PEM, no pass), <cn>.csr(PEM), <cn>.pfx.
+    CSR digest: sha512 for RSA, sha256/sha384 for ECDSA P-256/P-384, none for Ed25519.
+    """
+    name = 'python'
+
+    def generate_key(self, key_type=default_key_type):
+        if key_type in ('rsa2048', 'rsa3072', 'rsa4096'):
+            key = rsa.generate_private_key(public_exponent=65537, key_size=int(key_type[3:]))
+        elif key_type in ec_curves:
+            key = ec.generate_private_key(getattr(ec, ec_curves[key_type])())
+        elif key_type == 'ed25519':
+            key = ed25519.Ed25519PrivateKey.generate()
+        else:
+            raise CryptoError(f'UNKNOWN KEY TYPE({key_type}), must be one of {", ".join(key_types)}')
+        return key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption()
+        )
+
+    def make_csr(self, cn, csr_path, key_path, key_pem=None, sans=None, key_type=default_key_type):
+        csr_file_path = csr_path + "/" + cn + ".csr"
+        key_file_path = key_path + "/" + cn + ".key"
+        try:
+            key_pem = key_pem or self.generate_key(key_type)
+            key = serialization.load_pem_private_key(key_pem, password=None)
+            builder = x509.CertificateSigningRequestBuilder().subject_name(
+                x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, cn)])
+            )
+            if sans:
+                builder = builder.add_extension(
+                    x509.SubjectAlternativeName([x509.DNSName(san) for san in sans]), critical=False
+                )
+            # digest by actual key: existing key(pool/reuse/renewal) may be of other type than key_type
+            csr_pem = builder.sign(key, sign_hash(key)).public_bytes(serialization.Encoding.PEM)
+            write_key_file(key_file_path, key_pem)
+            write_file_atomic(csr_file_path, csr_pem)
+            return key_pem, csr_pem
+        except Exception as e:
+            raise CryptoError(f'FAILED TO MAKE CSR/KEY FOR {cn}\n'
+                              f'KEY:{key_file_path}\n'
+                              f'CSR:{csr_file_path}\n'
+                              f'{e}') from e
+
+    def make_pfx(self, cn, cer_file_path, key_file_path, out_file_path, pfx_pass, cer_pem=None, key_pem=None):
+        pfx_file_path = out_file_path + "/" + cn + ".pfx"
+        try:
+            if key_pem is None:
+                with open(key_file_path, 'rb') as key_file:
+                    key_pem = key_file.read()
+            if cer_pem is None:
+                with open(cer_file_path, 'rb') as cer_file:
+                    cer_pem = cer_file.read()
+            key = serialization.load_pem_private_key(key_pem, password=None)
+            cert = x509.load_pem_x509_certificate(cer_pem)
+            spki = (serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo)
+            if cert.public_key().public_bytes(*spki) != key.public_key().public_bytes(*spki):
+                raise CryptoError(f'certificate {cer_file_path} does not match key {key_file_path}')
+            pfx = pkcs12.serialize_key_and_certificates(
+                cn.encode(),
+                key,
+                cert,
+                None,
+                serialization.BestAvailableEncryption(pfx_pass.encode())
+            )
+            write_file_atomic(pfx_file_path, pfx, 0o600)
+        except CryptoError:
+            raise
+        except Exception as e:
+            raise CryptoError(f'FAILED TO MAKE PFX FOR {cn}\n'
+                              f'KEY:{key_file_path}\n'
+                              f'CER:{cer_file_path}\n'
+                              f'PFX:{pfx_file_path}\n'
+                              f'{e}') from e
+
+    def public_key(self, file_path):
+        with open(file_path, 'rb') as pem_file:
+            pem = pem_file.read()
+        try:
+            if b'PRIVATE KEY' in pem:
+                key = serialization.load_pem_private_key(pem, password=None).public_key()
+            elif b'CERTIFICATE REQUEST' in pem:
+                key = x509.load_pem_x509_csr(pem).public_key()
+            else:
+                key = x509.load_pem_x509_certificate(pem).public_key()
+        except Exception as e:
+            raise CryptoError(f'FAILED TO READ PUBLIC KEY OF {file_path}\n{e}') from e
+        return key.public_bytes(serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo)
+
+    def key_type(self, file_path):
+        with open(file_path, 'rb') as key_file:
+            pem = key_file.read()
+        try:
+            key = serialization.load_pem_private_key(pem, password=None)
+        except Exception as e:
+            raise CryptoError(f'FAILED TO READ KEY {file_path}\n{e}') from e
+        return key_type_of(key.public_key())
+
+
+# GET CONFIGURED CRYPTO BACKEND
+def get_crypto_backend(name: str, openssl_bin_path: str):
+    """
+    Get crypto backend by name, fallback to openssl if cryptography lib is not installed.
+
+    Args:
+        name: str, python or openssl(project_static.crypto_backend)
+        openssl_bin_path: str, full path to OpenSSL binary(for openssl backend)
+
+    Returns:
+        PythonBackend or OpensslBackend object
+    """
+    if name == 'python':
+        if x509 is not None:
+            return PythonBackend()
+        logging.warning('cryptography lib is not installed, falling back to openssl crypto backend')
+    elif name != 'openssl':
+        raise Exception(f'UNKNOWN CRYPTO BACKEND({name}), must be python or openssl')
+    return OpensslBackend(openssl_bin_path)
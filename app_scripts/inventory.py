@@ -0,0 +1,417 @@
+"""
+Certificate inventory of all runs(RESULTS_<date>/<CN>/<CN>.<cer_ext>):
+ - cached index(SQLite) keyed by cert path & mtime: rescan parses new/changed files only, parsing is parallel
+ - indexed queries: expiring within N days, by CN, by template(latest cert per CN)
+ - query result is written as cns_data file(plain/csv/jsonl) for renewal run
+    python3 -m app_scripts.inventory expiring --days 30 --cns-out data_files/cns_renew.jsonl
+"""
+
+import argparse
+import calendar
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from time import gmtime, perf_counter, strftime, time
+
+from project_static import logging
+from app_scripts.crypto_backend import x509, key_type_of
+from app_scripts.structured_log import log_fields, worker_logging
+
+# MS CA CERT TEMPLATE EXTENSIONS: v1 template name(BMPString), v2 template OID
+template_name_oid = '1.3.6.1.4.1.311.20.2'
+template_info_oid = '1.3.6.1.4.1.311.21.7'
+
+# LESS CHANGED CERTS ARE PARSED IN PROCESS(POOL START COSTS MORE)
+parallel_threshold = 64
+
+schema = '''
+CREATE TABLE IF NOT EXISTS certs (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    results_dir TEXT NOT NULL,
+    cn TEXT,
+    sans TEXT,
+    template TEXT,
+    key_type TEXT,
+    serial TEXT,
+    issuer TEXT,
+    not_before REAL,
+    not_after REAL,
+    sha256 TEXT,
+    error TEXT,
+    scanned_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS certs_cn ON certs (cn, not_after);
+CREATE INDEX IF NOT EXISTS certs_not_after ON certs (not_after);
+CREATE INDEX IF NOT EXISTS certs_template ON certs (template, not_after);
+'''
+
+# PARSED CERT FIELDS(certs COLUMNS)
+cert_fields = ('cn', 'sans', 'template', 'key_type', 'serial', 'issuer', 'not_before', 'not_after', 'sha256', 'error')
+
+
+# DER STRING VALUE(BMPString/UTF8String/PrintableString/IA5String)
+def _der_string(data: bytes) -> str:
+    tag, length, offset = data[0], data[1], 2
+    if length & 0x80:
+        offset = 2 + (length & 0x7f)
+        length = int.from_bytes(data[2:offset], 'big')
+    value = data[offset:offset + length]
+    return value.decode('utf-16-be') if tag == 0x1e else value.decode('utf-8')
+
+
+# PARSE CERT BY cryptography LIB
+def _parse_cert_python(data: bytes) -> dict:
+    if b'-----BEGIN' in data:
+        cert = x509.load_pem_x509_certificate(data)
+    else:
+        cert = x509.load_der_x509_certificate(data)
+
+    cns = cert.subject.get_attributes_for_oid(x509.NameOID.COMMON_NAME)
+    try:
+        sans = cert.extensions.get_extension_for_class(x509.SubjectAlternativeName).value.get_values_for_type(
+            x509.DNSName
+        )
+    except x509.ExtensionNotFound:
+        sans = []
+
+    template = None
+    for extension in cert.extensions:
+        oid = extension.oid.dotted_string
+        if oid == template_name_oid:
+            template = _der_string(extension.value.value)
+        elif oid == template_info_oid and template is None:
+            template_id = getattr(extension.value, 'template_id', None)
+            template = template_id.dotted_string if template_id else None
+
+    # not_valid_*_utc: cryptography 42+
+    not_before = getattr(cert, 'not_valid_before_utc', None) or cert.not_valid_before
+    not_after = getattr(cert, 'not_valid_after_utc', None) or cert.not_valid_after
+    return {
+        'cn': str(cns[0].value) if cns else None,
+        'sans': sans,
+        'template': template,
+        'key_type': key_type_of(cert.public_key()),
+        'serial': f'{cert.serial_number:x}',
+        'issuer': cert.issuer.rfc4514_string(),
+        'not_before': calendar.timegm(not_before.utctimetuple()),
+        'not_after': calendar.timegm(not_after.utctimetuple())
+    }
+
+
+# PARSE CERT BY openssl x509(NO TEMPLATE/KEY TYPE)
+def _parse_cert_openssl(data: bytes, openssl_bin_path: str) -> dict:
+    process = subprocess.run(
+        [openssl_bin_path, 'x509', '-noout', '-inform', 'PEM' if b'-----BEGIN' in data else 'DER',
+         '-subject', '-issuer', '-nameopt', 'RFC2253', '-startdate', '-enddate', '-serial', '-ext', 'subjectAltName'],
+        input=data, capture_output=True
+    )
+    if process.returncode != 0:
+        raise Exception(f'openssl x509 exit code {process.returncode}: {process.stderr.decode(errors="replace")}')
+    output = process.stdout.decode(errors='replace')
+    values = dict(line.split('=', 1) for line in output.splitlines() if '=' in line and not line.startswith(' '))
+    found_cn = re.search(r'(?:^|,)CN=((?:\\,|[^,])+)', values.get('subject', ''))
+
+    def timestamp(value):
+        return calendar.timegm(datetime.strptime(value.strip(), '%b %d %H:%M:%S %Y %Z').timetuple())
+
+    return {
+        'cn': found_cn.group(1) if found_cn else None,
+        'sans': re.findall(r'DNS:([^,\s]+)', output),
+        'template': None,
+        'key_type': None,
+        'serial': values.get('serial', '').strip().lower().lstrip('0') or '0',
+        'issuer': values.get('issuer', '').strip(),
+        'not_before': timestamp(values['notBefore']),
+        'not_after': timestamp(values['notAfter'])
+    }
+
+
+# PARSE ONE CERT FILE(PROCESS POOL WORKER, ERRORS ARE RETURNED)
+def parse_cert_file(file_path: str, openssl_bin_path: str = None) -> dict:
+    """
+    Returns:
+        dict, cert_fields(error is set and other fields are None if file is not a cert)
+    """
+    try:
+        with open(file_path, 'rb') as cert_file:
+            data = cert_file.read()
+        if x509 is not None:
+            fields = _parse_cert_python(data)
+        elif openssl_bin_path:
+            fields = _parse_cert_openssl(data, openssl_bin_path)
+        else:
+            raise Exception('NO CERT PARSER: install cryptography lib or set openssl_bin')
+        fields['sha256'] = hashlib.sha256(data).hexdigest()
+        fields['error'] = None
+        return fields
+    except Exception as e:
+        return dict(dict.fromkeys(cert_fields), error=str(e) or repr(e))
+
+
+def _parse_cert_args(args):
+    return parse_cert_file(*args)
+
+
+# FIND CERT FILES: <root>/RESULTS_*/<CN>/<CN>.<cer_ext>
+def find_cert_files(root: str, cer_ext: str):
+    """
+    Yield cert files of all results dirs in root(one scandir per dir, one stat per cert).
+
+    Returns:
+        generator of tuples(path, mtime_ns, size, results_dir)
+    """
+    if not os.path.isdir(root):
+        return
+    with os.scandir(root) as results_entries:
+        results_dirs = [
+            entry.path for entry in results_entries
+            if entry.name.startswith('RESULTS_') and entry.is_dir(follow_symlinks=False)
+        ]
+    for results_dir in results_dirs:
+        with os.scandir(results_dir) as cn_entries:
+            cn_dirs = [(entry.name, entry.path) for entry in cn_entries if entry.is_dir(follow_symlinks=False)]
+        for cn, cn_path in cn_dirs:
+            cert_path = f'{cn_path}/{cn}.{cer_ext}'
+            try:
+                stat = os.stat(cert_path)
+            except OSError:
+                continue
+            yield cert_path, stat.st_mtime_ns, stat.st_size, results_dir
+
+
+# CERT INVENTORY
+class CertInventory:
+    """
+    Cached index of issued certs.
+
+    Usage:
+        inventory = CertInventory(inventory_db, http_templates, inventory_template_oids)
+        inventory.scan([script_dir], cer_ext)
+        rows = inventory.expiring(days=30)
+        write_cn_rows('cns_renew.jsonl', inventory.cn_rows(rows, key_types))
+
+    Args:
+        db_path: str, SQLite file path
+        http_templates: dict, template name -> CA template name(cert v1 template name is shown as template name)
+        template_oids: dict, CA template OID -> template name(v2 templates)
+    """
+    def __init__(self, db_path, http_templates=None, template_oids=None):
+        self.db_path = db_path
+        self._conn = sqlite3.connect(db_path)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(schema)
+        # CA template name/OID -> template name used in cns_data
+        self.template_names = {ca_name: name for name, ca_name in (http_templates or {}).items()}
+        self.template_names.update(template_oids or {})
+
+    def close(self):
+        self._conn.close()
+
+    # RESCAN RESULTS DIRS, PARSE NEW/CHANGED CERTS ONLY
+    def scan(self, roots, cer_ext: str, workers: int = None, openssl_bin_path: str = None) -> dict:
+        """
+        Args:
+            roots: list of dirs with RESULTS_* dirs(project_static.script_dir)
+            cer_ext: str, certificate extension
+            workers: int, parser processes(default: os.cpu_count())
+            openssl_bin_path: str, openssl binary, used if cryptography lib is not installed
+
+        Returns:
+            dict, counters: files, parsed, unchanged, removed, errors, elapsed
+        """
+        start = perf_counter()
+        roots = [os.path.abspath(root) for root in roots]
+        cached = {
+            row['path']: (row['mtime_ns'], row['size'], row['results_dir'])
+            for row in self._conn.execute('SELECT path, mtime_ns, size, results_dir FROM certs')
+        }
+        seen = set()
+        changed = []
+        for root in roots:
+            for path, mtime_ns, size, results_dir in find_cert_files(root, cer_ext):
+                seen.add(path)
+                cached_entry = cached.get(path)
+                if cached_entry is None or cached_entry[:2] != (mtime_ns, size):
+                    changed.append((path, mtime_ns, size, results_dir))
+        removed = [
+            path for path, (_, _, results_dir) in cached.items()
+            if path not in seen and os.path.dirname(results_dir) in roots
+        ]
+
+        args = [(path, openssl_bin_path) for path, *_ in changed]
+        workers = workers or os.cpu_count()
+        executor = None
+        if len(changed) < parallel_threshold or workers == 1:
+            parsed = map(_parse_cert_args, args)
+        else:
+            # parser processes log to the same files(records over multiprocessing queue)
+            init_worker, init_args = worker_logging()
+            executor = ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=init_args)
+            parsed = executor.map(_parse_cert_args, args, chunksize=max(1, len(args) // (workers * 4)))
+
+        now = time()
+        errors = 0
+        records = []
+        try:
+            for (path, mtime_ns, size, results_dir), fields in zip(changed, parsed):
+                if fields['error']:
+                    errors += 1
+                    logging.warning('inventory: %s is not parsed, %s', path, fields['error'],
+                                    extra=log_fields('inventory_parse_failed', error=fields['error']))
+                records.append((
+                    path, mtime_ns, size, results_dir,
+                    *(json.dumps(fields[name]) if name == 'sans' and fields[name] is not None else fields[name]
+                      for name in cert_fields),
+                    now
+                ))
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        with self._conn:
+            self._conn.executemany(
+                f'INSERT OR REPLACE INTO certs (path, mtime_ns, size, results_dir, {", ".join(cert_fields)}, '
+                f'scanned_at) VALUES ({", ".join("?" * (len(cert_fields) + 5))})',
+                records
+            )
+            self._conn.executemany('DELETE FROM certs WHERE path = ?', ((path,) for path in removed))
+
+        stats = {
+            'files': len(seen),
+            'parsed': len(changed),
+            'unchanged': len(seen) - len(changed),
+            'removed': len(removed),
+            'errors': errors,
+            'elapsed': round(perf_counter() - start, 3)
+        }
+        logging.info('inventory scan: %s', stats, extra=log_fields('inventory_scanned'))
+        return stats
+
+    # TEMPLATE NAME(cns_data) OF CA TEMPLATE NAME/OID
+    def template_name(self, template):
+        return self.template_names.get(template, template)
+
+    # QUERIES
+    def _latest(self, where: str = '', params=(), having: str = '', having_params=()):
+        # latest cert per CN: older certs of renewed CNs do not show as expiring
+        return self._conn.execute(
+            'SELECT * FROM (SELECT *, MAX(not_after) FROM certs WHERE error IS NULL '
+            + (f'AND {where} ' if where else '') + 'GROUP BY cn) '
+            + (f'WHERE {having} ' if having else '') + 'ORDER BY not_after',
+            (*params, *having_params)
+        ).fetchall()
+
+    def expiring(self, days: float, now: float = None):
+        """
+        Latest cert of every CN expiring within days(already expired included).
+        """
+        return self._latest(having='not_after <= ?', having_params=((now or time()) + days * 86400,))
+
+    def by_cn(self, cn):
+        """
+        All certs of CN, oldest first.
+        """
+        return self._conn.execute(
+            'SELECT * FROM certs WHERE cn = ? AND error IS NULL ORDER BY not_after', (cn,)
+        ).fetchall()
+
+    def by_template(self, template):
+        """
+        Latest cert of every CN issued by template(cns_data template name, CA template name or OID).
+        """
+        templates = {template} | {ca_name for ca_name, name in self.template_names.items() if name == template}
+        return self._latest(f'template IN ({", ".join("?" * len(templates))})', tuple(templates))
+
+    def latest(self):
+        return self._latest()
+
+    def errors(self):
+        return self._conn.execute('SELECT * FROM certs WHERE error IS NOT NULL ORDER BY path').fetchall()
+
+    # ROWS FOR cns_data(cn_input.write_cn_rows)
+    def cn_rows(self, rows, key_types=None):
+        """
+        Args:
+            rows: query result
+            key_types: allowed key types(crypto_backend.key_types), other key types are not written(default used)
+
+        Returns:
+            generator of dicts: {'cn': ..., 'sans': [...], 'template': ..., 'key_type': ...}
+        """
+        for row in dict((row['cn'], row) for row in rows).values():
+            cn_row = {'cn': row['cn']}
+            sans = json.loads(row['sans']) if row['sans'] else []
+            if sans:
+                cn_row['sans'] = sans
+            if row['template']:
+                cn_row['template'] = self.template_name(row['template'])
+            if row['key_type'] and (key_types is None or row['key_type'] in key_types):
+                cn_row['key_type'] = row['key_type']
+            yield cn_row
+
+
+# CLI: SCAN & QUERIES
+if __name__ == '__main__':
+    from project_static import (
+        setup_logging, logs_dir, appname, start_date, script_dir, cer_ext, openssl_bin, http_templates,
+        inventory_db, inventory_template_oids
+    )
+
+    parser = argparse.ArgumentParser(description='Issued certs inventory of all RESULTS_<date> dirs')
+    parser.add_argument('--db', help='SQLite file(default: project_static.inventory_db)')
+    parser.add_argument('--root', action='append', help='dir with RESULTS_* dirs(default: script dir), repeatable')
+    parser.add_argument('--no-scan', action='store_true', help='query index without rescan')
+    parser.add_argument('--workers', type=int, help='parser processes(default: cpu count)')
+    parser.add_argument('--cns-out', help='write result as cns_data file(.csv/.jsonl keep sans/template/key_type)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('scan', help='rescan results dirs only')
+    expiring_parser = subparsers.add_parser('expiring', help='latest certs expiring within days(expired included)')
+    expiring_parser.add_argument('--days', type=float, default=30)
+    cn_parser = subparsers.add_parser('cn', help='all certs of CN')
+    cn_parser.add_argument('cn')
+    template_parser = subparsers.add_parser('template', help='latest certs by template')
+    template_parser.add_argument('template')
+    subparsers.add_parser('all', help='latest cert of every CN')
+    subparsers.add_parser('errors', help='files which are not parsed')
+    args = parser.parse_args()
+
+    setup_logging(f'{logs_dir}/{appname}_inventory_{start_date}.log')
+    inventory = CertInventory(args.db or inventory_db, http_templates, inventory_template_oids)
+    if not args.no_scan or args.command == 'scan':
+        print(inventory.scan(args.root or [script_dir], cer_ext, args.workers, openssl_bin))
+
+    if args.command == 'errors':
+        for row in inventory.errors():
+            print(f'{row["path"]}\t{row["error"]}')
+    elif args.command != 'scan':
+        if args.command == 'expiring':
+            rows = inventory.expiring(args.days)
+        elif args.command == 'cn':
+            rows = inventory.by_cn(args.cn)
+        elif args.command == 'template':
+            rows = inventory.by_template(args.template)
+        else:
+            rows = inventory.latest()
+        now = time()
+        for row in rows:
+            print('\t'.join(str(value) for value in (
+                row['cn'],
+                strftime('%Y-%m-%d', gmtime(row['not_after'])),
+                f'{(row["not_after"] - now) / 86400:.0f} days',
+                inventory.template_name(row['template']),
+                row['key_type'],
+                row['path']
+            )))
+        if args.cns_out:
+            from app_scripts.crypto_backend import key_types
+            from app_scripts.cn_input import write_cn_rows
+            print(f'{write_cn_rows(args.cns_out, inventory.cn_rows(rows, key_types))} CNs written to {args.cns_out}')
+    inventory.close()
@@ -0,0 +1,465 @@
+"""
+Issuance service(python3 app.py --serve):
+ - one warm pipeline for the whole service life: crypto backend, key pool, CA controller & issuer sessions
+   (browser per issue worker) are started once, single CN costs CA time only
+ - jobs come over local HTTP API(Unix socket 0600 or loopback host:port with bearer token), queued by priority
+   (lower first); requests with other Host than listen address or POST without JSON Content-Type are rejected
+ - POST /jobs {"cn": ..., "sans", "template", "key_type", "pfx_pass", "priority", "force", "wait"}
+   -> 202 {"id": ..., "state": "queued"} or 200 with result if job finished within "wait" seconds
+ - GET /jobs/<id> -> job state, artifacts & error; GET /health -> queue & stage stats
+ - python3 -m app_scripts.issuance_service <cn> [--priority N] [--wait S] - submit CN to running service
+"""
+
+import argparse
+import hmac
+import http.client
+import json
+import os
+import secrets
+import signal
+import socket
+import socketserver
+import uuid
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from queue import PriorityQueue
+from threading import Thread, Lock, Event
+from time import time
+
+from project_static import logging
+from app_scripts.cn_input import dns_name_key, parse_cn_row
+from app_scripts.project_helper import write_file_atomic
+from app_scripts.structured_log import log_fields
+
+# END OF SERVICE QUEUE MARKER(SORTED AFTER ALL JOBS)
+_stop_priority = float('inf')
+
+# JOB FIELDS RETURNED BY API
+job_fields = ('cn', 'cn_path', 'key', 'csr', 'cer', 'pfx', 'ca_request_id', 'ca_endpoint', 'failed_stage')
+
+# LOOPBACK HOSTS API MAY LISTEN ON
+loopback_hosts = ('127.0.0.1', 'localhost', '::1')
+
+
+# SERVICE JOBS: PRIORITY QUEUE -> PIPELINE -> FINISHED JOBS
+class IssuanceService:
+    """
+    Feed API jobs to pipeline running for the whole service life.
+
+    Args:
+        pipeline: pipeline.Pipeline(make_issuance_pipeline with priority_queues=True)
+        plan: callable(row, force) -> pipeline job(i.e. resume.plan_job with row options), called on pipeline feed
+            thread right before job goes to pipeline
+        templates: allowed template names(cn_input.parse_cn_row), optional
+        key_types: allowed key types, optional
+        default_priority: int, priority of jobs without own one(lower is sooner)
+        jobs_kept: int, finished jobs kept for status requests(oldest are dropped)
+        on_finish: callable(job), optional, called for every finished pipeline job(i.e. run report lists)
+    """
+    def __init__(self, pipeline, plan, templates=None, key_types=None, default_priority=100, jobs_kept=10000,
+                 on_finish=None):
+        self.pipeline = pipeline
+        self.plan = plan
+        self.templates = templates
+        self.key_types = key_types
+        self.default_priority = default_priority
+        self.jobs_kept = jobs_kept
+        self.on_finish = on_finish
+        self.started_at = None
+        self._queue = PriorityQueue()
+        self._seq = count()
+        self._jobs = {}
+        self._finished = OrderedDict()
+        self._active_cns = {}
+        self._lock = Lock()
+        self._thread = None
+
+    # QUEUE ONE JOB
+    def submit(self, raw: dict, priority: int = None, force: bool = False) -> str:
+        """
+        Args:
+            raw: dict, "cn" & row options(see cn_input.parse_cn_row)
+            priority: int, lower is sooner(default: default_priority)
+            force: bool, redo all steps even if CN is done in results dir
+
+        Returns:
+            str, job ID, raises ValueError for bad row or CN already queued/in progress
+        """
+        row = parse_cn_row(raw, self.templates, self.key_types)
+        try:
+            priority = self.default_priority if priority is None else int(priority)
+        except (TypeError, ValueError):
+            raise ValueError(f'priority must be integer, not {priority!r}')
+        cn_key = dns_name_key(row['cn'])
+        with self._lock:
+            if cn_key in self._active_cns:
+                # same CN twice in pipeline(in any letter case) would race on the same CA request & files
+                raise ValueError(f'CN {row["cn"]} is already in progress(job {self._active_cns[cn_key]})')
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {
+                'id': job_id,
+                'cn': row['cn'],
+                'state': 'queued',
+                'priority': priority,
+                'submitted_at': time(),
+                'finished': Event()
+            }
+            self._active_cns[cn_key] = job_id
+        self._queue.put((priority, next(self._seq), job_id, row, force))
+        logging.info('service job %s queued: %s, priority %s', job_id, row['cn'], priority,
+                     extra=log_fields('service_job_queued', cn=row['cn']))
+        return job_id
+
+    # JOB STATE FOR API
+    def status(self, job_id: str) -> dict:
+        """
+        Returns:
+            dict, job state(queued/running/done/failed), timestamps, artifacts paths & error, None if job is unknown
+        """
+        with self._lock:
+            entry = self._jobs.get(job_id) or self._finished.get(job_id)
+            if entry is None:
+                return None
+            return {name: value for name, value in entry.items() if name != 'finished'}
+
+    # WAIT FOR JOB TO FINISH
+    def wait(self, job_id: str, timeout: float = None) -> dict:
+        with self._lock:
+            entry = self._jobs.get(job_id) or self._finished.get(job_id)
+        if entry is not None:
+            entry['finished'].wait(timeout)
+        return self.status(job_id)
+
+    # SERVICE COUNTERS
+    def stats(self) -> dict:
+        with self._lock:
+            states = [entry['state'] for entry in self._jobs.values()]
+        return {
+            'uptime': round(time() - self.started_at, 3) if self.started_at else 0,
+            'queued': states.count('queued'),
+            'running': states.count('running'),
+            'finished': len(self._finished),
+            'stages': [stage.stats() for stage in self.pipeline.stages]
+        }
+
+    # PIPELINE FEED: BLOCKS ON SERVICE QUEUE UNTIL STOP
+    def _feed(self):
+        while True:
+            priority, _, job_id, row, force = self._queue.get()
+            if priority == _stop_priority:
+                return
+            try:
+                job = self.plan(row, force)
+            except Exception as e:
+                logging.warning('service job %s(%s): planning failed\n%s', job_id, row['cn'], e,
+                                extra=log_fields('service_job_failed', cn=row['cn'], error=str(e)))
+                # finish listener counts it too(run totals)
+                self._on_pipeline_finish({'cn': row['cn'], 'error': e, 'failed_stage': 'plan',
+                                          'service_job_id': job_id})
+                continue
+            job['service_job_id'] = job_id
+            job['priority'] = priority
+            with self._lock:
+                self._jobs[job_id]['state'] = 'running'
+            yield job
+
+    def _on_pipeline_finish(self, job):
+        if self.on_finish:
+            try:
+                self.on_finish(job)
+            except Exception as e:
+                logging.warning('service: finish listener failed for %s\n%s', job['cn'], e)
+        self._finish(job['service_job_id'], job)
+
+    def _finish(self, job_id, job):
+        with self._lock:
+            entry = self._jobs.pop(job_id)
+            self._active_cns.pop(dns_name_key(entry['cn']), None)
+            entry.update({name: job[name] for name in job_fields if job.get(name) is not None})
+            entry['state'] = 'failed' if job.get('error') else 'done'
+            if job.get('error'):
+                entry['error'] = str(job['error'])
+            entry['finished_at'] = time()
+            self._finished[job_id] = entry
+            while len(self._finished) > self.jobs_kept:
+                self._finished.popitem(last=False)
+        entry['finished'].set()
+        logging.info('service job %s %s: %s in %.3fs', job_id, entry['state'], entry['cn'],
+                     entry['finished_at'] - entry['submitted_at'],
+                     extra=log_fields(f'service_job_{entry["state"]}', cn=entry['cn'],
+                                      duration=round(entry['finished_at'] - entry['submitted_at'], 3),
+                                      error=entry.get('error')))
+
+    def start(self):
+        self.started_at = time()
+        self._thread = Thread(target=self.pipeline.run, args=(self._feed(), self._on_pipeline_finish),
+                              name='service-pipeline', daemon=True)
+        self._thread.start()
+
+    # STOP: QUEUED JOBS ARE DONE FIRST, THEN PIPELINE STAGES STOP
+    def stop(self):
+        self._queue.put((_stop_priority, next(self._seq), None, None, None))
+        if self._thread is not None:
+            self._thread.join()
+
+
+# HTTP API
+class _ApiHandler(BaseHTTPRequestHandler):
+    service = None
+    # Host header values of listen address(DNS rebinding: browser sends attacker's domain)
+    hosts = ()
+    # bearer token(TCP listen), None - no token(Unix socket, file permissions)
+    token = None
+    # max seconds POST /jobs waits for result
+    max_wait = 600
+
+    def _reply(self, code, body):
+        data = json.dumps(body, ensure_ascii=False, default=str).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    # HOST, TOKEN & CONTENT TYPE CHECKS: (code, error) of rejected request or None
+    def _check_request(self, body_expected=False):
+        if self.headers.get('Host') not in self.hosts:
+            return 403, 'Host does not match service address'
+        if self.token is not None:
+            scheme, _, token = (self.headers.get('Authorization') or '').partition(' ')
+            if scheme.lower() != 'bearer' or not hmac.compare_digest(token.strip().encode(), self.token.encode()):
+                return 401, 'bearer token required'
+        content_type = (self.headers.get('Content-Type') or '').split(';')[0].strip().lower()
+        if (body_expected or content_type) and content_type != 'application/json':
+            # text/plain & form "simple" requests of web pages are sent without CORS preflight
+            return 415, 'Content-Type must be application/json'
+        return None
+
+    def do_GET(self):
+        rejected = self._check_request()
+        if rejected:
+            return self._reply(rejected[0], {'error': rejected[1]})
+        if self.path == '/health':
+            return self._reply(200, self.service.stats())
+        if self.path.startswith('/jobs/'):
+            status = self.service.status(self.path[len('/jobs/'):])
+            if status is None:
+                return self._reply(404, {'error': 'unknown job'})
+            return self._reply(200, status)
+        self._reply(404, {'error': 'unknown path'})
+
+    def do_POST(self):
+        rejected = self._check_request(body_expected=True)
+        if rejected:
+            return self._reply(rejected[0], {'error': rejected[1]})
+        if self.path != '/jobs':
+            return self._reply(404, {'error': 'unknown path'})
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+            if not isinstance(body, dict):
+                raise ValueError('request is not JSON object')
+            wait = min(float(body.get('wait') or 0), self.max_wait)
+            if not wait >= 0:
+                raise ValueError(f'wait must be seconds >= 0, not {body.get("wait")!r}')
+            job_id = self.service.submit(body, body.get('priority'), bool(body.get('force')))
+        except (TypeError, ValueError) as e:
+            return self._reply(400, {'error': str(e)})
+        status = self.service.wait(job_id, wait) if wait else self.service.status(job_id)
+        self._reply(200 if status['state'] in ('done', 'failed') else 202, status)
+
+    def address_string(self):
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        logging.debug('service api %s: %s', self.address_string(), format % args)
+
+
+class _UnixHttpServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ('unix', 0)
+
+
+# BEARER TOKEN OF TCP API
+def read_service_token(token_file: str, create: bool = False) -> str:
+    """
+    Args:
+        token_file: str, token file(project_static.service_token_file), must be 0600
+        create: bool, make file with random token if it does not exist(service side)
+
+    Returns:
+        str, token, raises Exception if file is missing, empty or readable by group/others
+    """
+    if not token_file:
+        raise Exception('SERVICE TOKEN FILE IS NOT SET, TCP API NEEDS BEARER TOKEN')
+    if not os.path.isfile(token_file):
+        if not create:
+            raise Exception(f'SERVICE TOKEN FILE {token_file} NOT FOUND, START SERVICE FIRST')
+        write_file_atomic(token_file, secrets.token_urlsafe(32), 0o600)
+        logging.info('service: token file %s created', token_file, extra=log_fields('service_token_created'))
+    if os.stat(token_file).st_mode & 0o077:
+        raise Exception(f'SERVICE TOKEN FILE {token_file} MUST BE 0600(chmod 600 {token_file})')
+    with open(token_file, 'r', encoding='utf-8') as file:
+        token = file.read().strip()
+    if not token:
+        raise Exception(f'SERVICE TOKEN FILE {token_file} IS EMPTY')
+    return token
+
+
+# API SERVER ON UNIX SOCKET OR LOOPBACK HOST:PORT
+def make_api_server(service: IssuanceService, listen: str, token_file: str = None):
+    """
+    Args:
+        service: IssuanceService
+        listen: str, "unix:<socket path>"(socket file gets 0600) or "host:port"(loopback host only)
+        token_file: str, bearer token file for host:port(created with random token if not exists)
+
+    Returns:
+        socketserver server, serve_forever() to run
+    """
+    if listen.startswith('unix:'):
+        socket_path = listen[len('unix:'):]
+        handler = type('ApiHandler', (_ApiHandler,), {'service': service, 'hosts': ('localhost',)})
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        # socket file is 0600 from bind on, not after chmod
+        umask = os.umask(0o177)
+        try:
+            server = _UnixHttpServer(socket_path, handler)
+        finally:
+            os.umask(umask)
+        os.chmod(socket_path, 0o600)
+        return server
+    host, _, port = listen.rpartition(':')
+    host = host.strip('[]')
+    if host not in loopback_hosts:
+        raise Exception(f'SERVICE API MUST LISTEN ON LOOPBACK HOST OR UNIX SOCKET, NOT {listen}')
+    hosts = (f'[{host}]:{port}' if ':' in host else f'{host}:{port}',)
+    if int(port) == 80:
+        hosts += (f'[{host}]' if ':' in host else host,)
+    handler = type('ApiHandler', (_ApiHandler,), {
+        'service': service, 'hosts': hosts, 'token': read_service_token(token_file, create=True)
+    })
+    server_class = ThreadingHTTPServer
+    if ':' in host:
+        server_class = type('ThreadingHTTPServer6', (ThreadingHTTPServer,), {'address_family': socket.AF_INET6})
+    return server_class((host, int(port)), handler)
+
+
+# RUN SERVICE UNTIL SIGTERM/CTRL+C
+def run_service(service: IssuanceService, listen: str, token_file: str = None):
+    """
+    Start service pipeline & API, serve until SIGTERM/SIGINT, then finish queued jobs and stop.
+
+    Args:
+        service: IssuanceService
+        listen: str, see make_api_server
+        token_file: str, see make_api_server
+
+    Returns:
+        None
+    """
+    server = make_api_server(service, listen, token_file)
+    service.start()
+
+    def shutdown(signum, frame):
+        logging.info('service: signal %s, stopping', signum, extra=log_fields('service_stopping'))
+        Thread(target=server.shutdown, daemon=True).start()
+    previous = signal.signal(signal.SIGTERM, shutdown)
+
+    logging.info('service: listening on %s', listen, extra=log_fields('service_started'))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logging.info('service: interrupted, stopping')
+    finally:
+        signal.signal(signal.SIGTERM, previous)
+        server.server_close()
+        if listen.startswith('unix:') and os.path.exists(listen[len('unix:'):]):
+            os.remove(listen[len('unix:'):])
+        service.stop()
+        logging.info('service: stopped, %s jobs finished', service.stats()['finished'],
+                     extra=log_fields('service_stopped'))
+
+
+# API CLIENT CONNECTION
+class _UnixConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def api_request(listen: str, method: str, path: str, body: dict = None, timeout: float = None,
+                token: str = None) -> tuple:
+    """
+    Args:
+        listen: str, service address(project_static.service_listen)
+        method: str, GET or POST
+        path: str, API path(/jobs, /jobs/<id>, /health)
+        body: dict, JSON body for POST
+        timeout: float, socket timeout, seconds
+        token: str, bearer token(read_service_token), needed for host:port address
+
+    Returns:
+        tuple(int status code, dict response)
+    """
+    if listen.startswith('unix:'):
+        connection = _UnixConnection(listen[len('unix:'):], timeout)
+    else:
+        host, _, port = listen.rpartition(':')
+        connection = http.client.HTTPConnection(host.strip('[]'), int(port), timeout=timeout)
+    try:
+        data = json.dumps(body).encode() if body is not None else None
+        headers = {'Content-Type': 'application/json'} if data else {}
+        if token:
+            headers['Authorization'] = f'Bearer {token}'
+        connection.request(method, path, data, headers)
+        response = connection.getresponse()
+        return response.status, json.loads(response.read() or b'{}')
+    finally:
+        connection.close()
+
+
+# SUBMIT CN TO RUNNING SERVICE
+if __name__ == '__main__':
+    from project_static import service_listen, service_token_file
+
+    parser = argparse.ArgumentParser(description='Submit CN to running issuance service(python3 app.py --serve)')
+    parser.add_argument('cn', nargs='?', help='CN to issue cert for(none: show service health)')
+    parser.add_argument('--sans', help='SANs, separated by ";"')
+    parser.add_argument('--template', help='template name')
+    parser.add_argument('--key-type', help='key type')
+    parser.add_argument('--priority', type=int, help='lower is sooner(service default if not set)')
+    parser.add_argument('--force', action='store_true', help='redo all steps even if CN is done')
+    parser.add_argument('--wait', type=float, default=0, help='seconds to wait for result(0 - return job ID)')
+    parser.add_argument('--job', help='show state of job ID')
+    parser.add_argument('--listen', default=service_listen, help='service address')
+    parser.add_argument('--token-file', default=service_token_file, help='bearer token file(host:port address)')
+    args = parser.parse_args()
+
+    token = None if args.listen.startswith('unix:') else read_service_token(args.token_file)
+
+    if args.job:
+        status_code, result = api_request(args.listen, 'GET', f'/jobs/{args.job}', token=token)
+    elif args.cn:
+        request = {
+            'cn': args.cn, 'sans': args.sans, 'template': args.template, 'key_type': args.key_type,
+            'priority': args.priority, 'force': args.force, 'wait': args.wait
+        }
+        status_code, result = api_request(
+            args.listen, 'POST', '/jobs', {name: value for name, value in request.items() if value is not None},
+            timeout=args.wait + 30 if args.wait else 30, token=token
+        )
+    else:
+        status_code, result = api_request(args.listen, 'GET', '/health', token=token)
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    if status_code >= 400 or result.get('state') == 'failed':
+        raise SystemExit(1)
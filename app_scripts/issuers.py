@@ -0,0 +1,290 @@
+"""
+Pluggable issuer backends(CA submission step of staged/batch/async modes):
+ - playwright: MS certsrv web enrollment in browser(app_functions.create_cert)
+ - http: MS certsrv over pooled requests.Session(certsrv_http.create_cert_http)
+ - local: file-based local CA(in-process cryptography), template -> extensions mapping,
+   for load tests & offline issuance without production CA
+
+Issuer interface:
+ - name
+ - worker_context() -> context manager, entered once per issuing worker thread, its value is state
+   (BrowserSession for playwright, None for others)
+ - issue(endpoint, job, state=None) -> cert path, endpoint - ca_controller.CaEndpoint(url/credentials/http_session,
+   issuer defaults for missing ones), job - dict with cn, csr, cn_path, template(optional), csr_pem(optional,
+   submitted instead of csr file content); CA request ID, step timings & cert PEM(cer_pem) are saved to job
+"""
+
+import os
+from contextlib import nullcontext
+from datetime import datetime, timedelta, timezone
+from threading import Lock
+from time import perf_counter
+
+from app_scripts.crypto_backend import x509, PythonBackend, sign_hash, write_key_file
+from app_scripts.app_functions import read_csr_body, save_cert
+from app_scripts.ca_controller import CaRequestError
+from app_scripts.project_helper import write_file_atomic
+
+
+# MS CA CERTSRV IN BROWSER
+class PlaywrightIssuer:
+    """
+    Args:
+        url: str, default url of PKI server
+        user: str, default username to auth on PKI server
+        password: str, default password to auth on PKI server
+        template: str, default template name
+        cer_ext: str, certificate extension
+        form_cache: certsrv_form.FormCache, optional
+        templates: dict, template name -> form option label(project_static.browser_templates)
+        on_browser_start: callable(duration), optional, called after every browser(re)start(i.e. run metrics)
+    """
+    name = 'playwright'
+
+    def __init__(self, url, user, password, template, cer_ext, form_cache=None, templates=None,
+                 on_browser_start=None):
+        self.url = url
+        self.user = user
+        self.password = password
+        self.template = template
+        self.cer_ext = cer_ext
+        self.form_cache = form_cache
+        self.templates = templates
+        self.on_browser_start = on_browser_start
+
+    # sync Playwright objects are bound to their thread: one browser session per worker
+    def worker_context(self):
+        from app_scripts.browser_session import BrowserSession
+
+        return BrowserSession(self.user, self.password, on_start=self.on_browser_start)
+
+    def issue(self, endpoint, job, state=None):
+        from app_scripts.app_functions import create_cert
+
+        with state.page(endpoint.user, endpoint.password) as page:
+            return create_cert(
+                endpoint.url or self.url, endpoint.user or self.user, endpoint.password or self.password, job['csr'],
+                job.get('template', self.template), job['cn'], self.cer_ext, job['cn_path'], page, job,
+                self.form_cache, self.templates
+            )
+
+
+# MS CA CERTSRV OVER HTTP
+class HttpIssuer:
+    """
+    Args:
+        url: str, default url of PKI server
+        template: str, default template name
+        cer_ext: str, certificate extension
+        http_session: requests.Session(certsrv_http.make_certsrv_session), default for endpoints without own session
+        templates: dict, template name -> CA template name(project_static.http_templates)
+    """
+    name = 'http'
+
+    def __init__(self, url, template, cer_ext, http_session=None, templates=None):
+        self.url = url
+        self.template = template
+        self.cer_ext = cer_ext
+        self.http_session = http_session
+        self.templates = templates
+
+    def worker_context(self):
+        return nullcontext()
+
+    def issue(self, endpoint, job, state=None):
+        from app_scripts.certsrv_http import create_cert_http
+
+        return create_cert_http(
+            endpoint.url or self.url, job['csr'], job.get('template', self.template), job['cn'], self.cer_ext,
+            job['cn_path'], endpoint.http_session or self.http_session, self.templates, job
+        )
+
+
+# DER BMPString(MS CA V1 TEMPLATE NAME EXTENSION VALUE)
+def _der_bmp_string(value: str) -> bytes:
+    data = value.encode('utf-16-be')
+    if len(data) < 0x80:
+        return bytes((0x1e, len(data))) + data
+    length = len(data).to_bytes((len(data).bit_length() + 7) // 8, 'big')
+    return bytes((0x1e, 0x80 | len(length))) + length + data
+
+
+# KeyUsage FLAGS(x509.KeyUsage ARGS)
+key_usage_names = (
+    'digital_signature', 'content_commitment', 'key_encipherment', 'data_encipherment', 'key_agreement',
+    'key_cert_sign', 'crl_sign', 'encipher_only', 'decipher_only'
+)
+
+
+# LOCAL FILE-BASED CA
+class LocalCaIssuer:
+    """
+    Local CA in ca_dir: ca.key(0600) & ca.crt are made on first use, certs are signed in-process.
+    Cert gets CSR subject & SANs, KeyUsage/ExtendedKeyUsage/validity of template profile and
+    MS v1 template name extension(cert inventory shows template as for MS CA certs).
+
+    Args:
+        ca_dir: str, CA dir(created with 0700 if not exists)
+        template: str, default template name
+        cer_ext: str, certificate extension
+        templates: dict, template name -> profile dict(project_static.local_ca_templates):
+            key_usage: KeyUsage flag names, extended_key_usage: ExtendedKeyUsageOID names(lower case),
+            days: cert validity, ca_template: CA template name for template name extension(default: template name)
+        ca_key_type: str, CA key type(crypto_backend.key_types)
+        ca_name: str, CA subject CN
+        ca_days: int, CA cert validity
+    """
+    name = 'local'
+
+    def __init__(self, ca_dir, template, cer_ext, templates, ca_key_type='ecdsa-p256', ca_name='Local issuing CA',
+                 ca_days=3650):
+        if x509 is None:
+            raise Exception('LOCAL CA ISSUER NEEDS cryptography LIB, pip install cryptography')
+        self.ca_dir = ca_dir
+        self.template = template
+        self.cer_ext = cer_ext
+        self.templates = templates
+        self.ca_key_type = ca_key_type
+        self.ca_name = ca_name
+        self.ca_days = ca_days
+        self._ca = None
+        self._lock = Lock()
+
+    def worker_context(self):
+        return nullcontext()
+
+    # LOAD OR MAKE CA KEY & CERT
+    def _load_ca(self):
+        from cryptography.hazmat.primitives import serialization
+
+        with self._lock:
+            if self._ca is not None:
+                return self._ca
+            key_file = f'{self.ca_dir}/ca.key'
+            cert_file = f'{self.ca_dir}/ca.crt'
+            if os.path.isfile(key_file) and os.path.isfile(cert_file):
+                with open(key_file, 'rb') as file:
+                    key = serialization.load_pem_private_key(file.read(), password=None)
+                with open(cert_file, 'rb') as file:
+                    cert = x509.load_pem_x509_certificate(file.read())
+            else:
+                os.makedirs(self.ca_dir, mode=0o700, exist_ok=True)
+                key_pem = PythonBackend().generate_key(self.ca_key_type)
+                key = serialization.load_pem_private_key(key_pem, password=None)
+                name = x509.Name([x509.NameAttribute(x509.NameOID.COMMON_NAME, self.ca_name)])
+                now = datetime.now(timezone.utc)
+                cert = (
+                    x509.CertificateBuilder()
+                    .subject_name(name)
+                    .issuer_name(name)
+                    .public_key(key.public_key())
+                    .serial_number(x509.random_serial_number())
+                    .not_valid_before(now - timedelta(minutes=5))
+                    .not_valid_after(now + timedelta(days=self.ca_days))
+                    .add_extension(x509.BasicConstraints(ca=True, path_length=0), critical=True)
+                    .add_extension(x509.KeyUsage(**{
+                        flag: flag in ('key_cert_sign', 'crl_sign') for flag in key_usage_names
+                    }), critical=True)
+                    .add_extension(x509.SubjectKeyIdentifier.from_public_key(key.public_key()), critical=False)
+                    .sign(key, sign_hash(key))
+                )
+                write_key_file(key_file, key_pem)
+                write_file_atomic(cert_file, cert.public_bytes(serialization.Encoding.PEM))
+            self._ca = (key, cert)
+            return self._ca
+
+    def issue(self, endpoint, job, state=None):
+        from cryptography.hazmat.primitives import serialization
+        from app_scripts.inventory import template_name_oid
+
+        start = perf_counter()
+        template = job.get('template', self.template)
+        if template not in self.templates:
+            raise Exception(f'TEMPLATE NOT IN LIST, CHECK TEMPLATE TYPE({template})')
+        profile = self.templates[template]
+        ca_key, ca_cert = self._load_ca()
+
+        csr = x509.load_pem_x509_csr(read_csr_body(job['csr'], job).encode())
+        if not csr.is_signature_valid:
+            raise Exception(f'CSR SIGNATURE IS NOT VALID({job["csr"]})')
+
+        now = datetime.now(timezone.utc)
+        builder = (
+            x509.CertificateBuilder()
+            .subject_name(csr.subject)
+            .issuer_name(ca_cert.subject)
+            .public_key(csr.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(now - timedelta(minutes=5))
+            .not_valid_after(now + timedelta(days=profile.get('days', 365)))
+            .add_extension(x509.BasicConstraints(ca=False, path_length=None), critical=True)
+            .add_extension(x509.SubjectKeyIdentifier.from_public_key(csr.public_key()), critical=False)
+            .add_extension(x509.AuthorityKeyIdentifier.from_issuer_public_key(ca_key.public_key()), critical=False)
+            .add_extension(x509.UnrecognizedExtension(
+                x509.ObjectIdentifier(template_name_oid), _der_bmp_string(profile.get('ca_template', template))
+            ), critical=False)
+        )
+        try:
+            sans = csr.extensions.get_extension_for_class(x509.SubjectAlternativeName)
+            builder = builder.add_extension(sans.value, critical=False)
+        except x509.ExtensionNotFound:
+            pass
+        if profile.get('key_usage'):
+            builder = builder.add_extension(x509.KeyUsage(**{
+                flag: flag in profile['key_usage'] for flag in key_usage_names
+            }), critical=True)
+        if profile.get('extended_key_usage'):
+            builder = builder.add_extension(x509.ExtendedKeyUsage([
+                getattr(x509.oid.ExtendedKeyUsageOID, usage.upper()) for usage in profile['extended_key_usage']
+            ]), critical=False)
+        cert = builder.sign(ca_key, sign_hash(ca_key))
+
+        cert_pem = cert.public_bytes(serialization.Encoding.PEM)
+        job['ca_request_id'] = f'{cert.serial_number:x}'
+        try:
+            cert_path = save_cert(cert_pem, job['cn'], self.cer_ext, job['cn_path'], job)
+        except OSError as e:
+            raise CaRequestError(f'CERT FOR {job["cn"]} ISSUED(serial {job["ca_request_id"]}), BUT NOT SAVED\n{e}',
+                                 'issued', job['ca_request_id']) from e
+        job['step_timings'] = {'issue': perf_counter() - start}
+        return cert_path
+
+
+# GET ISSUER BY ENGINE NAME
+def get_issuer(
+        engine: str,
+        url: str = None,
+        user: str = None,
+        password: str = None,
+        template: str = None,
+        cer_ext: str = 'crt',
+        http_session=None,
+        http_templates: dict = None,
+        form_cache=None,
+        browser_templates: dict = None,
+        on_browser_start=None,
+        local_ca_dir: str = None,
+        local_ca_templates: dict = None,
+        local_ca_key_type: str = 'ecdsa-p256'
+):
+    """
+    Args:
+        engine: str, playwright, http or local(project_static.issuer_engine)
+        url, user, password: PKI server defaults(playwright/http)
+        template: str, default template name
+        cer_ext: str, certificate extension
+        http_session, http_templates: see HttpIssuer
+        form_cache, browser_templates, on_browser_start: see PlaywrightIssuer
+        local_ca_dir, local_ca_templates, local_ca_key_type: see LocalCaIssuer
+
+    Returns:
+        PlaywrightIssuer, HttpIssuer or LocalCaIssuer object
+    """
+    if engine == 'http':
+        return HttpIssuer(url, template, cer_ext, http_session, http_templates)
+    if engine == 'playwright':
+        return PlaywrightIssuer(url, user, password, template, cer_ext, form_cache, browser_templates,
+                                on_browser_start)
+    if engine == 'local':
+        return LocalCaIssuer(local_ca_dir, template, cer_ext, local_ca_templates, local_ca_key_type)
+    raise Exception(f'UNKNOWN ISSUER ENGINE({engine}), must be playwright, http or local')
@@ -0,0 +1,237 @@
+"""
+Persistent job-state store(SQLite, WAL mode):
+ - one row per CN per results dir: state, failed stage, artifact paths & sha256, CA request ID & endpoint
+ - one row per stage run: status, start time, duration, error
+ - indexed queries, i.e. all CNs failed at CA stage this week:
+    python3 -m app_scripts.job_store failed --stage issue --days 7
+"""
+
+import argparse
+import hashlib
+import os
+import sqlite3
+from threading import Lock
+from time import time
+
+# CN STATES: new -> keygen -> issue -> pfx(done) or failed
+state_after_stage = {
+    'keygen': 'keygen',
+    'issue': 'issue',
+    'pfx': 'done'
+}
+
+# JOB ARTIFACTS: job key -> (path column, sha256 column)
+artifacts = {
+    'key': ('key_path', 'key_sha256'),
+    'csr': ('csr_path', 'csr_sha256'),
+    'cer': ('cer_path', 'cer_sha256'),
+    'pfx': ('pfx_path', 'pfx_sha256')
+}
+
+schema = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    results_dir TEXT NOT NULL,
+    cn TEXT NOT NULL,
+    run_id TEXT,
+    state TEXT NOT NULL DEFAULT 'new',
+    failed_stage TEXT,
+    error TEXT,
+    key_path TEXT, key_sha256 TEXT,
+    csr_path TEXT, csr_sha256 TEXT,
+    cer_path TEXT, cer_sha256 TEXT,
+    pfx_path TEXT, pfx_sha256 TEXT,
+    ca_request_id TEXT,
+    ca_endpoint TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    UNIQUE (results_dir, cn)
+);
+CREATE INDEX IF NOT EXISTS jobs_cn ON jobs (cn);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, updated_at);
+CREATE INDEX IF NOT EXISTS jobs_failed ON jobs (failed_stage, updated_at);
+CREATE TABLE IF NOT EXISTS job_stages (
+    job_id INTEGER NOT NULL REFERENCES jobs (id),
+    run_id TEXT,
+    stage TEXT NOT NULL,
+    status TEXT NOT NULL,
+    started_at REAL NOT NULL,
+    duration REAL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS job_stages_job ON job_stages (job_id);
+CREATE INDEX IF NOT EXISTS job_stages_stage ON job_stages (stage, status, started_at);
+'''
+
+
+# FILE SHA256
+def file_sha256(file_path: str) -> str:
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(65536), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+# JOB STORE
+class JobStore:
+    """
+    SQLite job-state store, shared by all pipeline threads(writes are serialized by lock).
+    WAL mode: queries from other processes do not block the running pipeline.
+
+    Args:
+        db_path: str, SQLite file path
+        run_id: str, current run ID(i.e. run start date&time)
+    """
+    def __init__(self, db_path, run_id=None):
+        self.db_path = db_path
+        self.run_id = run_id
+        self._lock = Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(schema)
+        # stores made before CA endpoints support
+        if 'ca_endpoint' not in {row['name'] for row in self._conn.execute('PRAGMA table_info(jobs)')}:
+            self._conn.execute('ALTER TABLE jobs ADD COLUMN ca_endpoint TEXT')
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # GET CN JOB ROW
+    def get(self, results_dir, cn):
+        with self._lock:
+            return self._conn.execute(
+                'SELECT * FROM jobs WHERE results_dir = ? AND cn = ?', (results_dir, cn)
+            ).fetchone()
+
+    # CREATE/RESET CN JOB ROW
+    def start_job(self, results_dir, cn, reset=False):
+        """
+        Make job row for CN(if not exists), reset its state if reset=True(--force).
+
+        Returns:
+            int, job ID
+        """
+        now = time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT INTO jobs (results_dir, cn, run_id, created_at, updated_at) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (results_dir, cn) DO UPDATE SET run_id = excluded.run_id',
+                (results_dir, cn, self.run_id, now, now)
+            )
+            if reset:
+                self._conn.execute(
+                    "UPDATE jobs SET state = 'new', failed_stage = NULL, error = NULL, ca_request_id = NULL, "
+                    "ca_endpoint = NULL, "
+                    + ', '.join(f'{path_col} = NULL, {sha_col} = NULL' for path_col, sha_col in artifacts.values())
+                    + ', updated_at = ? WHERE results_dir = ? AND cn = ?',
+                    (now, results_dir, cn)
+                )
+            return self._conn.execute(
+                'SELECT id FROM jobs WHERE results_dir = ? AND cn = ?', (results_dir, cn)
+            ).fetchone()[0]
+
+    # RECORD STAGE RESULT
+    def record_stage(self, job, stage, started_at, duration, error=None):
+        """
+        Save stage run and move CN job to next state(or failed).
+        Artifact paths are taken from job dict, sha256 is counted for existing files.
+
+        Args:
+            job: dict, pipeline job(must have "job_id")
+            stage: str, keygen/issue/pfx
+            started_at: float, stage start timestamp
+            duration: float, stage duration, seconds
+            error: Exception or None
+        """
+        now = time()
+        columns = {'updated_at': now}
+        if error is None:
+            columns.update(state=state_after_stage[stage], failed_stage=None, error=None)
+            for name, (path_col, sha_col) in artifacts.items():
+                if job.get(name) and os.path.isfile(job[name]):
+                    columns[path_col] = job[name]
+                    columns[sha_col] = file_sha256(job[name])
+            if job.get('ca_request_id'):
+                columns['ca_request_id'] = job['ca_request_id']
+            if job.get('ca_endpoint'):
+                columns['ca_endpoint'] = job['ca_endpoint']
+        else:
+            columns.update(state='failed', failed_stage=stage, error=str(error))
+
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT INTO job_stages (job_id, run_id, stage, status, started_at, duration, error) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (job['job_id'], self.run_id, stage, 'failed' if error else 'done', started_at, duration,
+                 str(error) if error else None)
+            )
+            self._conn.execute(
+                f'UPDATE jobs SET {", ".join(f"{col} = ?" for col in columns)} WHERE id = ?',
+                (*columns.values(), job['job_id'])
+            )
+
+    # QUERIES
+    def failed(self, stage=None, since=0):
+        """
+        CNs failed(at stage if set) since timestamp.
+        """
+        query = "SELECT * FROM jobs WHERE state = 'failed' AND updated_at >= ?"
+        params = [since]
+        if stage:
+            query += ' AND failed_stage = ?'
+            params.append(stage)
+        with self._lock:
+            return self._conn.execute(query + ' ORDER BY updated_at', params).fetchall()
+
+    def by_cn(self, cn):
+        with self._lock:
+            return self._conn.execute('SELECT * FROM jobs WHERE cn = ? ORDER BY updated_at', (cn,)).fetchall()
+
+    def stage_timings(self, run_id=None):
+        """
+        Count/avg/max duration of done stages(for run_id if set).
+        """
+        query = "SELECT stage, COUNT(*) AS count, AVG(duration) AS avg, MAX(duration) AS max " \
+                "FROM job_stages WHERE status = 'done'"
+        params = []
+        if run_id:
+            query += ' AND run_id = ?'
+            params.append(run_id)
+        with self._lock:
+            return self._conn.execute(query + ' GROUP BY stage', params).fetchall()
+
+
+# CLI FOR QUERIES
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Query job-state store')
+    parser.add_argument('--db', help='SQLite file(default: project_static.job_store_db)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    failed_parser = subparsers.add_parser('failed', help='CNs failed in last days')
+    failed_parser.add_argument('--stage', choices=tuple(state_after_stage), help='failed stage')
+    failed_parser.add_argument('--days', type=float, default=7)
+    cn_parser = subparsers.add_parser('cn', help='all jobs of CN')
+    cn_parser.add_argument('cn')
+    subparsers.add_parser('timings', help='stage timings')
+    args = parser.parse_args()
+
+    if not args.db:
+        from project_static import job_store_db
+        args.db = job_store_db
+    store = JobStore(args.db)
+
+    if args.command == 'failed':
+        rows = store.failed(args.stage, time() - args.days * 86400)
+    elif args.command == 'cn':
+        rows = store.by_cn(args.cn)
+    else:
+        rows = store.stage_timings()
+    for row in rows:
+        print('\t'.join(str(row[col]) for col in row.keys() if col in (
+            'cn', 'results_dir', 'state', 'failed_stage', 'error', 'ca_request_id', 'ca_endpoint', 'stage', 'count',
+            'avg', 'max'
+        )))
+    store.close()
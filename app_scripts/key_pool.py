@@ -0,0 +1,157 @@
+"""
+Pre-generated private keys pool(spool dir) for burst issuance:
+ - keep <size> keys(0600, dir 0700) in spool dir
+ - refill in background thread or from cron: python3 -m app_scripts.key_pool
+ - take key atomically(rename), each key is used only once
+ - keys of one type per pool fill(project_static.key_type), key type is in file name: <id>.<key type>.key
+"""
+
+import os
+import uuid
+from threading import Thread, Event
+
+from project_static import logging
+from app_scripts.structured_log import log_fields
+from app_scripts.crypto_backend import default_key_type
+
+# POOL FILES
+key_suffix = '.key'
+tmp_suffix = '.tmp'
+claimed_suffix = '.claimed'
+# pool files without key type in name(made before key types): RSA 2048
+legacy_key_type = 'rsa2048'
+
+
+# KEY TYPE OF POOL FILE NAME
+def pool_key_type(name: str) -> str:
+    stem = name[:-len(key_suffix)]
+    return stem.split('.', 1)[1] if '.' in stem else legacy_key_type
+
+
+# KEY POOL(SPOOL DIR)
+class KeyPool:
+    """
+    Spool dir with ready to use private keys.
+    Safe for several threads/processes: key is claimed by os.rename, only one caller wins.
+
+    Args:
+        pool_dir: str, spool dir path(created with 0700 if not exists)
+        size: int, keys to keep in pool
+        backend: crypto backend(crypto_backend.get_crypto_backend), used to generate keys
+        low_water: int, background refill starts when pool has less keys(default: size // 2)
+        key_type: str, type of keys pool is filled with(crypto_backend.key_types)
+    """
+    def __init__(self, pool_dir, size, backend, low_water=None, key_type=default_key_type):
+        self.pool_dir = pool_dir
+        self.size = size
+        self.backend = backend
+        self.key_type = key_type
+        self.low_water = size // 2 if low_water is None else low_water
+        self._need_refill = Event()
+        self._stop = Event()
+        self._thread = None
+        os.makedirs(pool_dir, mode=0o700, exist_ok=True)
+        os.chmod(pool_dir, 0o700)
+
+    def _ready_keys(self, key_type=None):
+        key_type = key_type or self.key_type
+        with os.scandir(self.pool_dir) as entries:
+            return [
+                entry.name for entry in entries
+                if entry.name.endswith(key_suffix) and pool_key_type(entry.name) == key_type
+            ]
+
+    def count(self, key_type=None):
+        return len(self._ready_keys(key_type))
+
+    # TAKE ONE KEY
+    def take(self, key_type=None):
+        """
+        Claim one key of key_type(default: pool key type) and remove it from pool.
+
+        Returns:
+            PEM key bytes or None if pool has no key of key_type
+        """
+        for name in self._ready_keys(key_type):
+            key_path = f'{self.pool_dir}/{name}'
+            claimed_path = f'{key_path}{claimed_suffix}.{os.getpid()}.{uuid.uuid4().hex}'
+            try:
+                os.rename(key_path, claimed_path)
+            except FileNotFoundError:
+                # already taken by other thread/process
+                continue
+            try:
+                with open(claimed_path, 'rb') as key_file:
+                    key_pem = key_file.read()
+            finally:
+                os.remove(claimed_path)
+            if self._thread is not None and self.count() < self.low_water:
+                self._need_refill.set()
+            return key_pem
+        if self._thread is not None and (key_type or self.key_type) == self.key_type:
+            self._need_refill.set()
+        return None
+
+    # ADD ONE KEY
+    def _add_key(self):
+        name = f'{uuid.uuid4().hex}.{self.key_type}'
+        tmp_path = f'{self.pool_dir}/{name}{tmp_suffix}'
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'wb') as key_file:
+            key_file.write(self.backend.generate_key(self.key_type))
+        # key becomes visible for take() only when fully written
+        os.rename(tmp_path, f'{self.pool_dir}/{name}{key_suffix}')
+
+    # FILL POOL UP TO SIZE
+    def fill(self):
+        """
+        Generate keys until pool has <size> keys(or stop() is called).
+
+        Returns:
+            int, keys generated
+        """
+        added = 0
+        missing = self.size - self.count()
+        while added < missing and not self._stop.is_set():
+            self._add_key()
+            added += 1
+        if added:
+            logging.info('key pool %s: %s %s keys generated', self.pool_dir, added, self.key_type,
+                         extra=log_fields('key_pool_refilled'))
+        return added
+
+    def _refill_loop(self):
+        while not self._stop.is_set():
+            try:
+                self.fill()
+            except Exception as e:
+                logging.warning('key pool %s: refill failed\n%s', self.pool_dir, e,
+                                extra=log_fields('key_pool_refill_failed', error=str(e)))
+            self._need_refill.wait()
+            self._need_refill.clear()
+
+    # BACKGROUND REFILL
+    def start_refill(self):
+        if self._thread is None:
+            self._thread = Thread(target=self._refill_loop, name='key-pool-refill', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._need_refill.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+# CRON ENTRY POINT: FILL POOL FROM project_static SETTINGS
+if __name__ == '__main__':
+    from project_static import (
+        setup_logging, logs_dir, appname, start_date, key_pool_dir, key_pool_size, crypto_backend, openssl_bin,
+        key_type
+    )
+    from app_scripts.crypto_backend import get_crypto_backend
+
+    setup_logging(f'{logs_dir}/{appname}_key_pool_{start_date}.log')
+    pool = KeyPool(key_pool_dir, key_pool_size, get_crypto_backend(crypto_backend, openssl_bin), key_type=key_type)
+    pool.fill()
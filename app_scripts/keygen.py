@@ -0,0 +1,158 @@
+"""
+Parallel keygen stage:
+ - make <CN> dir in results dir
+ - make <CN>.key & <CN>.csr for the whole CNs list on a thread pool
+ - in-process(python) backend: new keys optionally on a process pool(keygen on all cores whatever GIL does)
+ - renewal: copy key(and CSR) of previous run instead of making new key
+ - key & CSR are written once(temp file + rename) and kept in memory for issue & pfx steps(artifacts)
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import contextmanager, nullcontext
+from time import perf_counter, time
+
+from project_static import logging
+from app_scripts.crypto_backend import write_key_file, default_key_type
+from app_scripts.structured_log import log_fields, worker_logging
+from app_scripts.project_helper import write_file_atomic
+
+
+# NEW KEYS ON PROCESS POOL(IN-PROCESS BACKEND ONLY, OPENSSL BACKEND FORKS OPENSSL PER KEY ANYWAY)
+@contextmanager
+def key_processes(backend, workers: int = None):
+    """
+    Process pool for new keys of in-process backend, closed on exit.
+
+    :param backend: crypto backend(crypto_backend.get_crypto_backend)
+    :param workers: int, processes(default: os.cpu_count())
+    :return: key maker: callable(key_type) -> PEM key bytes made in pool process,
+        None for openssl backend(keys are made by make_csr as before)
+    """
+    if backend.name != 'python':
+        yield None
+        return
+    init_worker, init_args = worker_logging()
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=init_worker,
+                             initargs=init_args) as executor:
+        yield lambda key_type: executor.submit(backend.generate_key, key_type).result()
+
+
+# MAKE CN DIR AND CSR&KEY FOR ONE CN
+def make_cn_csr(backend, cn: str, results_dir: str, key_pool=None, reuse_key: bool = False, sans: list = None,
+                renew_from: str = None, renew_csr: bool = False, key_type: str = default_key_type,
+                artifacts: dict = None, key_maker=None) -> str:
+    """
+    Make <results_dir>/<cn> dir(if not exists) and CSR&KEY files inside it.
+    Key is copied from previous run(renew_from), reused(reuse_key), taken from key pool if pool is set
+    and not empty, made by key_maker if set, generated by backend otherwise.
+
+    :param backend: crypto backend(crypto_backend.get_crypto_backend)
+    :param cn: CN(common name), str
+    :param results_dir: results dir of the run, str
+    :param key_pool: key_pool.KeyPool, optional
+    :param reuse_key: bool, make CSR with existing <cn>.key(resume: key is valid, CSR is missing)
+    :param sans: list of DNS names for subjectAltName, optional
+    :param renew_from: CN dir of previous run to copy <cn>.key from(resume.plan_renewal), optional
+    :param renew_csr: bool, copy <cn>.csr from renew_from too(CSR is made with copied key otherwise)
+    :param key_type: str, type of new key(crypto_backend.key_types), pool key is taken only if of this type
+    :param artifacts: dict, optional(i.e. pipeline job), filled with key_pem & csr_pem bytes
+    :param key_maker: callable(key_type) -> PEM key bytes for new key(key_processes), optional
+    :return: str, CN dir path
+    """
+    cn_path = f'{results_dir}/{cn}'
+    try:
+        os.mkdir(cn_path)
+    except FileExistsError:
+        logging.info('%s alreade exists, moving on', cn_path, extra=log_fields('cn_dir_exists', cn=cn, stage='keygen'))
+    except Exception as e:
+        raise Exception(f'failed to create dir {cn_path}:\n\t{e}')
+
+    key_pem = None
+    if renew_from:
+        with open(f'{renew_from}/{cn}.key', 'rb') as key_file:
+            key_pem = key_file.read()
+        if renew_csr:
+            with open(f'{renew_from}/{cn}.csr', 'rb') as csr_file:
+                csr_pem = csr_file.read()
+            write_key_file(f'{cn_path}/{cn}.key', key_pem)
+            write_file_atomic(f'{cn_path}/{cn}.csr', csr_pem)
+            if artifacts is not None:
+                artifacts.update(key_pem=key_pem, csr_pem=csr_pem)
+            return cn_path
+    elif reuse_key:
+        with open(f'{cn_path}/{cn}.key', 'rb') as key_file:
+            key_pem = key_file.read()
+    elif key_pool:
+        key_pem = key_pool.take(key_type)
+    if key_pem is None and key_maker is not None:
+        key_pem = key_maker(key_type)
+    key_pem, csr_pem = backend.make_csr(cn, cn_path, cn_path, key_pem=key_pem, sans=sans, key_type=key_type)
+    if artifacts is not None:
+        artifacts.update(key_pem=key_pem, csr_pem=csr_pem)
+    return cn_path
+
+
+# MAKE CSR&KEY FOR ALL CNS IN PARALLEL
+def make_csrs_parallel(backend, cns: list, results_dir: str, workers: int = None, key_pool=None,
+                       reuse_keys=(), sans: dict = None, timings: dict = None, renew: dict = None,
+                       key_type: str = default_key_type, cn_key_types: dict = None, artifacts: dict = None,
+                       processes: bool = False):
+    """
+    Run make_cn_csr for every CN on thread pool.
+    openssl backend forks openssl per CN, so keygen uses all cores. python backend makes keys in-process:
+    threads scale only as far as cryptography releases GIL during keygen, with processes new keys are made
+    on process pool of the same size(key_processes).
+
+    :param backend: crypto backend(crypto_backend.get_crypto_backend)
+    :param cns: list of CNs
+    :param results_dir: results dir of the run, str
+    :param workers: int, worker count(default: os.cpu_count())
+    :param key_pool: key_pool.KeyPool, optional
+    :param reuse_keys: CNs to make CSR for with existing key
+    :param sans: dict, CN -> list of SANs, optional
+    :param timings: dict, optional, filled with cn -> (start timestamp, duration) for done & failed CNs
+    :param renew: dict, CN -> (CN dir of previous run, bool copy CSR) for CNs renewed with previous key, optional
+    :param key_type: str, type of new keys(crypto_backend.key_types)
+    :param cn_key_types: dict, CN -> key type for CNs with own key type(cns_data key_type option), optional
+    :param artifacts: dict, CN -> dict to fill with key_pem & csr_pem(i.e. CN jobs), optional
+    :param processes: bool, new keys of python backend on process pool
+    :return: tuple(dict cn -> cn_path for done CNs, dict cn -> error for failed CNs)
+    """
+    done = {}
+    failed = {}
+
+    def timed_cn_csr(cn, *args, **kwargs):
+        started_at = time()
+        start = perf_counter()
+        try:
+            return make_cn_csr(backend, cn, *args, key_maker=key_maker, **kwargs)
+        finally:
+            if timings is not None:
+                timings[cn] = (started_at, perf_counter() - start)
+
+    workers = workers or os.cpu_count()
+    key_context = key_processes(backend, workers) if processes else nullcontext()
+    with key_context as key_maker, ThreadPoolExecutor(max_workers=workers) as executor:
+        # dict.fromkeys: same CN twice would race on the same files
+        futures = {
+            executor.submit(
+                timed_cn_csr, cn, results_dir, key_pool, cn in reuse_keys, (sans or {}).get(cn),
+                *(renew or {}).get(cn, ()), key_type=(cn_key_types or {}).get(cn, key_type),
+                artifacts=(artifacts or {}).get(cn)
+            ): cn for cn in dict.fromkeys(cns)
+        }
+        for future in as_completed(futures):
+            cn = futures[future]
+            try:
+                done[cn] = future.result()
+            except Exception as e:
+                logging.warning('failed to make csr&key for %s:\n\t%s\nskipping this cn', cn, e,
+                                extra=log_fields('stage_failed', cn=cn, stage='keygen', error=str(e)))
+                failed[cn] = e
+            else:
+                duration = timings[cn][1] if timings is not None and cn in timings else None
+                logging.info('Finished to make csr & key files for %s', cn, extra=log_fields(
+                    'stage_done', cn=cn, stage='keygen', duration=round(duration, 3) if duration is not None else None
+                ))
+    return done, failed
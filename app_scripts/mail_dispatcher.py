@@ -0,0 +1,258 @@
+"""
+Queued e-mail(smtp) delivery for reports and per-CN notifications:
+ - one SMTP connection(STARTTLS + login once) kept alive between messages, closed when idle
+ - messages are queued and sent by background thread, senders(pipeline workers) never wait for SMTP
+ - per-recipient digests: CN notifications are collected and sent as one mail every digest_interval
+ - reconnect on dropped connection, flush of digests & queue at close/exit
+"""
+
+import atexit
+from datetime import datetime
+from email.message import EmailMessage
+from queue import Queue, Empty, Full
+from smtplib import SMTP, SMTPServerDisconnected, SMTPResponseException
+from ssl import create_default_context
+from threading import Thread, Lock, Event
+from time import monotonic
+
+from project_static import logging
+from app_scripts.structured_log import log_fields
+
+# END OF QUEUE MARKER
+STOP = object()
+
+# SMTP REPLY CODES MEANING "CONNECTION IS GONE, RECONNECT"
+reconnect_codes = (421,)
+
+
+# QUEUED SMTP SENDER
+class MailDispatcher:
+    """
+    Background SMTP sender with one long-lived connection.
+
+    Usage:
+        with MailDispatcher(smtp_server, smtp_port, smtp_from_addr, smtp_login, smtp_pass) as mailer:
+            mailer.notify(mail_list_users, f'{cn}: cert issued')
+            mailer.send(mail_list_admins, 'subject', 'body')
+
+    Args:
+        smtp_server: str, server ip/name
+        smtp_port: int/str, server's port
+        mail_from: str, mail from field
+        login: str, login(STARTTLS + auth if login & password are set, same as send_mail)
+        password: str, password
+        appname: str, digest mail subject prefix
+        digest_interval: float, seconds between per-recipient digest mails(0 - only at close)
+        queue_size: int, max queued messages, new messages are dropped(with warning) when queue is full
+        idle_timeout: float, seconds without messages before SMTP connection is closed
+        timeout: float, SMTP socket timeout, seconds
+    """
+    def __init__(self, smtp_server, smtp_port, mail_from, login=None, password=None, appname='',
+                 digest_interval=300, queue_size=1000, idle_timeout=60, timeout=30):
+        self.smtp_server = smtp_server
+        self.smtp_port = smtp_port
+        self.mail_from = mail_from
+        self.login = login
+        self.password = password
+        self.appname = appname
+        self.digest_interval = digest_interval
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.connects = 0
+        self._queue = Queue(maxsize=queue_size)
+        self._digests = {}
+        self._digests_lock = Lock()
+        self._smtp = None
+        self._last_used = 0
+        self._last_digest = monotonic()
+        self._closed = Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def start(self):
+        self._thread = Thread(target=self._run, name='mail-dispatcher', daemon=True)
+        self._thread.start()
+        # queued mails are not lost if caller forgets close()
+        atexit.register(self.close)
+
+    # QUEUE ONE MAIL
+    def send(self, mail_to, subject: str, body: str, subtype: str = 'plain') -> bool:
+        """
+        Queue mail, never blocks.
+
+        Args:
+            mail_to: list or tuple(for several emails) or str for single address
+            subject: str, mail subject
+            body: str, mail body
+            subtype: str, plain or html
+
+        Returns:
+            bool, False if queue is full(mail dropped) or dispatcher is closed
+        """
+        if self._closed.is_set():
+            logging.warning('mail dispatcher is closed, mail "%s" dropped', subject, extra=log_fields('mail_dropped'))
+            return False
+        message = EmailMessage()
+        message.set_content(body, subtype=subtype)
+        message['From'] = self.mail_from
+        message['Subject'] = subject
+        message['To'] = ', '.join(mail_to) if isinstance(mail_to, (list, tuple)) else mail_to
+        try:
+            self._queue.put_nowait((message, mail_to))
+        except Full:
+            self.dropped += 1
+            logging.warning('mail queue is full, mail "%s" dropped', subject, extra=log_fields('mail_dropped'))
+            return False
+        return True
+
+    # ADD LINE TO PER-RECIPIENT DIGEST
+    def notify(self, mail_to, line: str):
+        """
+        Add notification line to digest of each recipient, digests are sent every digest_interval.
+
+        Args:
+            mail_to: list or tuple(for several emails) or str for single address
+            line: str, notification text(i.e. "<cn>: certificate issued")
+        """
+        recipients = mail_to if isinstance(mail_to, (list, tuple)) else [mail_to]
+        with self._digests_lock:
+            for recipient in recipients:
+                self._digests.setdefault(recipient, []).append(line)
+
+    def flush_digests(self):
+        with self._digests_lock:
+            digests, self._digests = self._digests, {}
+            self._last_digest = monotonic()
+        for recipient, lines in digests.items():
+            self.send(
+                recipient,
+                f'{self.appname} - {len(lines)} notifications({datetime.now():%d-%m-%Y %H:%M})',
+                '\n'.join(lines) + '\n'
+            )
+
+    # FLUSH DIGESTS, SEND QUEUED MAILS, CLOSE CONNECTION
+    def close(self, timeout: float = 60):
+        if self._closed.is_set() or self._thread is None:
+            return
+        self.flush_digests()
+        self._closed.set()
+        self._queue.put(STOP)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logging.warning('mail dispatcher: %s mails not sent in %ss', self._queue.qsize(), timeout,
+                            extra=log_fields('mail_not_sent'))
+        logging.info('mail dispatcher closed: sent %s, failed %s, dropped %s, smtp connections %s',
+                     self.sent, self.failed, self.dropped, self.connects, extra=log_fields('mail_dispatcher_closed'))
+
+    # SMTP CONNECTION
+    def _connect(self):
+        smtp = SMTP(self.smtp_server, self.smtp_port, timeout=self.timeout)
+        try:
+            if self.login and self.password:
+                smtp.starttls(context=create_default_context())
+                smtp.login(self.login, self.password)
+        except Exception:
+            smtp.close()
+            raise
+        self._smtp = smtp
+        self.connects += 1
+
+    def _disconnect(self):
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except Exception:
+            self._smtp.close()
+        self._smtp = None
+
+    def _deliver(self, message, mail_to):
+        # second try on fresh connection if relay dropped the kept one
+        for attempt in (1, 2):
+            try:
+                if self._smtp is None:
+                    self._connect()
+                self._smtp.send_message(message, self.mail_from, mail_to)
+                return
+            except (SMTPServerDisconnected, ConnectionError, TimeoutError) as e:
+                error = e
+            except SMTPResponseException as e:
+                if e.smtp_code not in reconnect_codes:
+                    raise
+                error = e
+            self._disconnect()
+            if attempt == 2:
+                raise error
+            logging.info('smtp connection lost(%s), reconnecting', error,
+                         extra=log_fields('smtp_reconnect', error=str(error)))
+
+    # BACKGROUND SENDER
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=1)
+            except Empty:
+                item = None
+
+            if item is STOP:
+                # senders may still have queued mails before STOP
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except Empty:
+                        break
+                    if item is not STOP:
+                        self._send_item(item)
+                break
+
+            if item is not None:
+                self._send_item(item)
+            elif self._smtp is not None and monotonic() - self._last_used > self.idle_timeout:
+                self._disconnect()
+
+            if self.digest_interval and monotonic() - self._last_digest > self.digest_interval:
+                self.flush_digests()
+        self._disconnect()
+
+    def _send_item(self, item):
+        message, mail_to = item
+        try:
+            self._deliver(message, mail_to)
+        except Exception as e:
+            self.failed += 1
+            logging.warning('FAILED: sending mail "%s" to %s\n%s', message['Subject'], mail_to, e,
+                            extra=log_fields('mail_failed', error=str(e)))
+        else:
+            self.sent += 1
+        self._last_used = monotonic()
+
+
+# PIPELINE LISTENER: PER-CN NOTIFICATIONS
+def cn_notifier(dispatcher: MailDispatcher, mail_to):
+    """
+    Stage listener(see pipeline.Pipeline) adding per-CN lines to recipients digests:
+    CN done(pfx stage) or failed(any stage).
+
+    Args:
+        dispatcher: MailDispatcher
+        mail_to: list or tuple(for several emails) or str for single address
+
+    Returns:
+        callable(job, stage, started_at, duration, error)
+    """
+    def listener(job, stage, started_at, duration, error):
+        if error is not None:
+            reason = str(error).splitlines()[0] if str(error) else repr(error)
+            dispatcher.notify(mail_to, f'{job["cn"]}: FAILED at {stage}: {reason}')
+        elif stage == 'pfx':
+            dispatcher.notify(mail_to, f'{job["cn"]}: certificate issued, pfx ready: {job.get("pfx", "")}')
+    return listener
@@ -0,0 +1,256 @@
+"""
+Local stand-in for MS CA Web Enrollment(certsrv) pages, for benchmarks & offline runs:
+ - home page with "Request a certificate" link
+ - "Submit a certificate request..." link
+ - request form: #locTaRequest textarea, #lbCertTemplateID select, #btnSubmit
+ - certfnsh.asp: signs CSR by throwaway local CA, "Certificate Issued" page(browser & http engine)
+ - certnew.cer: base64 cert download
+ - configurable CA latency(+jitter), error(denied) rate and unavailable(HTTP 503) rate
+"""
+
+import datetime
+import html
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+from project_static import browser_templates
+from app_scripts.certsrv_form import submit_link_name
+
+
+# THROWAWAY LOCAL CA
+class LocalCA:
+    """
+    Self-signed EC P-256 CA in memory, signs CSRs for <days> days.
+    """
+    def __init__(self, name='Mock certsrv CA', days=30):
+        self.days = days
+        self.key = ec.generate_private_key(ec.SECP256R1())
+        self.name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, name)])
+        now = datetime.datetime.now(datetime.timezone.utc)
+        self.cert = (
+            x509.CertificateBuilder()
+            .subject_name(self.name)
+            .issuer_name(self.name)
+            .public_key(self.key.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(now)
+            .not_valid_after(now + datetime.timedelta(days=days))
+            .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+            .sign(self.key, hashes.SHA256())
+        )
+
+    def sign(self, csr_pem: bytes) -> bytes:
+        csr = x509.load_pem_x509_csr(csr_pem)
+        now = datetime.datetime.now(datetime.timezone.utc)
+        builder = (
+            x509.CertificateBuilder()
+            .subject_name(csr.subject)
+            .issuer_name(self.name)
+            .public_key(csr.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(now)
+            .not_valid_after(now + datetime.timedelta(days=self.days))
+        )
+        for extension in csr.extensions:
+            builder = builder.add_extension(extension.value, extension.critical)
+        return builder.sign(self.key, hashes.SHA256()).public_bytes(serialization.Encoding.PEM)
+
+
+# CERTSRV PAGES
+home_page = '''<html><body><h2>Microsoft Active Directory Certificate Services</h2>
+<a href="certrqus.asp">Request a certificate</a></body></html>'''
+
+request_page = f'''<html><body><a href="certrqxt.asp">{html.escape(submit_link_name)}</a></body></html>'''
+
+issued_page = '''<html><body><span id="locPageTitle">Certificate Issued</span>
+<input type="radio" id="rbDerEnc" name="rbEncoding" checked> DER encoded
+<input type="radio" id="rbB64Enc" name="rbEncoding"> Base 64 encoded
+<a id="locDownloadCert3" href="certnew.cer?ReqID={req_id}&amp;Enc=b64" download="certnew.cer">Download certificate</a>
+</body></html>'''
+
+denied_page = '''<html><body><span id="locPageTitle">Certificate Request Denied</span>
+The disposition message is "{message}"</body></html>'''
+
+
+def form_page():
+    options = '\n'.join(
+        f'<option value="{html.escape(label)}">{html.escape(label)}</option>'
+        for label in dict.fromkeys(browser_templates.values())
+    )
+    return f'''<html><body><form method="post" action="certfnsh.asp">
+<textarea id="locTaRequest" name="CertRequest"></textarea>
+<select id="lbCertTemplateID" name="lbCertTemplate">{options}</select>
+<input type="hidden" name="Mode" value="newreq">
+<input type="submit" id="btnSubmit" value="Submit">
+</form></body></html>'''
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # client gone before answer(timeout checks): not a server error
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+
+# MOCK CERTSRV SERVER
+class MockCertsrv:
+    """
+    Threaded local certsrv stand-in.
+
+    Usage:
+        with MockCertsrv(latency=0.05) as mock:
+            pki_url = mock.url
+
+    Args:
+        latency: float, CA issuing delay per request, seconds
+        jitter: float, random extra delay 0..jitter, seconds
+        error_rate: float, 0..1, share of requests denied by CA
+        user: str, optional, basic auth user(password is not checked)
+        unavailable_rate: float, 0..1, share of submissions answered with HTTP 503(transient CA overload)
+    """
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, user=None, host='127.0.0.1', port=0,
+                 unavailable_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.unavailable_rate = unavailable_rate
+        self.user = user
+        self.ca = LocalCA()
+        self.issued = {}
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = _Server((host, port), self._handler())
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/certsrv/'
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='mock-certsrv', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def issue(self, csr_pem: bytes) -> str:
+        """
+        Sign CSR after configured latency.
+
+        Returns:
+            str, request ID, raises Exception if CA "denies" request(error_rate)
+        """
+        time.sleep(self.latency + random.uniform(0, self.jitter))
+        if self.error_rate and random.random() < self.error_rate:
+            raise Exception('Denied by Policy Module(mock error rate)')
+        cert_pem = self.ca.sign(csr_pem)
+        with self._lock:
+            self.requests += 1
+            req_id = str(self.requests)
+            self.issued[req_id] = cert_pem
+        return req_id
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _send(self, body, content_type='text/html', headers=None, status=200):
+                data = body if isinstance(body, bytes) else body.encode()
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _authorized(self):
+                if mock.user is None or self.headers.get('Authorization'):
+                    return True
+                self._send('', headers={'WWW-Authenticate': 'Basic realm="certsrv"'}, status=401)
+                return False
+
+            def do_GET(self):
+                if not self._authorized():
+                    return
+                parsed = urlparse(self.path)
+                page = parsed.path.rstrip('/').rsplit('/', 1)[-1]
+                if page in ('certsrv', ''):
+                    self._send(home_page)
+                elif page == 'certrqus.asp':
+                    self._send(request_page)
+                elif page == 'certrqxt.asp':
+                    self._send(form_page())
+                elif page == 'certnew.cer':
+                    req_id = parse_qs(parsed.query).get('ReqID', [''])[0]
+                    cert_pem = mock.issued.get(req_id)
+                    if cert_pem is None:
+                        self._send('unknown ReqID', status=404)
+                        return
+                    self._send(cert_pem, 'application/pkix-cert',
+                               {'Content-Disposition': 'attachment; filename="certnew.cer"'})
+                else:
+                    self._send('not found', status=404)
+
+            def do_POST(self):
+                if not self._authorized():
+                    return
+                if mock.unavailable_rate and random.random() < mock.unavailable_rate:
+                    self._send('Service Unavailable', status=503)
+                    return
+                form = parse_qs(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode())
+                csr_body = form.get('CertRequest', [''])[0]
+                try:
+                    req_id = mock.issue(csr_body.encode())
+                except Exception as e:
+                    self._send(denied_page.format(message=html.escape(str(e))))
+                    return
+                self._send(issued_page.format(req_id=req_id))
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+# RUN STANDALONE: python3 -m app_scripts.mock_certsrv --port 8080 --latency 0.2
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Local stand-in for MS certsrv')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--unavailable-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = MockCertsrv(args.latency, args.jitter, args.error_rate, port=args.port,
+                         unavailable_rate=args.unavailable_rate)
+    print(f'mock certsrv at {server.url}')
+    server.start()
+    try:
+        server._thread.join()
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,108 @@
+"""
+Local SMTP stand-in for offline runs & mail dispatcher checks:
+ - EHLO/HELO, MAIL, RCPT, DATA, RSET, NOOP, QUIT(no TLS, no auth)
+ - received mails are kept in memory
+ - connection count & optional connection drop after N mails(reconnect check)
+"""
+
+import threading
+from socketserver import StreamRequestHandler, ThreadingTCPServer
+
+
+# MOCK SMTP SERVER
+class MockSmtp:
+    """
+    Threaded local SMTP stand-in.
+
+    Usage:
+        with MockSmtp() as smtp:
+            MailDispatcher(smtp.host, smtp.port, 'from@example.test')
+
+    Args:
+        drop_after: int, close client connection after every N mails(0 - never)
+    """
+    def __init__(self, host='127.0.0.1', port=0, drop_after=0):
+        self.drop_after = drop_after
+        self.messages = []
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingTCPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def host(self):
+        return self._server.server_address[0]
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='mock-smtp', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler(self):
+        mock = self
+
+        class Handler(StreamRequestHandler):
+            def reply(self, line):
+                self.wfile.write(f'{line}\r\n'.encode())
+
+            def handle(self):
+                with mock._lock:
+                    mock.connections += 1
+                received = 0
+                mail_from, rcpt_to = None, []
+                self.reply('220 mock-smtp ready')
+                for raw in self.rfile:
+                    command = raw.decode('utf-8', 'replace').rstrip('\r\n')
+                    verb = command[:4].upper()
+                    if verb == 'EHLO':
+                        self.reply('250-mock-smtp')
+                        self.reply('250 8BITMIME')
+                    elif verb == 'HELO':
+                        self.reply('250 mock-smtp')
+                    elif verb == 'MAIL':
+                        mail_from, rcpt_to = command.split(':', 1)[1].strip(), []
+                        self.reply('250 OK')
+                    elif verb == 'RCPT':
+                        rcpt_to.append(command.split(':', 1)[1].strip())
+                        self.reply('250 OK')
+                    elif verb == 'DATA':
+                        self.reply('354 End data with <CR><LF>.<CR><LF>')
+                        lines = []
+                        for data_line in self.rfile:
+                            if data_line in (b'.\r\n', b'.\n'):
+                                break
+                            lines.append(data_line[1:] if data_line.startswith(b'..') else data_line)
+                        with mock._lock:
+                            mock.messages.append((mail_from, rcpt_to, b''.join(lines).decode('utf-8', 'replace')))
+                        received += 1
+                        self.reply('250 OK queued')
+                        if mock.drop_after and received >= mock.drop_after:
+                            # drop without 221, like relay closing idle/long connection
+                            return
+                    elif verb == 'RSET':
+                        mail_from, rcpt_to = None, []
+                        self.reply('250 OK')
+                    elif verb == 'NOOP':
+                        self.reply('250 OK')
+                    elif verb == 'QUIT':
+                        self.reply('221 Bye')
+                        return
+                    else:
+                        self.reply('502 Command not implemented')
+
+        return Handler
@@ -0,0 +1,369 @@
+"""
+Staged producer/consumer pipeline:
+ - stages connected by bounded queues, each stage with own worker threads
+ - keygen, CA submission and PFX packaging overlap for different CNs
+ - queue depth & throughput report for every stage
+ - optional priority queues: job with lower "priority" is taken first(issuance service)
+"""
+
+from contextlib import nullcontext
+from itertools import count
+from queue import Queue, PriorityQueue
+from threading import Thread, Lock, Event
+from time import perf_counter, time
+
+from project_static import logging
+from app_scripts.structured_log import log_fields, ca_log
+
+# END OF STAGE INPUT MARKER
+STOP = object()
+
+
+# ONE PIPELINE STAGE
+class Stage:
+    """
+    Stage of pipeline: <workers> threads take jobs from own bounded queue,
+    run func on each and put successful jobs to the next stage queue.
+
+    func(job) or func(job, state) if worker_context is set.
+    Job is dict, func changes it in place; job failed if func raises.
+    Job with stage name in job["skip"](already done, see resume.plan_job) is passed to the next stage as is.
+
+    Args:
+        name: str, stage name for logs/report
+        func: callable, stage work for one job
+        workers: int, worker threads count
+        queue_size: int, max jobs waiting in stage queue(backpressure for previous stage)
+        worker_context: callable, returns context manager, entered once per worker,
+            its value is passed to func as state(i.e. BrowserSession per worker thread)
+        logger: logger for job failures(i.e. structured_log.ca_log for CA submission stage), default: root
+        priority: bool, stage queue is ordered by job "priority"(lower first, default 0), FIFO within same priority
+    """
+    def __init__(self, name, func, workers=1, queue_size=100, worker_context=None, logger=None, priority=False):
+        self.name = name
+        self.func = func
+        self.logger = logger or logging.getLogger()
+        self.workers = workers
+        self.worker_context = worker_context
+        self.priority = priority
+        self.queue = PriorityQueue(maxsize=queue_size) if priority else Queue(maxsize=queue_size)
+        self._seq = count()
+        self.next = None
+        self.done = 0
+        self.failed = 0
+        self.skipped = 0
+        self.max_depth = 0
+        self.first_ts = None
+        self.last_ts = None
+        self.listeners = []
+        self._lock = Lock()
+        self._threads = []
+
+    def put(self, job):
+        # STOP goes after all jobs of priority queue
+        if self.priority:
+            job = (float('inf') if job is STOP else job.get('priority', 0), next(self._seq), job)
+        self.queue.put(job)
+        with self._lock:
+            self.max_depth = max(self.max_depth, self.queue.qsize())
+
+    def start(self, on_finish):
+        for num in range(self.workers):
+            thread = Thread(target=self._worker, args=(on_finish,), name=f'{self.name}-{num}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        for _ in self._threads:
+            self.put(STOP)
+        for thread in self._threads:
+            thread.join()
+
+    def _worker(self, on_finish):
+        worker_error = None
+        try:
+            context = self.worker_context() if self.worker_context else nullcontext()
+            state = context.__enter__()
+        except Exception as e:
+            # worker still drains its share of queue, so previous stage never blocks
+            logging.error('%s: worker setup failed\n%s', self.name, e,
+                          extra=log_fields('worker_setup_failed', stage=self.name, error=str(e)))
+            context, state, worker_error = None, None, e
+
+        try:
+            while True:
+                job = self.queue.get()
+                if self.priority:
+                    job = job[2]
+                if job is STOP:
+                    break
+                if self.name in job.get('skip', ()):
+                    with self._lock:
+                        self.skipped += 1
+                    if self.next:
+                        self.next.put(job)
+                    else:
+                        on_finish(job)
+                    continue
+                with self._lock:
+                    if self.first_ts is None:
+                        self.first_ts = perf_counter()
+                started_at = time()
+                start = perf_counter()
+                error = None
+                try:
+                    if worker_error:
+                        raise worker_error
+                    if self.worker_context:
+                        self.func(job, state)
+                    else:
+                        self.func(job)
+                except BaseException as e:
+                    error = e
+                    if not isinstance(e, Exception):
+                        # SystemExit & co out of func: worker state is unknown, rest of its share fails fast
+                        worker_error = e
+                finished = perf_counter()
+                with self._lock:
+                    if error is None:
+                        self.done += 1
+                    else:
+                        self.failed += 1
+                    self.last_ts = max(self.last_ts or finished, finished)
+                duration = finished - start
+                # job always goes on(next stage or finished), even if logging/listeners fail:
+                # Pipeline.run & service waiters are never left waiting for it
+                try:
+                    if error is None:
+                        logging.info('DONE: %s for %s in %.3fs', self.name, job['cn'], duration,
+                                     extra=log_fields('stage_done', cn=job['cn'], stage=self.name,
+                                                      duration=round(duration, 3), endpoint=job.get('ca_endpoint')))
+                    else:
+                        job['error'] = error
+                        job['failed_stage'] = self.name
+                        self.logger.warning(
+                            'FAILED: %s for %s, \n%s, \nskipping\n', self.name, job['cn'], error,
+                            extra=log_fields('stage_failed', cn=job['cn'], stage=self.name,
+                                             duration=round(duration, 3), endpoint=job.get('ca_endpoint'),
+                                             error=str(error))
+                        )
+                    self._notify(job, started_at, duration, error)
+                finally:
+                    if error is None and self.next:
+                        self.next.put(job)
+                    else:
+                        on_finish(job)
+        finally:
+            if context is not None:
+                context.__exit__(None, None, None)
+
+    # TELL LISTENERS(JOB STORE, METRICS) ABOUT STAGE RESULT
+    def _notify(self, job, started_at, duration, error):
+        for listener in self.listeners:
+            try:
+                listener(job, self.name, started_at, duration, error)
+            except Exception as e:
+                logging.warning('%s: stage listener failed for %s\n%s', self.name, job['cn'], e,
+                                extra=log_fields('listener_failed', cn=job['cn'], stage=self.name, error=str(e)))
+
+    # STAGE COUNTERS
+    def stats(self):
+        elapsed = (self.last_ts - self.first_ts) if self.first_ts and self.last_ts else 0
+        return {
+            'stage': self.name,
+            'workers': self.workers,
+            'queue_depth': self.queue.qsize(),
+            'max_queue_depth': self.max_depth,
+            'done': self.done,
+            'failed': self.failed,
+            'skipped': self.skipped,
+            'elapsed': round(elapsed, 3),
+            'throughput': round(self.done / elapsed, 3) if elapsed else 0
+        }
+
+
+# PIPELINE OF STAGES
+class Pipeline:
+    """
+    Chain stages and run all jobs through them.
+
+    Args:
+        stages: list of Stage, in order
+        report_interval: float, seconds between queue depth/throughput log lines(0 - off)
+        listeners: list of callables(job, stage_name, started_at, duration, error),
+            called after every job done/failed by every stage(i.e. JobStore.record_stage)
+    """
+    def __init__(self, stages, report_interval=10, listeners=()):
+        self.stages = stages
+        self.report_interval = report_interval
+        for stage, next_stage in zip(stages, stages[1:]):
+            stage.next = next_stage
+        for stage in stages:
+            stage.listeners = list(listeners)
+        self.results = []
+        self._results_lock = Lock()
+
+    def _on_finish(self, job):
+        with self._results_lock:
+            self.results.append(job)
+
+    def _monitor(self, finished):
+        while not finished.wait(self.report_interval):
+            self.log_stats()
+
+    def log_stats(self):
+        for stats in (stage.stats() for stage in self.stages):
+            logging.info('PIPELINE %s: queue %s(max %s), done %s, failed %s, skipped %s, %s jobs/s',
+                         stats['stage'], stats['queue_depth'], stats['max_queue_depth'], stats['done'],
+                         stats['failed'], stats['skipped'], stats['throughput'],
+                         extra=log_fields('stage_stats', stage=stats['stage']))
+
+    def run(self, jobs, on_finish=None):
+        """
+        Feed jobs(iterable of dicts with "cn" key) to the first stage, wait for all stages.
+        Feeding blocks while first stage queue is full.
+
+        Args:
+            jobs: iterable of job dicts(may block waiting for next job, i.e. issuance service queue)
+            on_finish: callable(job), optional, called for every finished job instead of collecting it to results
+
+        Returns:
+            list of finished jobs(failed ones have "error" & "failed_stage" keys), empty if on_finish is set
+        """
+        for stage in self.stages:
+            stage.start(on_finish or self._on_finish)
+
+        finished = Event()
+        if self.report_interval:
+            Thread(target=self._monitor, args=(finished,), daemon=True).start()
+
+        try:
+            for job in jobs:
+                self.stages[0].put(job)
+        finally:
+            # stop stages in order: each stage gets STOP only after previous one fed it everything
+            # (also when feed fails: jobs already fed are finished, workers & their sessions are closed)
+            for stage in self.stages:
+                stage.stop()
+            finished.set()
+        self.log_stats()
+        return self.results
+
+
+# CERT ISSUANCE PIPELINE: KEYGEN -> CA -> PFX
+def make_issuance_pipeline(
+        backend,
+        results_dir: str,
+        engine: str,
+        url: str,
+        user: str,
+        password: str,
+        template: str,
+        cer_ext: str,
+        pfx_pass: str,
+        keygen_workers: int,
+        issuer_workers: int,
+        pfx_workers: int,
+        queue_size: int = 100,
+        http_session=None,
+        http_templates: dict = None,
+        report_interval: float = 10,
+        key_pool=None,
+        listeners=(),
+        metrics=None,
+        controller=None,
+        form_cache=None,
+        browser_templates: dict = None,
+        key_type: str = None,
+        issuer=None,
+        priority_queues: bool = False,
+        keygen_processes: bool = False
+) -> Pipeline:
+    """
+    Build keygen -> issue -> pfx pipeline, jobs are dicts: {'cn': <cn>} or resume.plan_job dicts.
+    Each job gets cn_path, csr, key, cer, pfx keys on the way.
+    Key, CSR & cert go between stages as in-memory buffers(key_pem, csr_pem, cer_pem), each file is written once.
+    Per-CN sans/template/key_type/pfx_pass job keys(cn_input row options) override defaults.
+
+    :param backend: crypto backend(crypto_backend.get_crypto_backend)
+    :param results_dir: results dir of the run
+    :param engine: str, playwright, http or local(project_static.issuer_engine), not used if issuer is set
+    :param url: url of PKI server
+    :param user: username to auth on PKI server
+    :param password: password to auth on PKI server
+    :param template: default template name to use for PKI
+    :param cer_ext: certificate extension
+    :param pfx_pass: default pfx password
+    :param keygen_workers: int, keygen stage workers
+    :param issuer_workers: int, CA submission stage workers(one browser per worker for playwright engine)
+    :param pfx_workers: int, pfx stage workers
+    :param queue_size: int, max jobs waiting in each stage queue
+    :param http_session: requests.Session from certsrv_http.make_certsrv_session(http engine only)
+    :param http_templates: dict, project_static.http_templates(http engine only)
+    :param report_interval: float, seconds between stage stats log lines
+    :param key_pool: key_pool.KeyPool for keygen stage, optional
+    :param listeners: stage result listeners(see Pipeline), i.e. JobStore.record_stage
+    :param metrics: run_metrics.RunMetrics, optional, gets stage results & browser start timings
+    :param controller: ca_controller.SubmissionController, optional, CA submissions retries/circuit breaker/
+        adaptive concurrency(issuer_workers is max concurrency then) & CA endpoints(url/user/password/http_session
+        are defaults for endpoints without them)
+    :param form_cache: certsrv_form.FormCache, optional, cached request form of CA urls(playwright engine only)
+    :param browser_templates: dict, project_static.browser_templates(playwright engine only)
+    :param key_type: str, default type of new keys(project_static.key_type, default: crypto_backend.default_key_type)
+    :param issuer: issuers object for CA submission stage, default: issuers.get_issuer of engine & args above
+    :param priority_queues: bool, stage queues ordered by job "priority"(issuance service)
+    :param keygen_processes: bool, new keys of python backend on process pool(one process per keygen worker)
+    :return: Pipeline
+    """
+    from app_scripts.keygen import make_cn_csr, key_processes
+    from app_scripts.ca_controller import CaEndpoint
+    from app_scripts.crypto_backend import default_key_type
+    from app_scripts.issuers import get_issuer
+
+    key_type = key_type or default_key_type
+
+    # key_maker: keygen worker context value(own key process of worker thread, keygen_processes only)
+    def keygen(job, key_maker=None):
+        cn = job['cn']
+        job['cn_path'] = make_cn_csr(
+            backend, cn, results_dir, key_pool, job.get('reuse_key', False), job.get('sans'),
+            job.get('renew_from'), job.get('renew_csr', False), job.get('key_type', key_type), artifacts=job,
+            key_maker=key_maker
+        )
+        job['csr'] = f'{job["cn_path"]}/{cn}.csr'
+        job['key'] = f'{job["cn_path"]}/{cn}.key'
+
+    # func(endpoint): controller picks endpoint, single default endpoint otherwise
+    default_endpoint = CaEndpoint('default', url, user, password, issuer_workers)
+
+    def submit(func, job):
+        return controller.submit(func, job['cn'], job) if controller else func(default_endpoint)
+
+    if issuer is None:
+        on_start = (lambda duration: metrics.observe_step('issue', 'browser_start', duration)) if metrics else None
+        issuer = get_issuer(
+            engine, url, user, password, template, cer_ext, http_session, http_templates, form_cache,
+            browser_templates, on_start
+        )
+
+    # state: issuer worker context value(BrowserSession of worker thread for playwright)
+    def issue(job, state):
+        job['cer'] = submit(lambda endpoint: issuer.issue(endpoint, job, state), job)
+
+    # key/CSR/cert buffers of keygen & issue stages are dropped here: only paths stay in finished jobs
+    def pfx(job):
+        job.pop('csr_pem', None)
+        backend.make_pfx(job['cn'], job['cer'], job['key'], job['cn_path'], job.get('pfx_pass', pfx_pass),
+                         job.pop('cer_pem', None), job.pop('key_pem', None))
+        job['pfx'] = f'{job["cn_path"]}/{job["cn"]}.pfx'
+
+    return Pipeline(
+        [
+            Stage('keygen', keygen, keygen_workers, queue_size,
+                  (lambda: key_processes(backend, 1)) if keygen_processes else None, priority=priority_queues),
+            Stage('issue', issue, issuer_workers, queue_size, issuer.worker_context, ca_log, priority_queues),
+            Stage('pfx', pfx, pfx_workers, queue_size, priority=priority_queues)
+        ],
+        report_interval,
+        [*listeners, metrics] if metrics else listeners
+    )
@@ -0,0 +1,154 @@
+"""
+Various Helper functions:
+ - files_rotate
+ - functions decorator
+ - count estimated time
+ - check dir exist
+ - check file exist
+ - write file atomically
+ """
+
+from os import remove, mkdir, path, replace, chmod, fdopen, fsync, close, open as os_open, O_RDONLY
+from tempfile import mkstemp
+from time import perf_counter
+from project_static import logging
+from app_scripts.structured_log import log_fields
+
+
+# FUNCTION CALL DECORATOR
+def func_decor(action='PRINTING FUNC DESCR', level='warn'):
+    """
+    Function's decorator: use logging from project_static.py to:
+    1) log 'STARTED: <action>'
+    2) try/except function: exit if level=crit and skip if warn(default)
+    3) log 'DONE: <action>'
+    Records are structured events(structured_log): event started/done/failed, action, duration, error.
+
+    Args:
+        action: str, decored function description, "logging started" or "loggiing started for" {obj=user_name}
+        level: str, default: warn, crit; func fail: warn->skip error, crit->exit program
+
+    Returns:
+        decored func if func or None/exit if func fails (warn/crit)
+    """
+    def inner(func):
+        def wrapper(*args, **kwargs):
+            logging.info('STARTED: %s', action, extra=log_fields('started', action=action))
+            start = perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                fields = log_fields('failed', action=action, duration=round(perf_counter() - start, 3), error=str(e))
+                if level == 'crit':
+                    logging.error('FAILED: %s, exiting\n%s', action, e, extra=fields)
+                    exit()
+                else:
+                    logging.warning('FAILED: %s, skipping\n%s', action, e, extra=fields)
+                    return None
+            else:
+                logging.info('DONE: %s\n', action,
+                             extra=log_fields('done', action=action, duration=round(perf_counter() - start, 3)))
+                return result
+        return wrapper
+    return inner
+
+
+# FILES ROTATION (LOGS/OTHER)
+@func_decor('file/logs rotation')
+def files_rotate(path_to_rotate, num_of_files_to_keep):
+    """
+    This function is for log rotation.
+
+    ARGS:
+        path_to_rotate: absolute PATH of logs location
+        num_of_files_to_keep: number of LOGS to keep
+            delete rest
+
+    Returns:
+         None
+
+    One os.scandir pass, newest files are picked by heap(see retention.apply_retention for results dirs too).
+    """
+    from app_scripts.retention import expired_entries, scan_files
+
+    for entry in expired_entries(scan_files(path_to_rotate), keep=num_of_files_to_keep):
+        remove(entry)
+
+
+# CHECK FILE EXIST
+def check_file(file_path):
+    """
+    Just check if file exists.
+
+    Args:
+        file_path: path to file
+
+    Returns:
+        True/False
+    """
+    return path.isfile(file_path)
+
+
+# CHECK DIR EXIST
+def check_create_dir(dir_path):
+    """
+        Just check if dir exists and create if not.
+
+        Args:
+            dir_path: path to file
+
+        Returns:
+            None
+    """
+    if not path.isdir(dir_path):
+        mkdir(dir_path)
+
+
+# WRITE FILE ONCE VIA TEMP FILE + RENAME
+def write_file_atomic(file_path, data, mode=0o644):
+    """
+    Write data to temp file in the same dir and rename it to file_path:
+    file_path is either absent(or previous version) or complete, never half-written(crash, concurrent reader).
+    Temp file is fsynced before rename and dir after it: renamed file survives power loss with its data.
+    Temp name is unique(mkstemp): concurrent writers of the same file_path do not clobber each other's temp file.
+
+    Args:
+        file_path: path to file
+        data: bytes or str(written as utf-8)
+        mode: int, file permissions, temp file is created with 0600 and gets them before rename(0o600 for keys)
+
+    Returns:
+        None
+    """
+    dir_path = path.dirname(file_path) or '.'
+    fd, tmp_path = mkstemp(dir=dir_path, prefix=f'.{path.basename(file_path)}.', suffix='.tmp')
+    try:
+        with fdopen(fd, 'wb') as file:
+            file.write(data.encode() if isinstance(data, str) else data)
+            file.flush()
+            fsync(file.fileno())
+        if mode != 0o600:
+            chmod(tmp_path, mode)
+        replace(tmp_path, file_path)
+    except BaseException:
+        try:
+            remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    _fsync_dir(dir_path)
+
+
+# PERSIST DIR ENTRIES(RENAME) ON DISK
+def _fsync_dir(dir_path):
+    try:
+        fd = os_open(dir_path, O_RDONLY)
+    except OSError:
+        # no dir handles(i.e. Windows): rename durability is up to filesystem
+        return
+    try:
+        fsync(fd)
+    except OSError:
+        pass
+    finally:
+        close(fd)
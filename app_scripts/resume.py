@@ -0,0 +1,215 @@
+"""
+Resumable runs:
+ - check CN state in job store or in results dir(key, CSR matching key, cert matching key, PFX)
+ - plan CN job: skip steps already done, redo only missing ones
+ - renewal: reuse latest valid key(and CSR) of CN from previous RESULTS_<date> dirs, no new key
+"""
+
+import os
+
+from project_static import logging
+from app_scripts.retention import scan_dated, results_name_re
+from app_scripts.structured_log import log_fields
+
+# STAGES OF ONE CN, IN ORDER
+stages = ('keygen', 'issue', 'pfx')
+
+
+# CHECK WHAT IS ALREADY DONE FOR CN
+def cn_state(backend, cn_path: str, cn: str, cer_ext: str) -> dict:
+    """
+    Check CN artifacts in its results dir.
+
+    :param backend: crypto backend(crypto_backend.get_crypto_backend)
+    :param cn_path: CN results dir
+    :param cn: CN
+    :param cer_ext: certificate extension
+    :return: dict, key/csr/cer/pfx -> bool(csr & cer are True only if they match the key)
+    """
+    key_file = f'{cn_path}/{cn}.key'
+    csr_file = f'{cn_path}/{cn}.csr'
+    cer_file = f'{cn_path}/{cn}.{cer_ext}'
+    pfx_file = f'{cn_path}/{cn}.pfx'
+    state = {'key': False, 'csr': False, 'cer': False, 'pfx': False}
+
+    if not os.path.isfile(key_file):
+        return state
+    try:
+        key_pub = backend.public_key(key_file)
+    except Exception:
+        return state
+    state['key'] = True
+
+    for name, file_path in (('csr', csr_file), ('cer', cer_file)):
+        if not os.path.isfile(file_path):
+            continue
+        try:
+            state[name] = backend.public_key(file_path) == key_pub
+        except Exception:
+            state[name] = False
+
+    # pfx made from current cert: exists and not older than cert
+    state['pfx'] = (
+        state['cer']
+        and os.path.isfile(pfx_file)
+        and os.path.getsize(pfx_file) > 0
+        and os.path.getmtime(pfx_file) >= os.path.getmtime(cer_file)
+    )
+    return state
+
+
+# STAGES DONE BY JOB STORE ROW(NO FILES PARSING, ONLY STAT OF RECORDED ARTIFACTS)
+def stored_done(row) -> tuple:
+    """
+    :param row: job_store.JobStore.get row
+    :return: tuple of bools, done flags for stages(keygen, issue, pfx)
+    """
+    if row['state'] == 'failed':
+        done_count = stages.index(row['failed_stage'])
+    elif row['state'] == 'done':
+        done_count = len(stages)
+    elif row['state'] in stages:
+        done_count = stages.index(row['state']) + 1
+    else:
+        done_count = 0
+
+    stage_files = (('key_path', 'csr_path'), ('cer_path',), ('pfx_path',))
+    return tuple(
+        num < done_count and all(row[col] and os.path.isfile(row[col]) for col in cols)
+        for num, cols in enumerate(stage_files)
+    )
+
+
+# PLAN CN JOB
+def plan_job(backend, results_dir: str, cn: str, cer_ext: str, force: bool = False, store=None) -> dict:
+    """
+    Make pipeline job for CN with "skip" set of stages already done.
+    Any redone stage makes all next stages redone too(new key -> new cert -> new pfx).
+    State is taken from job store if CN has row there, CN dir is checked otherwise.
+
+    :param backend: crypto backend(crypto_backend.get_crypto_backend)
+    :param results_dir: results dir of the run
+    :param cn: CN
+    :param cer_ext: certificate extension
+    :param force: bool, redo all stages
+    :param store: job_store.JobStore, optional
+    :return: dict, job: cn, cn_path, key, csr, skip(and cer/pfx if skipped, reuse_key if key is kept, job_id)
+    """
+    cn_path = f'{results_dir}/{cn}'
+    job = {
+        'cn': cn,
+        'cn_path': cn_path,
+        'key': f'{cn_path}/{cn}.key',
+        'csr': f'{cn_path}/{cn}.csr',
+        'skip': set()
+    }
+    row = None
+    if store:
+        row = store.get(results_dir, cn)
+        job['job_id'] = store.start_job(results_dir, cn, reset=force)
+    if force or not os.path.isdir(cn_path):
+        return job
+
+    if row is not None and row['state'] != 'new':
+        done = stored_done(row)
+        key_ok = done[0] or bool(row['key_path'] and os.path.isfile(row['key_path']))
+    else:
+        state = cn_state(backend, cn_path, cn, cer_ext)
+        done = (state['key'] and state['csr'], state['cer'], state['pfx'])
+        key_ok = state['key']
+
+    for stage, stage_done in zip(stages, done):
+        if not stage_done:
+            break
+        job['skip'].add(stage)
+    # valid key without CSR: keep the key, make CSR only
+    if 'keygen' not in job['skip'] and key_ok:
+        job['reuse_key'] = True
+    if 'issue' in job['skip']:
+        job['cer'] = f'{cn_path}/{cn}.{cer_ext}'
+    if 'pfx' in job['skip']:
+        job['pfx'] = f'{cn_path}/{cn}.pfx'
+    return job
+
+
+# CN DIRS OF PREVIOUS RUNS(ONE os.scandir PER RESULTS DIR)
+def previous_cn_dirs(results_parent: str, exclude: str = None) -> dict:
+    """
+    :param results_parent: dir with RESULTS_<date> dirs
+    :param exclude: results dir of current run
+    :return: dict, CN -> list of CN dirs, newest run first(run date from RESULTS_<date> name)
+    """
+    exclude = os.path.realpath(exclude) if exclude else None
+    cn_dirs = {}
+    for _, dir_path in sorted(scan_dated(results_parent, results_name_re, dirs=True), reverse=True):
+        if os.path.realpath(dir_path) == exclude:
+            continue
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    cn_dirs.setdefault(entry.name, []).append(entry.path)
+    return cn_dirs
+
+
+# FIND KEY(AND CSR) TO RENEW CN WITH
+def renewal_source(backend, cn_dirs: list, cn: str, key_types, key_type: str = None):
+    """
+    Latest CN dir with valid key meeting policy: key type(algorithm & size) in key_types
+    and same as requested key_type(cns_data row option) if set.
+
+    :param backend: crypto backend(crypto_backend.get_crypto_backend)
+    :param cn_dirs: CN dirs of previous runs, newest first(previous_cn_dirs value)
+    :param cn: CN
+    :param key_types: allowed key types(project_static.renew_key_types)
+    :param key_type: str, requested key type, optional
+    :return: tuple(CN dir, bool CSR matches key) or None if no key meets policy
+    """
+    for cn_path in cn_dirs:
+        key_file = f'{cn_path}/{cn}.key'
+        if not os.path.isfile(key_file):
+            continue
+        try:
+            found_type = backend.key_type(key_file)
+            if found_type not in key_types or (key_type and found_type != key_type):
+                logging.info('%s: key %s is %s, not allowed for renewal', cn, key_file, found_type,
+                             extra=log_fields('renewal_key_skipped', cn=cn))
+                continue
+            key_pub = backend.public_key(key_file)
+        except Exception as e:
+            logging.info('%s: key %s is not valid for renewal\n%s', cn, key_file, e,
+                         extra=log_fields('renewal_key_skipped', cn=cn, error=str(e)))
+            continue
+        csr_file = f'{cn_path}/{cn}.csr'
+        try:
+            csr_ok = os.path.isfile(csr_file) and backend.public_key(csr_file) == key_pub
+        except Exception:
+            csr_ok = False
+        return cn_path, csr_ok
+    return None
+
+
+# RENEWAL PLAN FOR CN JOB
+def plan_renewal(backend, job: dict, cn_dirs: dict, key_types, key_type: str = None, sans: list = None) -> dict:
+    """
+    Set job to renew CN with key of previous run(keygen copies key & CSR, no new key is generated).
+    CSR is made again with that key if it does not match the key or sans are set for CN.
+    Job with key already in results dir(skip keygen/reuse_key) is not changed.
+
+    :param backend: crypto backend(crypto_backend.get_crypto_backend)
+    :param job: dict, plan_job result
+    :param cn_dirs: dict, previous_cn_dirs result
+    :param key_types: allowed key types(project_static.renew_key_types)
+    :param key_type: str, requested key type(cns_data row option), optional
+    :param sans: list of SANs(cns_data row option), optional
+    :return: dict, job with renew_from(CN dir of previous run) & renew_csr(bool, copy CSR) if source is found
+    """
+    if 'keygen' in job['skip'] or job.get('reuse_key'):
+        return job
+    source = renewal_source(backend, cn_dirs.get(job['cn'], ()), job['cn'], key_types, key_type)
+    if source is None:
+        logging.info('%s: no previous key for renewal, new key will be made', job['cn'],
+                     extra=log_fields('renewal_no_key', cn=job['cn']))
+        return job
+    job['renew_from'], csr_ok = source
+    job['renew_csr'] = csr_ok and not sans
+    return job
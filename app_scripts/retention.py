@@ -0,0 +1,313 @@
+"""
+Retention for logs and RESULTS_<date> dirs, one os.scandir pass per dir:
+ - policy: keep N newest and/or D days(RESULTS dirs & archives are dated by name, no stat per dir)
+ - logs are kept per run(.log, .jsonl & _ca_errors.jsonl of one run together) and per log kind(app & tool logs)
+ - old RESULTS dirs are archived to streamed, compressed tarballs(0600), archive is checked before delete
+ - keys(.key/.pfx) are overwritten before delete, rest of dir is removed
+ - cron/manual run: python3 -m app_scripts.retention [--dry-run]
+"""
+
+import argparse
+import heapq
+import os
+import re
+import shutil
+import tarfile
+from datetime import datetime
+from time import time
+
+from project_static import logging
+from app_scripts.structured_log import log_fields
+
+# DATED NAMES: RESULTS_<dd-mm-YYYY> DIRS AND THEIR ARCHIVES
+results_name_re = re.compile(r'^RESULTS_(\d{2}-\d{2}-\d{4})$')
+archive_name_re = re.compile(r'^RESULTS_(\d{2}-\d{2}-\d{4})(_\d+)?\.tar\.(gz|bz2|xz)$')
+results_date_format = '%d-%m-%Y'
+
+# LOG FILES OF ONE RUN: <base>.log, <base>.jsonl, <base>_ca_errors.jsonl; KIND: BASE WITHOUT DATE
+log_name_re = re.compile(r'^(.+?)(_ca_errors)?\.(log|jsonl)$')
+log_date_re = re.compile(r'_\d{2}-\d{2}-\d{4}$')
+
+# FILES WITH PRIVATE KEY MATERIAL(OVERWRITTEN BEFORE DELETE)
+key_suffixes = ('.key', '.pfx')
+
+
+# PICK ENTRIES OUT OF POLICY
+def expired_entries(entries, keep: int = None, days: float = None, now: float = None) -> list:
+    """
+    Entries out of retention policy: not among <keep> newest AND older than <days>
+    (only one of keep/days set - that one decides, none set - nothing expires).
+
+    Args:
+        entries: list of tuples(timestamp, path)
+        keep: int, newest entries to keep
+        days: float, keep entries younger than days
+        now: float, current timestamp(default: time())
+
+    Returns:
+        list of paths, oldest first
+    """
+    if keep is None and days is None:
+        return []
+    newest = {path for _, path in heapq.nlargest(keep, entries)} if keep is not None else set()
+    cutoff = (now or time()) - days * 86400 if days is not None else None
+    return [
+        path for timestamp, path in sorted(entries)
+        if path not in newest and (cutoff is None or timestamp < cutoff)
+    ]
+
+
+# SCAN DIRS(ONE os.scandir PASS EACH)
+def scan_files(dir_path: str) -> list:
+    """
+    Returns:
+        list of tuples(mtime, path) of files in dir(not recursive)
+    """
+    if not os.path.isdir(dir_path):
+        return []
+    with os.scandir(dir_path) as entries:
+        return [
+            (entry.stat(follow_symlinks=False).st_mtime, entry.path)
+            for entry in entries if entry.is_file(follow_symlinks=False)
+        ]
+
+
+def scan_log_runs(dir_path: str) -> dict:
+    """
+    Log files grouped by run and log kind(app log, key_pool/retention/inventory/certsrv_form tool logs),
+    so one run with JSON-lines & CA errors logs counts once and tool logs do not push app runs out.
+
+    Returns:
+        dict, kind -> dict(run base path -> tuple(newest mtime of run files, list of run files))
+    """
+    kinds = {}
+    for mtime, file_path in scan_files(dir_path):
+        found = log_name_re.match(os.path.basename(file_path))
+        base = found.group(1) if found else os.path.basename(file_path)
+        runs = kinds.setdefault(log_date_re.sub('', base), {})
+        run_mtime, run_files = runs.get(os.path.join(dir_path, base), (0, []))
+        runs[os.path.join(dir_path, base)] = (max(run_mtime, mtime), run_files + [file_path])
+    return kinds
+
+
+def _name_timestamp(name_re, name):
+    found = name_re.match(name)
+    if not found:
+        return None
+    try:
+        return datetime.strptime(found.group(1), results_date_format).timestamp()
+    except ValueError:
+        return None
+
+
+def scan_dated(dir_path: str, name_re, dirs: bool) -> list:
+    """
+    Dated entries by name(date from name, no stat calls).
+
+    Args:
+        dir_path: str, dir to scan
+        name_re: compiled regex, group 1 is date(results_date_format)
+        dirs: bool, True - dirs only, False - files only
+
+    Returns:
+        list of tuples(timestamp, path)
+    """
+    if not dir_path or not os.path.isdir(dir_path):
+        return []
+    found = []
+    with os.scandir(dir_path) as entries:
+        for entry in entries:
+            timestamp = _name_timestamp(name_re, entry.name)
+            if timestamp is None:
+                continue
+            if (entry.is_dir(follow_symlinks=False) if dirs else entry.is_file(follow_symlinks=False)):
+                found.append((timestamp, entry.path))
+    return found
+
+
+# OVERWRITE & DELETE FILE
+def secure_delete(file_path: str):
+    """
+    Overwrite file with zeros, fsync, delete.
+    NB: on SSD/copy-on-write/journaling filesystems old blocks may survive, use disk encryption for full safety.
+    """
+    size = os.path.getsize(file_path)
+    zeros = bytes(65536)
+    with open(file_path, 'r+b', buffering=0) as file:
+        remaining = size
+        while remaining > 0:
+            remaining -= file.write(zeros[:min(len(zeros), remaining)])
+        os.fsync(file.fileno())
+    os.remove(file_path)
+
+
+# REMOVE RESULTS DIR, KEYS OVERWRITTEN FIRST
+def purge_dir(dir_path: str) -> int:
+    """
+    Returns:
+        int, key files wiped
+    """
+    wiped = 0
+    stack = [dir_path]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False) and entry.name.endswith(key_suffixes):
+                    secure_delete(entry.path)
+                    wiped += 1
+    shutil.rmtree(dir_path)
+    return wiped
+
+
+# ARCHIVE RESULTS DIR TO TARBALL
+def archive_dir(dir_path: str, archive_path_dir: str, compression: str = 'gz') -> str:
+    """
+    Stream dir to <archive_path_dir>/<dir name>.tar.<compression>(0600, via temp file + rename),
+    then read archive back and check all dir entries are in it.
+
+    Args:
+        dir_path: str, dir to archive
+        archive_path_dir: str, archives dir(created with 0700 if not exists)
+        compression: str, gz/bz2/xz
+
+    Returns:
+        str, archive path, raises Exception if archive check fails
+    """
+    os.makedirs(archive_path_dir, mode=0o700, exist_ok=True)
+    name = os.path.basename(os.path.normpath(dir_path))
+    archive_path = f'{archive_path_dir}/{name}.tar.{compression}'
+    if os.path.exists(archive_path):
+        archive_path = f'{archive_path_dir}/{name}_{int(time())}.tar.{compression}'
+    tmp_path = f'{archive_path}.tmp'
+
+    expected = 1
+    for _, dir_names, file_names in os.walk(dir_path):
+        expected += len(dir_names) + len(file_names)
+
+    try:
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'wb') as raw, tarfile.open(fileobj=raw, mode=f'w|{compression}') as tar:
+            tar.add(dir_path, arcname=name)
+        with tarfile.open(tmp_path, f'r|{compression}') as tar:
+            archived = sum(1 for _ in tar)
+        if archived != expected:
+            raise Exception(f'ARCHIVE CHECK FAILED FOR {dir_path}: {archived} entries in archive, {expected} in dir')
+        os.replace(tmp_path, archive_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return archive_path
+
+
+# APPLY ALL POLICIES
+def apply_retention(
+        logs_dir: str,
+        logs_keep: int = None,
+        results_parent: str = None,
+        results_keep: int = None,
+        results_keep_days: float = None,
+        archive_path_dir: str = None,
+        archive_keep_days: float = None,
+        compression: str = 'gz',
+        exclude=(),
+        dry_run: bool = False
+) -> dict:
+    """
+    Logs: delete runs(all files of run) out of logs_keep newest runs of each log kind.
+    Results: RESULTS_<date> dirs out of policy are archived(if archive_path_dir set) and purged.
+    Archives: deleted after archive_keep_days.
+
+    Args:
+        logs_dir: str, logs dir
+        logs_keep: int, newest runs to keep per log kind(None - keep all)
+        results_parent: str, dir with RESULTS_<date> dirs(None - skip results)
+        results_keep: int, newest results dirs to keep
+        results_keep_days: float, keep results dirs younger than days
+        archive_path_dir: str, archives dir, None - purge results dirs without archive
+        archive_keep_days: float, delete archives older than days(None - keep forever)
+        compression: str, gz/bz2/xz
+        exclude: paths never touched(i.e. current run results dir)
+        dry_run: bool, only log what would be done
+
+    Returns:
+        dict, counters: logs_deleted, results_archived, results_purged, keys_wiped, archives_deleted, errors
+    """
+    stats = dict.fromkeys(
+        ('logs_deleted', 'results_archived', 'results_purged', 'keys_wiped', 'archives_deleted', 'errors'), 0
+    )
+    excluded = {os.path.realpath(path) for path in exclude}
+    action = 'DRY RUN, would' if dry_run else 'retention:'
+
+    for runs in scan_log_runs(logs_dir).values():
+        expired = expired_entries([(mtime, base) for base, (mtime, _) in runs.items()], keep=logs_keep)
+        for path in (path for base in expired for path in runs[base][1]):
+            if os.path.realpath(path) in excluded:
+                continue
+            logging.info('%s delete log %s', action, path, extra=log_fields('retention', action='delete_log'))
+            if not dry_run:
+                try:
+                    os.remove(path)
+                    stats['logs_deleted'] += 1
+                except OSError as e:
+                    logging.warning('failed to delete log %s\n%s', path, e,
+                                    extra=log_fields('retention_failed', action='delete_log', error=str(e)))
+                    stats['errors'] += 1
+
+    if results_parent:
+        results_dirs = scan_dated(results_parent, results_name_re, dirs=True)
+        for path in expired_entries(results_dirs, results_keep, results_keep_days):
+            if os.path.realpath(path) in excluded:
+                continue
+            logging.info('%s %spurge %s', action, 'archive & ' if archive_path_dir else '', path,
+                         extra=log_fields('retention', action='purge'))
+            if dry_run:
+                continue
+            try:
+                if archive_path_dir:
+                    archive_path = archive_dir(path, archive_path_dir, compression)
+                    stats['results_archived'] += 1
+                    logging.info('%s archived to %s', path, archive_path,
+                                 extra=log_fields('retention', action='archive'))
+                stats['keys_wiped'] += purge_dir(path)
+                stats['results_purged'] += 1
+            except Exception as e:
+                logging.warning('failed to archive/purge %s, kept\n%s', path, e,
+                                extra=log_fields('retention_failed', action='purge', error=str(e)))
+                stats['errors'] += 1
+
+    if archive_path_dir and archive_keep_days is not None:
+        archives = scan_dated(archive_path_dir, archive_name_re, dirs=False)
+        for path in expired_entries(archives, days=archive_keep_days):
+            logging.info('%s delete archive %s', action, path, extra=log_fields('retention', action='delete_archive'))
+            if not dry_run:
+                try:
+                    os.remove(path)
+                    stats['archives_deleted'] += 1
+                except OSError as e:
+                    logging.warning('failed to delete archive %s\n%s', path, e,
+                                    extra=log_fields('retention_failed', action='delete_archive', error=str(e)))
+                    stats['errors'] += 1
+
+    logging.info('retention done: %s', stats, extra=log_fields('retention_done'))
+    return stats
+
+
+# CRON ENTRY POINT: APPLY project_static POLICIES
+if __name__ == '__main__':
+    from project_static import (
+        setup_logging, appname, start_date, logs_dir, logs_to_keep, script_dir, results_keep, results_keep_days,
+        results_archive_dir, archive_keep_days, archive_compression
+    )
+
+    parser = argparse.ArgumentParser(description='Apply logs & RESULTS dirs retention')
+    parser.add_argument('--dry-run', action='store_true', help='only log what would be done')
+    args = parser.parse_args()
+
+    setup_logging(f'{logs_dir}/{appname}_retention_{start_date}.log')
+    print(apply_retention(
+        logs_dir, logs_to_keep, script_dir, results_keep, results_keep_days,
+        results_archive_dir, archive_keep_days, archive_compression, dry_run=args.dry_run
+    ))
@@ -0,0 +1,257 @@
+"""
+Run metrics & machine-readable run report:
+ - per-stage(keygen/issue/pfx) and per-step(navigate/submit/issue/download, browser start) duration histograms
+ - done/failed/skipped counters per stage, per-CN durations & outcomes, CA endpoint of every issued cert
+ - JSON report and Prometheus textfile-collector(node_exporter) file at the end of the run
+ - long-running service: raw values & per-CN records are kept for last N only(window), counters stay cumulative
+ - short text summary for user report mail
+"""
+
+import json
+from collections import deque, OrderedDict
+from threading import Lock
+from time import time
+
+from app_scripts.project_helper import write_file_atomic
+
+# HISTOGRAM BUCKETS, SECONDS(CA ISSUANCE MAY TAKE MINUTES)
+duration_buckets = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+# PERCENTILE OF SORTED LIST
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+# DURATIONS HISTOGRAM
+class Histogram:
+    """
+    Prometheus-like histogram(bucket counts, sum, count), raw values are kept for percentiles.
+    window: int, raw values kept(last ones, percentiles/min/max of window), None - all(one run)
+    """
+    def __init__(self, buckets=duration_buckets, window=None):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.values = deque(maxlen=window)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value: float):
+        self.values.append(value)
+        self.count += 1
+        self.sum += value
+        for num, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[num] += 1
+                return
+        self.counts[-1] += 1
+
+    def cumulative(self):
+        """
+        Returns:
+            list of tuples(le label, cumulative count), last one is "+Inf"
+        """
+        result = []
+        total = 0
+        for bound, count in zip((*self.buckets, '+Inf'), self.counts):
+            total += count
+            result.append((str(bound), total))
+        return result
+
+    def summary(self) -> dict:
+        values = sorted(self.values)
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 4),
+            'min': round(values[0], 4) if values else 0,
+            'max': round(values[-1], 4) if values else 0,
+            'p50': round(percentile(values, 50), 4),
+            'p90': round(percentile(values, 90), 4),
+            'p99': round(percentile(values, 99), 4),
+            'buckets': dict(self.cumulative())
+        }
+
+
+# RUN METRICS
+class RunMetrics:
+    """
+    Collect stage/step timings of the run, thread-safe.
+    Instance is stage listener itself(same signature as JobStore.record_stage):
+        metrics(job, stage, started_at, duration, error)
+    Issue step timings are taken from job["step_timings"](set by create_cert/create_cert_http).
+
+    Args:
+        appname: str, metrics prefix/label(project_static.appname)
+        run_id: str, run ID(i.e. run start date&time)
+        window: int, per-CN records & histogram raw values kept(last ones), None - all(one run);
+            service mode sets it, so metrics do not grow for the whole service life
+    """
+    def __init__(self, appname, run_id, window=None):
+        self.appname = appname
+        self.run_id = run_id
+        self.started_at = time()
+        self.elapsed = None
+        self.stages = {}
+        self.steps = {}
+        self.counters = {}
+        self.cns = OrderedDict()
+        self.endpoints = {}
+        self.window = window
+        self._lock = Lock()
+
+    def _histogram(self, histograms, key):
+        if key not in histograms:
+            histograms[key] = Histogram(window=self.window)
+        return histograms[key]
+
+    # PER-CN RECORD, OLDEST CNS ARE DROPPED OVER WINDOW
+    def _cn_record(self, cn):
+        record = self.cns.setdefault(cn, {})
+        if self.window is not None:
+            self.cns.move_to_end(cn)
+            while len(self.cns) > self.window:
+                self.cns.popitem(last=False)
+        return record
+
+    def __call__(self, job, stage, started_at, duration, error=None):
+        outcome = 'failed' if error else 'done'
+        with self._lock:
+            self._histogram(self.stages, stage).observe(duration)
+            self.counters[(stage, outcome)] = self.counters.get((stage, outcome), 0) + 1
+            cn_record = self._cn_record(job['cn'])
+            cn_record[stage] = {'status': outcome, 'started_at': round(started_at, 3), 'duration': round(duration, 4)}
+            if error:
+                cn_record[stage]['error'] = str(error)
+            if stage == 'issue' and not error and job.get('ca_endpoint'):
+                cn_record[stage]['endpoint'] = job['ca_endpoint']
+                self.endpoints[job['ca_endpoint']] = self.endpoints.get(job['ca_endpoint'], 0) + 1
+            if stage == 'issue' and job.get('step_timings'):
+                cn_record[stage]['steps'] = {step: round(value, 4) for step, value in job['step_timings'].items()}
+                for step, value in job['step_timings'].items():
+                    self._histogram(self.steps, (stage, step)).observe(value)
+
+    # STEP OUTSIDE OF CN JOB(I.E. BROWSER START)
+    def observe_step(self, stage, step, duration):
+        with self._lock:
+            self._histogram(self.steps, (stage, step)).observe(duration)
+
+    # STAGES SKIPPED FOR CN(RESUME MODE)
+    def skipped(self, job):
+        with self._lock:
+            for stage in job.get('skip', ()):
+                self.counters[(stage, 'skipped')] = self.counters.get((stage, 'skipped'), 0) + 1
+                self._cn_record(job['cn'])[stage] = {'status': 'skipped'}
+
+    def finish(self, elapsed: float):
+        self.elapsed = elapsed
+
+    # REPORT DICT
+    def report(self, totals: dict = None) -> dict:
+        """
+        Args:
+            totals: dict, run totals from app(i.e. CNs total/succeeded/failed lists lengths), optional
+
+        Returns:
+            dict, JSON-serializable run report
+        """
+        with self._lock:
+            return {
+                'appname': self.appname,
+                'run_id': self.run_id,
+                'started_at': round(self.started_at, 3),
+                'elapsed': round(self.elapsed, 3) if self.elapsed is not None else None,
+                'totals': totals or {},
+                'counters': {
+                    stage: {
+                        outcome: count for (counter_stage, outcome), count in self.counters.items()
+                        if counter_stage == stage
+                    }
+                    for stage in dict.fromkeys(stage for stage, _ in self.counters)
+                },
+                'stages': {stage: histogram.summary() for stage, histogram in self.stages.items()},
+                'steps': {
+                    f'{stage}.{step}': histogram.summary() for (stage, step), histogram in self.steps.items()
+                },
+                'endpoints': dict(self.endpoints),
+                'cns': dict(self.cns)
+            }
+
+    # JSON REPORT FILE
+    def write_json(self, file_path: str, totals: dict = None):
+        write_file_atomic(file_path, json.dumps(self.report(totals), indent=2, ensure_ascii=False))
+
+    # PROMETHEUS TEXTFILE-COLLECTOR FILE
+    def prometheus(self, totals: dict = None) -> str:
+        """
+        Metrics in Prometheus text format, prefix "pki_auto", label run_id is not used(high cardinality).
+        """
+        prefix = 'pki_auto'
+        lines = []
+
+        def histogram_lines(name, help_text, histograms):
+            lines.append(f'# HELP {prefix}_{name} {help_text}')
+            lines.append(f'# TYPE {prefix}_{name} histogram')
+            for labels, histogram in histograms:
+                label_str = ','.join(f'{key}="{value}"' for key, value in labels.items())
+                for le, count in histogram.cumulative():
+                    lines.append(f'{prefix}_{name}_bucket{{{label_str},le="{le}"}} {count}')
+                lines.append(f'{prefix}_{name}_sum{{{label_str}}} {histogram.sum:.4f}')
+                lines.append(f'{prefix}_{name}_count{{{label_str}}} {histogram.count}')
+
+        with self._lock:
+            histogram_lines(
+                'stage_duration_seconds', 'Duration of CN stage(keygen/issue/pfx) in last run',
+                [({'stage': stage}, histogram) for stage, histogram in self.stages.items()]
+            )
+            histogram_lines(
+                'step_duration_seconds', 'Duration of stage step(i.e. issue navigate/submit/issue/download) in last run',
+                [({'stage': stage, 'step': step}, histogram) for (stage, step), histogram in self.steps.items()]
+            )
+            lines.append(f'# HELP {prefix}_stage_jobs Jobs by stage and outcome(done/failed/skipped) in last run')
+            lines.append(f'# TYPE {prefix}_stage_jobs gauge')
+            for (stage, outcome), count in sorted(self.counters.items()):
+                lines.append(f'{prefix}_stage_jobs{{stage="{stage}",outcome="{outcome}"}} {count}')
+            if self.endpoints:
+                lines.append(f'# HELP {prefix}_endpoint_issued Certs issued by CA endpoint in last run')
+                lines.append(f'# TYPE {prefix}_endpoint_issued gauge')
+                for endpoint, count in self.endpoints.items():
+                    lines.append(f'{prefix}_endpoint_issued{{endpoint="{endpoint}"}} {count}')
+            for name, value in (totals or {}).items():
+                lines.append(f'# TYPE {prefix}_run_{name} gauge')
+                lines.append(f'{prefix}_run_{name} {value}')
+            lines.append(f'# TYPE {prefix}_run_duration_seconds gauge')
+            lines.append(f'{prefix}_run_duration_seconds {self.elapsed or 0:.3f}')
+            lines.append(f'# TYPE {prefix}_run_last_timestamp_seconds gauge')
+            lines.append(f'{prefix}_run_last_timestamp_seconds {time():.0f}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, file_path: str, totals: dict = None):
+        write_file_atomic(file_path, self.prometheus(totals))
+
+    # TEXT SUMMARY FOR USER REPORT
+    def summary_text(self, totals: dict = None) -> str:
+        report = self.report(totals)
+        lines = [f'{self.appname}: {self.run_id}', '----------------------------']
+        lines += [f'{name}: {value}' for name, value in report['totals'].items()]
+        if report['elapsed'] is not None:
+            lines.append(f'elapsed: {report["elapsed"]}s')
+        for stage, counters in report['counters'].items():
+            timing = report['stages'].get(stage)
+            timing_str = f', p50 {timing["p50"]}s, p99 {timing["p99"]}s, max {timing["max"]}s' if timing else ''
+            lines.append(f'{stage}: ' + ', '.join(f'{outcome} {count}' for outcome, count in counters.items())
+                         + timing_str)
+        for step, timing in report['steps'].items():
+            lines.append(f'  {step}: count {timing["count"]}, p50 {timing["p50"]}s, p99 {timing["p99"]}s')
+        if report['endpoints']:
+            lines.append('issued by CA endpoint: '
+                         + ', '.join(f'{endpoint} {count}' for endpoint, count in report['endpoints'].items()))
+        failed = [
+            f'{cn}: {stage} - {record["error"]}'
+            for cn, cn_stages in report['cns'].items()
+            for stage, record in cn_stages.items() if record.get('status') == 'failed'
+        ]
+        if failed:
+            lines += ['----------------------------', 'FAILED:'] + failed
+        return '\n'.join(lines) + '\n'
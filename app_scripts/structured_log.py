@@ -0,0 +1,162 @@
+"""
+Non-blocking structured logging:
+ - workers only put records to queue, one listener thread formats & writes them(no file I/O, no handler lock on workers)
+ - text log as before + JSON-lines log: one record per line with cn, stage, duration, event fields
+ - CA errors channel(logger "ca"): CA submission failures, retries, circuit events to own JSON-lines file
+ - process pool workers log to the same files over multiprocessing queue(worker_logging initializer)
+"""
+
+import atexit
+import json
+import multiprocessing
+import queue
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+
+from project_static import logging
+
+# CA ERRORS CHANNEL: ca_log RECORDS OF WARNING AND ABOVE GO TO CA ERRORS FILE TOO
+ca_channel = 'ca'
+ca_log = logging.getLogger(ca_channel)
+
+# RECORD FIELDS SET BY extra=log_fields(...), WRITTEN TO JSON-LINES LOG IF SET
+event_fields = ('event', 'cn', 'stage', 'duration', 'endpoint', 'attempt', 'action', 'error')
+
+_state = {'listener': None, 'handlers': None, 'mp_queue': None, 'mp_listener': None}
+
+
+# EXTRA FIELDS OF STRUCTURED RECORD
+def log_fields(event: str, **fields) -> dict:
+    """
+    Fields for extra= of logging call(None values are dropped), i.e.
+    logging.info('DONE: %s for %s', stage, cn, extra=log_fields('stage_done', cn=cn, stage=stage, duration=0.2))
+
+    Args:
+        event: str, event name
+        fields: cn, stage, duration, endpoint, attempt, action, error
+
+    Returns:
+        dict
+    """
+    return {'event': event, **{name: value for name, value in fields.items() if value is not None}}
+
+
+# ONE JSON OBJECT PER RECORD
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'process': record.process,
+            'thread': record.threadName,
+            'msg': record.getMessage().strip()
+        }
+        for name in event_fields:
+            value = getattr(record, name, None)
+            if value is not None:
+                entry[name] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+# IN-PROCESS QUEUE: RECORD IS FORMATTED BY LISTENER THREAD, NOT BY WORKER
+class _LocalQueueHandler(QueueHandler):
+    def prepare(self, record):
+        return record
+
+
+# ONLY RECORDS OF CA CHANNEL
+class _ChannelFilter(logging.Filter):
+    def filter(self, record):
+        return record.name == ca_channel or record.name.startswith(f'{ca_channel}.')
+
+
+def _file_handler(file_path, mode, formatter, level=logging.NOTSET, record_filter=None):
+    handler = logging.FileHandler(file_path, mode=mode, encoding='utf-8', delay=True)
+    handler.setFormatter(formatter)
+    handler.setLevel(level)
+    if record_filter:
+        handler.addFilter(record_filter)
+    return handler
+
+
+# START LOGGING(project_static.setup_logging)
+def start_logging(log_file: str, mode: str, fmt: str, datefmt: str, json_log: str = None, ca_errors_log: str = None,
+                  level=logging.INFO):
+    """
+    Root logger puts records to in-process queue, listener thread writes them to handlers.
+    Does nothing if root logger already has handlers(same as logging.basicConfig).
+    Listener is stopped(queue flushed) at exit.
+
+    Args:
+        log_file: str, text log
+        mode: str, file mode of logs(project_static.log_filemode)
+        fmt: str, text log format
+        datefmt: str, text log date format
+        json_log: str, JSON-lines log, None - off
+        ca_errors_log: str, CA errors JSON-lines log, None - off
+        level: root logger level
+
+    Returns:
+        None
+    """
+    root = logging.getLogger()
+    if root.handlers:
+        return
+    handlers = [_file_handler(log_file, mode, logging.Formatter(fmt, datefmt))]
+    if json_log:
+        handlers.append(_file_handler(json_log, mode, JsonFormatter()))
+    if ca_errors_log:
+        handlers.append(_file_handler(ca_errors_log, mode, JsonFormatter(), logging.WARNING, _ChannelFilter()))
+
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    _state.update(listener=listener, handlers=handlers)
+    root.addHandler(_LocalQueueHandler(log_queue))
+    root.setLevel(level)
+    atexit.register(stop_logging)
+
+
+# STOP LISTENERS: WRITE QUEUED RECORDS, CLOSE FILES
+def stop_logging():
+    for name in ('mp_listener', 'listener'):
+        if _state[name]:
+            _state[name].stop()
+            _state[name] = None
+    if _state['mp_queue'] is not None:
+        _state['mp_queue'].close()
+        _state['mp_queue'] = None
+    for handler in _state['handlers'] or ():
+        handler.close()
+
+
+# PROCESS POOL WORKERS LOGGING
+def worker_logging() -> tuple:
+    """
+    Initializer & its args for ProcessPoolExecutor/multiprocessing.Pool:
+    records of worker processes go over multiprocessing queue to the same handlers.
+    ProcessPoolExecutor(workers, initializer=init_worker, initargs=args) with init_worker, args = worker_logging()
+
+    Returns:
+        tuple(initializer, initargs), initializer is None if logging is not started
+    """
+    if not _state['listener']:
+        return None, ()
+    if _state['mp_queue'] is None:
+        _state['mp_queue'] = multiprocessing.Queue()
+        _state['mp_listener'] = QueueListener(_state['mp_queue'], *_state['handlers'], respect_handler_level=True)
+        _state['mp_listener'].start()
+    return _init_worker, (_state['mp_queue'], logging.getLogger().level)
+
+
+def _init_worker(mp_queue, level):
+    # forked worker inherits in-process queue handler, its queue has no listener here
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    # standard QueueHandler: record is formatted in worker, args/traceback are not pickled
+    root.addHandler(QueueHandler(mp_queue))
+    root.setLevel(level)
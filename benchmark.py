@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark: full keygen -> issue -> pfx pipeline against local mock certsrv or local CA.
+
+- runs pipeline at 10/100/1000 CNs(--sizes)
+- reports per-stage & end-to-end certs/sec, p50/p99 latency, peak RSS as JSON
+- --save-baseline to store result, --baseline to fail(exit 1) on throughput regression
+- --engine local: certs signed by local CA(issuers.LocalCaIssuer), no CA latency(i.e. 10k CNs synthetic run),
+  compare with --engine http report to see CA share of run time
+- --keygen-processes: python backend keys on process pool, compare with thread run to see keygen scaling over cores
+
+Example:
+    python3 benchmark.py --engine http --latency 0.05 --sizes 10 100 --baseline benchmark_baseline.json
+    python3 benchmark.py --engine local --key-type ecdsa-p256 --sizes 10000
+"""
+
+import argparse
+import json
+import resource
+import sys
+import tempfile
+from contextlib import nullcontext
+from time import perf_counter
+
+import urllib3
+
+from app_scripts.crypto_backend import get_crypto_backend, key_types
+from app_scripts.certsrv_http import make_certsrv_session
+from app_scripts.mock_certsrv import MockCertsrv
+from app_scripts.pipeline import make_issuance_pipeline
+from app_scripts.issuers import LocalCaIssuer
+
+# TEMPLATE NAMES FOR MOCK CA(ANY NAME IS ACCEPTED BY MOCK)
+bench_template = 'Web client and server'
+bench_http_templates = {bench_template: 'BenchTemplate'}
+bench_local_templates = {
+    bench_template: {
+        'ca_template': 'BenchTemplate',
+        'key_usage': ('digital_signature', 'key_encipherment'),
+        'extended_key_usage': ('server_auth', 'client_auth'),
+        'days': 30
+    }
+}
+
+
+# PERCENTILE OF SORTED LIST
+def percentile(values, pct):
+    if not values:
+        return 0
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))], 4)
+
+
+# PEAK RSS OF THIS PROCESS AND ITS CHILDREN(OPENSSL), MB
+def peak_rss_mb():
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # ru_maxrss is in KB on Linux
+    return round(max(own, children) / 1024, 1)
+
+
+# ONE BENCH RUN
+def run_size(size, args, mock, ca_dir=None):
+    backend = get_crypto_backend(args.crypto, args.openssl_bin)
+    http_session = make_certsrv_session('bench', 'bench', pool_size=args.issuer_workers) \
+        if args.engine == 'http' else None
+    stage_latencies = {}
+    job_spans = {}
+
+    def collect(job, stage, started_at, duration, error):
+        if error is None:
+            stage_latencies.setdefault(stage, []).append(duration)
+        first, last = job_spans.get(job['cn'], (started_at, started_at))
+        job_spans[job['cn']] = (min(first, started_at), max(last, started_at + duration))
+
+    # local CA of whole benchmark(CA key is made once)
+    issuer = LocalCaIssuer(ca_dir, bench_template, 'crt', bench_local_templates) if args.engine == 'local' else None
+
+    with tempfile.TemporaryDirectory(prefix='bench_') as results_dir:
+        pipeline = make_issuance_pipeline(
+            backend,
+            results_dir,
+            args.engine,
+            mock.url if mock else None,
+            'bench',
+            'bench',
+            bench_template,
+            'crt',
+            'bench',
+            args.keygen_workers,
+            args.issuer_workers,
+            args.pfx_workers,
+            http_session=http_session,
+            http_templates=bench_http_templates,
+            report_interval=0,
+            listeners=[collect],
+            key_type=args.key_type,
+            issuer=issuer,
+            keygen_processes=args.keygen_processes
+        )
+        start = perf_counter()
+        results = pipeline.run({'cn': f'bench-{num}.example.test'} for num in range(size))
+        elapsed = perf_counter() - start
+
+    if http_session:
+        http_session.close()
+
+    done = sum(1 for job in results if 'pfx' in job)
+    end_to_end = [last - first for first, last in job_spans.values()]
+    return {
+        'cns': size,
+        'done': done,
+        'failed': size - done,
+        'elapsed': round(elapsed, 3),
+        'certs_per_sec': round(done / elapsed, 3) if elapsed else 0,
+        'latency_p50': percentile(end_to_end, 50),
+        'latency_p99': percentile(end_to_end, 99),
+        'peak_rss_mb': peak_rss_mb(),
+        'stages': {
+            stats['stage']: {
+                'certs_per_sec': stats['throughput'],
+                'latency_p50': percentile(stage_latencies.get(stats['stage'], []), 50),
+                'latency_p99': percentile(stage_latencies.get(stats['stage'], []), 99),
+                'max_queue_depth': stats['max_queue_depth'],
+                'failed': stats['failed']
+            }
+            for stats in (stage.stats() for stage in pipeline.stages)
+        }
+    }
+
+
+# COMPARE WITH BASELINE
+def regressions(report, baseline, tolerance):
+    """
+    Returns:
+        list of str, runs/stages with certs/sec lower than baseline by more than tolerance
+    """
+    found = []
+    base_runs = {run['cns']: run for run in baseline.get('runs', [])}
+    for run in report['runs']:
+        base = base_runs.get(run['cns'])
+        if not base:
+            continue
+        pairs = [('end-to-end', run['certs_per_sec'], base['certs_per_sec'])]
+        pairs += [
+            (stage, stats['certs_per_sec'], base['stages'][stage]['certs_per_sec'])
+            for stage, stats in run['stages'].items() if stage in base.get('stages', {})
+        ]
+        for name, current, previous in pairs:
+            if previous and current < previous * (1 - tolerance):
+                found.append(f'{run["cns"]} CNs, {name}: {current} certs/s < baseline {previous} certs/s')
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline pipeline benchmark against local mock certsrv or local CA')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--engine', choices=('http', 'playwright', 'local'), default='http')
+    parser.add_argument('--crypto', choices=('python', 'openssl'), default='python')
+    parser.add_argument('--openssl-bin', default='/usr/bin/openssl')
+    parser.add_argument('--key-type', choices=key_types, default='rsa2048')
+    parser.add_argument('--latency', type=float, default=0.05, help='mock CA latency, seconds(not local engine)')
+    parser.add_argument('--jitter', type=float, default=0.0, help='mock CA extra random latency, seconds')
+    parser.add_argument('--keygen-workers', type=int, default=4)
+    parser.add_argument('--keygen-processes', action='store_true',
+                        help='python backend: new keys on process pool(one process per keygen worker)')
+    parser.add_argument('--issuer-workers', type=int, default=8)
+    parser.add_argument('--pfx-workers', type=int, default=2)
+    parser.add_argument('--output', help='write JSON report to file(default: stdout)')
+    parser.add_argument('--baseline', help='baseline JSON to compare with')
+    parser.add_argument('--save-baseline', help='save this report as baseline JSON')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed certs/sec drop vs baseline, 0..1')
+    args = parser.parse_args()
+
+    urllib3.disable_warnings()
+    local = args.engine == 'local'
+    with MockCertsrv(args.latency, args.jitter) if not local else nullcontext() as mock, \
+            tempfile.TemporaryDirectory(prefix='bench_ca_') as ca_dir:
+        report = {
+            'settings': {
+                name: getattr(args, name) for name in (
+                    'engine', 'crypto', 'key_type', 'latency', 'jitter', 'keygen_workers', 'keygen_processes',
+                    'issuer_workers', 'pfx_workers'
+                )
+            },
+            'runs': [run_size(size, args, mock, ca_dir) for size in args.sizes]
+        }
+
+    report_json = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(report_json)
+    else:
+        print(report_json)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as file:
+            file.write(report_json)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            found = regressions(report, json.load(file), args.tolerance)
+        for line in found:
+            print(f'REGRESSION: {line}', file=sys.stderr)
+        if found:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,12 +2,17 @@
 - logging settings
 - date settings
 - static initial project's data
+- lazy settings: credentials & mailing data are read from data files on first use only
+
+Import has no side effects(no logs dir, no logging setup, no data files reading):
+call setup_logging() in entry point, credentials/mailing values are loaded on first access.
 """
 
 import logging
 from datetime import datetime
+from functools import cached_property
 import json
-from os import path, mkdir
+from os import path, mkdir, cpu_count
 
 # COMMON DATA
 
@@ -34,10 +39,6 @@ By default script uses script's location dir.
 '''
 logs_dir = f'{script_dir}/logs'
 
-# CHECK LOGS DIR EXIST/CREATE
-if not path.isdir(logs_dir):
-    mkdir(logs_dir)
-
 # LOGS FORMAT
 '''
 logging_format: is for string of log representation
@@ -54,59 +55,384 @@ w - create new/rewrite exist
 log_filemode = 'w'
 
 # LOGS TO KEEP AFTER ROTATION
+'''
+runs kept per log kind(app log, each tool log): .log, .jsonl & _ca_errors.jsonl of one run count as one
+'''
 logs_to_keep = 30
 
 # DEFINE LOG NAME
 app_log_name = f'{logs_dir}/{appname}_{str(start_date)}.log'
 
-# DEFINE LOGGING SETTINGS
-logging.basicConfig(filename=app_log_name, filemode=log_filemode, level=logging.INFO,
-                    format=logging_format, datefmt=logging_datefmt)
+# STRUCTURED LOGS
+'''
+Records are queued by workers and written by one listener thread(no file I/O or handler lock on workers).
+log_json: also write JSON-lines log <log name>.jsonl: ts, level, logger, process, thread, msg
+    and event/cn/stage/duration/endpoint fields of worker records(one line per record: filter by CN with jq/grep)
+log_ca_errors: CA errors channel <log name>_ca_errors.jsonl: CA submission failures & retries, circuit events
+'''
+log_json = True
+log_ca_errors = True
+
+
+# DEFINE LOGGING SETTINGS(CALLED BY ENTRY POINT, NOT ON IMPORT)
+def setup_logging(log_file=None):
+    """
+    Create logs dir(if not exists) and log to log_file(default: app_log_name).
+    Other entry points(cron tools) pass own log file, so they do not rewrite app log of the day.
+    JSON-lines & CA errors logs are named after log_file(see STRUCTURED LOGS).
+    """
+    from app_scripts.structured_log import start_logging
+
+    if not path.isdir(logs_dir):
+        mkdir(logs_dir)
+    log_file = log_file or app_log_name
+    log_base = path.splitext(log_file)[0]
+    start_logging(log_file, log_filemode, logging_format, logging_datefmt,
+                  f'{log_base}.jsonl' if log_json else None,
+                  f'{log_base}_ca_errors.jsonl' if log_ca_errors else None)
 
 
 # MAILING DATA
 mailing_data = f'{data_files}/mailing_data.json'
-with open(mailing_data, encoding='utf-8') as file:
-    data = json.load(file)
-    smtp_server = data['smtp_server']
-    smtp_port = data['smtp_port']
-    smtp_login = data['smtp_login']
-    smtp_pass = data['smtp_pass']
-    smtp_from_addr = data['smtp_from_addr']
-    mail_list_admins = data['list_admins']
-    mail_list_users = data['list_users']
+
+# MAIL NOTIFICATIONS
+'''
+mail_notify_cns: per-CN notifications(cert issued/failed) to mail_list_users, collected in per-recipient digests
+    and sent by queued dispatcher over one kept-alive SMTP connection(user report is sent by it too)
+mail_digest_interval: seconds between digest mails, 0 - one digest at the end of the run
+'''
+mail_notify_cns = False
+mail_digest_interval = 300
 
 # VA PROJECT REGARDING DATA
 results_dir = f'{script_dir}/RESULTS_{start_date}'
 
+# RESUME MODE
+'''
+True - rerun skips steps already done for CN in results dir(key/csr, cert matching key, pfx)
+False - all steps are redone for every CN(same as --force)
+'''
+resume_mode = True
+
+# RENEWAL MODE(SAME AS --renew)
+'''
+True - CN key(and CSR) is taken from latest previous RESULTS_<date> dir, only new cert & pfx are made
+    (keys pinned by clients stay the same), CNs without previous key get new key
+renew_key_types: policy, only keys of these types(algorithm & size) are reused, others are replaced by new key
+CSR is made again with the same key if it does not match the key or sans are set for CN in cns_data
+'''
+renew_mode = False
+renew_key_types = ('rsa2048', 'rsa3072', 'rsa4096', 'ecdsa-p256', 'ecdsa-p384')
+
+# JOB-STATE STORE(SQLite): CN states, artifacts, CA request IDs, timings of all runs
+'''
+query example: python3 -m app_scripts.job_store failed --stage issue --days 7
+'''
+job_store_enabled = True
+job_store_db = f'{script_dir}/jobs.sqlite3'
+
+# CERT INVENTORY(INDEX OF CERTS IN ALL RESULTS_<date> DIRS)
+'''
+inventory_db: SQLite index, cert path & mtime -> parsed cert(rescan parses new/changed certs only)
+inventory_template_oids: CA template OID -> template name(v2 templates have only OID in cert)
+query examples:
+    python3 -m app_scripts.inventory expiring --days 30 --cns-out data_files/cns_renew.jsonl
+    python3 -m app_scripts.inventory cn example.com
+'''
+inventory_db = f'{script_dir}/inventory.sqlite3'
+inventory_template_oids = {}
+
+# RESULTS RETENTION(LOGS: logs_to_keep)
+'''
+RESULTS_<date> dirs not among results_keep newest AND older than results_keep_days are archived
+to results_archive_dir/RESULTS_<date>.tar.<archive_compression>(0600), keys(.key/.pfx) are overwritten,
+dir is removed. results_archive_dir = None - remove without archive, results_retention_enabled = False - keep all.
+Archives older than archive_keep_days are deleted(None - keep forever).
+results_keep_days must be above cert lifetime + renewal window: cert inventory & renewal(--renew) read live
+RESULTS_<date> dirs only, archived certs drop out of expiry queries and their keys are not reused.
+Off by default in app.py runs.
+cron/manual run: python3 -m app_scripts.retention --dry-run
+'''
+results_retention_enabled = False
+results_keep = 7
+results_keep_days = 400
+results_archive_dir = f'{script_dir}/archive'
+archive_compression = 'gz'
+archive_keep_days = 365
+
+# RUN REPORT
+'''
+run_report_json: stage/step duration histograms, counters & per-CN durations of the run(saved in results dir)
+prom_file: Prometheus textfile-collector file(node_exporter --collector.textfile.directory), None - off
+    i.e. /var/lib/node_exporter/textfile_collector/pki_auto.prom
+'''
+run_report_json = f'run_report_{start_date_n_time.strftime("%H-%M-%S")}.json'
+prom_file = f'{script_dir}/pki_auto.prom'
+
 # template for PKI to use
 template = 'Web client and server'
 
 # pfx pass for making pfx file
 pfx_pass = '123'
 
-# OpenSSL binary path
+# PRE-GENERATED KEYS POOL
+'''
+key_pool_enabled: take keys from key_pool_dir instead of generating them on the critical path
+pool is refilled in background during the run, or from cron: python3 -m app_scripts.key_pool
+'''
+key_pool_enabled = False
+key_pool_dir = f'{script_dir}/key_pool'
+key_pool_size = 100
+
+# CRYPTO BACKEND FOR KEY/CSR/PFX
+'''
+python - in-process by cryptography lib(default, falls back to openssl if lib is not installed)
+openssl - openssl_bin subprocess
+'''
+crypto_backend = 'python'
+
+# KEY TYPE OF NEW KEYS
+'''
+rsa2048, rsa3072, rsa4096, ecdsa-p256, ecdsa-p384, ed25519(crypto_backend.key_types)
+cns_data key_type option overrides it per CN, key pool is filled with keys of this type
+ECDSA keys are generated orders of magnitude faster than RSA(keygen stops limiting big batches);
+check CA template allows key algorithm: Ed25519 is accepted by few CAs/templates
+'''
+key_type = 'rsa2048'
+
+# OpenSSL binary path(openssl crypto backend only)
 # openssl_bin = r'C:\Program Files\OpenSSL-Win64\bin\openssl.exe'
 openssl_bin = r'/usr/bin/openssl'
 
 # certificate extension
 cer_ext = 'crt'
 
+# workers for parallel keygen(CSR&KEY) stage
+keygen_workers = cpu_count()
+
+# python crypto backend: new keys on process pool(one process per keygen worker) instead of keygen worker threads
+# (threads scale over cores only as far as cryptography releases GIL during keygen, openssl backend: not used)
+keygen_processes = False
+
+# ISSUER ENGINE
+'''
+playwright - drive certsrv pages with headless Chromium(default)
+http - post CSR to certsrv directly with requests, no browser
+local - sign CSR with local file-based CA(local_ca_* below), no CA server/credentials: load tests, offline issuance
+'''
+issuer_engine = 'playwright'
+
+# RUN MODE
+'''
+staged - keygen, CA submission & pfx stages overlap, connected by bounded queues(default)
+batch - all keys, then all certs(sync or async by issuer_concurrency), then all pfx
+'''
+run_mode = 'staged'
+
+# pfx stage workers(staged mode)
+pfx_workers = 2
+
+# max jobs waiting in each stage queue(staged mode)
+stage_queue_size = 100
+
+# seconds between stages queue depth/throughput log lines(staged mode), 0 - only final report
+stage_report_interval = 10
+
+# ISSUANCE SERVICE(python3 app.py --serve)
+'''
+one warm staged pipeline(CA sessions, browsers, key pool) for the service life, jobs come over local API
+service_listen: API address, "unix:<socket path>"(socket file gets 0600, only service user can submit jobs)
+    or "127.0.0.1:<port>"(loopback only, requests need "Authorization: Bearer <token of service_token_file>")
+service_token_file: bearer token of TCP API, made with random token(0600) on first service start, must stay 0600
+service_priority: priority of jobs without own one, lower is sooner(urgent request: "priority": 0)
+service_jobs_kept: finished jobs kept in memory for GET /jobs/<id>, also last CN records & timings kept by run metrics
+python3 -m app_scripts.issuance_service <cn> --wait 120 - submit CN & wait for result
+'''
+service_listen = f'unix:{data_files}/issuance_service.sock'
+service_token_file = f'{data_files}/service_token'
+service_priority = 100
+service_jobs_kept = 10000
+
+# CA SUBMISSIONS IN FLIGHT
+'''
+batch mode:
+    1 - one by one(sync mode)
+    >1 - asyncio mode, up to issuer_concurrency submissions at once
+staged mode: CA submission stage workers(one browser per worker for playwright engine)
+'''
+issuer_concurrency = 1
+
+# per-CN CA submission timeout(async mode), seconds
+# (http/local issuers run on worker threads which timeout cannot stop: timed out CN is failed, not retried)
+issuer_timeout = 120
+
+# CA SUBMISSION CONTROLLER(ALL MODES)
+'''
+retries: transient failures(timeouts, connection errors, 5xx) are retried up to ca_max_attempts times,
+    delay is random 0..ca_backoff_base x 2^(attempt-1) seconds(max ca_backoff_max)
+circuit breaker: after ca_breaker_threshold transient failures in a row submissions pause for ca_breaker_reset
+    seconds, then one probe submission decides to resume or pause again
+adaptive concurrency(AIMD): submissions in flight float between ca_min_concurrency and issuer_concurrency,
+    +1 per window of successes, halved on transient error or latency above ca_latency_tolerance x best latency
+'''
+ca_max_attempts = 3
+ca_backoff_base = 2
+ca_backoff_max = 60
+ca_breaker_threshold = 5
+ca_breaker_reset = 60
+ca_adaptive_concurrency = True
+ca_min_concurrency = 1
+ca_latency_tolerance = 2.0
+
+# CA template names for http engine(CertificateTemplate attribute, NOT display label)
+http_templates = {
+    'SSL': '23https-ssl',
+    'Ldaps for pam': '23LDAPS_for_PAM',
+    'Web client and server': '23WebClientandServer'
+}
+
+# CERTSRV FORM(PLAYWRIGHT ENGINE)
+'''
+browser_templates: template name -> certsrv form option label(display label, NOT CA template name),
+    new CA template needs only new entry here; label is checked against templates shown on CA form
+certsrv_form_cache: form page url, field selectors & template options discovered on first submission per CA url,
+    later submissions open form page directly(no home -> "Request a certificate" -> "Submit..." page loads)
+certsrv_form_ttl: seconds cached form is trusted, form is discovered again after it(or when form page does not match)
+python3 -m app_scripts.certsrv_form [--refresh] shows templates available on CA endpoints
+'''
+browser_templates = {
+    'SSL': '23https/ssl',
+    'Ldaps for pam': '23LDAPS_for_PAM',
+    'Web client and server': '23Web Client and Server'
+}
+certsrv_form_cache = f'{script_dir}/certsrv_form_cache.json'
+certsrv_form_ttl = 86400
+
+# LOCAL CA(LOCAL ENGINE)
+'''
+local_ca_dir: CA key(0600) & cert, made on first run, certs are signed in-process(cryptography lib)
+local_ca_key_type: CA key type(see KEY TYPE)
+local_ca_templates: template name -> cert profile:
+    ca_template - MS CA template name written to cert(template name extension, as MS CA does),
+    key_usage - KeyUsage flags, extended_key_usage - ExtendedKeyUsage names(server_auth, client_auth, ...),
+    days - cert validity; subject & SANs are taken from CSR
+'''
+local_ca_dir = f'{script_dir}/local_ca'
+local_ca_key_type = 'ecdsa-p256'
+local_ca_templates = {
+    'SSL': {
+        'ca_template': '23https-ssl',
+        'key_usage': ('digital_signature', 'key_encipherment'),
+        'extended_key_usage': ('server_auth',),
+        'days': 365
+    },
+    'Ldaps for pam': {
+        'ca_template': '23LDAPS_for_PAM',
+        'key_usage': ('digital_signature', 'key_encipherment'),
+        'extended_key_usage': ('server_auth',),
+        'days': 365
+    },
+    'Web client and server': {
+        'ca_template': '23WebClientandServer',
+        'key_usage': ('digital_signature', 'key_encipherment'),
+        'extended_key_usage': ('server_auth', 'client_auth'),
+        'days': 365
+    }
+}
+
+# CA ENDPOINTS
+'''
+script_data with single pki-url: one CA endpoint
+script_data with "endpoints" list(see data_files/data-prod-endpoints_BLANK.json): CNs go to healthy endpoint
+    with least latency x load, each endpoint has own credentials(default: top level pki-user/pki-pass),
+    concurrency(default: issuer_concurrency), AIMD limit and circuit breaker(ca_* settings),
+    submission failed on one endpoint is retried on other, run report shows endpoint of every cert
+'''
+
 # TEST
 # script_data = f'{data_files}/data-test.json'
 
 # PROD
 script_data = f'{data_files}/data-prod.json'
-cns_data = f'{data_files}/cns_data'
 
-with open(script_data, encoding='utf-8') as file:
-    data = json.load(file)
-    pki_url = data['pki-url']
-    pki_user = data['pki-user']
-    pki_pass = data['pki-pass']
+# CNS INPUT
+'''
+cns_data - one CN per line(default)
+cns_data.csv - columns: cn,sans,template,key_type,pfx_pass(all but cn optional, sans separated by ";")
+cns_data.jsonl - one object per line: {"cn": ..., "sans": [...], "template": ..., "key_type": ..., "pfx_pass": ...}
+'''
+cns_data = f'{data_files}/cns_data'
 
 # PROXY
 proxies = {
     'http': None,
     'https': None
 }
+
+
+# LAZY SETTINGS(DATA FILES ARE READ ON FIRST ACCESS ONLY)
+class Settings:
+    """
+    Settings read from data files, each file is read once, on first access to any of its values.
+    Module attributes below(pki_url, smtp_server, ...) are served from here,
+    so "from project_static import pki_url" reads script_data only when it is imported.
+    """
+    @staticmethod
+    def _read(file_path):
+        try:
+            with open(file_path, encoding='utf-8') as file:
+                return json.load(file)
+        except FileNotFoundError:
+            raise Exception(f'CONFIG FILE NOT FOUND: {file_path}')
+
+    @cached_property
+    def pki(self) -> dict:
+        return self._read(script_data)
+
+    @cached_property
+    def mailing(self) -> dict:
+        return self._read(mailing_data)
+
+    @cached_property
+    def pki_endpoints(self) -> list:
+        """
+        CA endpoints from script_data "endpoints" list(pki-url, optional name/pki-user/pki-pass/concurrency,
+        top level pki-user/pki-pass are defaults), single endpoint of top level pki-url if list is not set.
+        """
+        endpoints = self.pki.get('endpoints') or [{'name': 'default', 'pki-url': self.pki['pki-url']}]
+        return [
+            {
+                'name': endpoint.get('name') or endpoint['pki-url'],
+                'url': endpoint['pki-url'],
+                'user': endpoint.get('pki-user', self.pki.get('pki-user')),
+                'password': endpoint.get('pki-pass', self.pki.get('pki-pass')),
+                'concurrency': endpoint.get('concurrency')
+            }
+            for endpoint in endpoints
+        ]
+
+
+settings = Settings()
+
+# LAZY MODULE ATTRIBUTES: name -> (settings property, key in its data file or None for whole value)
+lazy_settings = {
+    'pki_endpoints': ('pki_endpoints', None),
+    'pki_url': ('pki', 'pki-url'),
+    'pki_user': ('pki', 'pki-user'),
+    'pki_pass': ('pki', 'pki-pass'),
+    'smtp_server': ('mailing', 'smtp_server'),
+    'smtp_port': ('mailing', 'smtp_port'),
+    'smtp_login': ('mailing', 'smtp_login'),
+    'smtp_pass': ('mailing', 'smtp_pass'),
+    'smtp_from_addr': ('mailing', 'smtp_from_addr'),
+    'mail_list_admins': ('mailing', 'list_admins'),
+    'mail_list_users': ('mailing', 'list_users')
+}
+
+
+def __getattr__(name):
+    if name in lazy_settings:
+        data_name, key = lazy_settings[name]
+        data = getattr(settings, data_name)
+        return data if key is None else data[key]
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -0,0 +1,253 @@
+"""
+CA submission controller on fake CA calls & fake clock:
+ - transient/permanent error classification, retries & backoff, no retry after CSR is sent
+ - circuit breaker open -> half-open probe -> closed/open again
+ - AIMD limit decrease(once per congestion burst) & increase
+ - failover to other endpoint, sync & asyncio submissions
+"""
+
+import asyncio
+
+import pytest
+import requests
+
+from app_scripts import ca_controller
+from app_scripts.ca_controller import (
+    AimdLimiter, CaRequestError, CircuitBreaker, CircuitOpenError, SubmissionController, is_transient
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(ca_controller, 'time', clock)
+    return clock
+
+
+# CA call answering with scripted errors, then cert path
+class FakeCa:
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = []
+
+    def __call__(self, endpoint):
+        self.calls.append(endpoint.name)
+        if self.errors:
+            raise self.errors.pop(0)
+        return f'/results/{endpoint.name}.crt'
+
+
+def _http_error(status_code):
+    response = requests.Response()
+    response.status_code = status_code
+    return requests.HTTPError(f'{status_code} error', response=response)
+
+
+@pytest.mark.parametrize('error', [
+    TimeoutError('timed out'),
+    ConnectionResetError('reset'),
+    requests.ConnectTimeout('connect timeout'),
+    requests.ConnectionError('refused'),
+    asyncio.TimeoutError(),
+    Exception('TIMEOUT: cert for cn not issued in 1s, cancelled'),
+    Exception('page.goto: net::ERR_CONNECTION_REFUSED at https://ca/certsrv'),
+    _http_error(503),
+    _http_error(429),
+])
+def test_transient_errors(error):
+    assert is_transient(error)
+
+
+@pytest.mark.parametrize('error', [
+    CaRequestError('denied', 'denied', '7'),
+    CaRequestError('pending', 'pending', '8'),
+    CaRequestError('issued, not saved', 'issued', '9'),
+    CaRequestError('answer lost', 'unknown'),
+    CircuitOpenError('open'),
+    AssertionError('no result page'),
+    FileNotFoundError('no csr'),
+    PermissionError('read-only results dir'),
+    Exception('TEMPLATE NOT IN LIST, CHECK TEMPLATE TYPE(x)'),
+    _http_error(404),
+    _http_error(401),
+])
+def test_permanent_errors(error):
+    assert not is_transient(error)
+
+
+def test_transient_error_is_retried_with_backoff(clock):
+    controller = SubmissionController(max_attempts=3, backoff_base=1, backoff_max=10)
+    ca = FakeCa(TimeoutError('timed out'), _http_error(503))
+    job = {}
+
+    assert controller.submit(ca, 'host.example.test', job) == '/results/default.crt'
+    assert ca.calls == ['default'] * 3
+    assert controller.retries == 2
+    assert job['ca_endpoint'] == 'default'
+    # full jitter: random 0..base x 2^(attempt-1)
+    assert len(clock.sleeps) == 2
+    assert 0 <= clock.sleeps[0] <= 1 and 0 <= clock.sleeps[1] <= 2
+
+
+def test_retries_stop_at_max_attempts(clock):
+    controller = SubmissionController(max_attempts=2, backoff_base=0)
+    ca = FakeCa(TimeoutError('first'), TimeoutError('second'), TimeoutError('third'))
+
+    with pytest.raises(TimeoutError, match='second'):
+        controller.submit(ca, 'host.example.test')
+    assert len(ca.calls) == 2
+    assert controller.retries == 1
+
+
+@pytest.mark.parametrize('error', [
+    CaRequestError('denied', 'denied', '7'),
+    CaRequestError('issued, not saved', 'issued', '9'),
+    Exception('TEMPLATE NOT IN LIST, CHECK TEMPLATE TYPE(x)'),
+])
+def test_permanent_error_is_not_retried(clock, error):
+    controller = SubmissionController(max_attempts=5, backoff_base=0)
+    ca = FakeCa(error)
+
+    with pytest.raises(type(error)):
+        controller.submit(ca, 'host.example.test')
+    assert len(ca.calls) == 1
+    assert controller.retries == 0
+    # CA answered: circuit stays healthy
+    assert controller.endpoints[0].breaker.failures == 0
+
+
+def test_unknown_answer_is_not_retried_but_is_congestion(clock):
+    controller = SubmissionController(max_concurrency=8, max_attempts=5, backoff_base=0, breaker_threshold=1)
+    endpoint = controller.endpoints[0]
+    limit = endpoint.limiter.current
+    ca = FakeCa(CaRequestError('CSR SENT, answer lost', 'unknown'))
+
+    with pytest.raises(CaRequestError) as error:
+        controller.submit(ca, 'host.example.test')
+    assert error.value.outcome == 'unknown'
+    assert len(ca.calls) == 1
+    assert controller.retries == 0
+    assert endpoint.limiter.current < limit
+    assert endpoint.breaker.state == 'open'
+
+
+def test_circuit_opens_half_opens_and_closes(clock):
+    breaker = CircuitBreaker(threshold=3, reset_timeout=60)
+    for _ in range(2):
+        breaker.record(False)
+    assert breaker.state == 'closed' and breaker.before_call() == 0
+    breaker.record(False)
+    assert breaker.state == 'open' and breaker.opens == 1
+    assert breaker.before_call() == pytest.approx(60)
+
+    clock.advance(30)
+    assert breaker.wait_time() == pytest.approx(30)
+    clock.advance(30)
+    # one probe is let through, others wait for its result
+    assert breaker.before_call() == 0
+    assert breaker.state == 'half-open'
+    assert breaker.before_call() > 0
+    breaker.record(True)
+    assert breaker.state == 'closed' and breaker.failures == 0
+    assert breaker.before_call() == 0
+
+
+def test_failed_probe_opens_circuit_again(clock):
+    breaker = CircuitBreaker(threshold=1, reset_timeout=10)
+    breaker.record(False)
+    clock.advance(10)
+    assert breaker.before_call() == 0
+    breaker.record(False)
+    assert breaker.state == 'open' and breaker.opens == 2
+    assert breaker.wait_time() == pytest.approx(10)
+
+
+def test_open_circuit_fails_submission_after_max_wait(clock):
+    controller = SubmissionController(max_attempts=1, breaker_threshold=1, breaker_reset=60, breaker_max_wait=0)
+    with pytest.raises(TimeoutError):
+        controller.submit(FakeCa(TimeoutError('timed out')), 'first.example.test')
+
+    ca = FakeCa()
+    with pytest.raises(CircuitOpenError):
+        controller.submit(ca, 'second.example.test')
+    assert ca.calls == []
+
+
+def test_aimd_decrease_once_per_burst_and_increase(clock):
+    limiter = AimdLimiter(max_limit=16, initial=8)
+    started = [limiter.acquire() for _ in range(3)]
+    clock.advance(1)
+    # burst of errors from submissions started before the first decrease: one halving only
+    for start in started:
+        limiter.release(start, 1.0, True)
+    assert limiter.current == 4
+    assert limiter.in_flight == 0
+
+    # +1/limit per fast success: about +1 per <limit> successes
+    for _ in range(4):
+        limiter.release(limiter.acquire(), 1.0, False)
+    assert limiter.current == 4
+    limiter.release(limiter.acquire(), 1.0, False)
+    assert limiter.current == 5
+
+
+def test_aimd_decreases_on_high_latency(clock):
+    limiter = AimdLimiter(max_limit=16, initial=8, latency_tolerance=2.0)
+    limiter.release(limiter.acquire(), 1.0, False)
+    assert limiter.best_latency == 1.0
+    clock.advance(1)
+    limiter.release(limiter.acquire(), 3.0, False)
+    assert limiter.current == 4
+
+
+def test_aimd_limit_is_fixed_if_not_adaptive(clock):
+    limiter = AimdLimiter(max_limit=4, adaptive=False)
+    limiter.release(limiter.acquire(), 1.0, True)
+    assert limiter.current == 4
+
+
+def test_failover_to_other_endpoint_without_backoff(clock):
+    controller = SubmissionController(
+        max_attempts=3, backoff_base=10,
+        endpoints=[{'name': 'ca1', 'url': 'https://ca1'}, {'name': 'ca2', 'url': 'https://ca2'}]
+    )
+    ca = FakeCa(_http_error(503))
+    job = {}
+
+    assert controller.submit(ca, 'host.example.test', job) == f'/results/{ca.calls[1]}.crt'
+    assert ca.calls[0] != ca.calls[1]
+    assert job['ca_endpoint'] == ca.calls[1]
+    assert clock.sleeps == [0]
+    assert controller.endpoints[0].limiter.in_flight == controller.endpoints[1].limiter.in_flight == 0
+
+
+def test_async_submission_retries_transient_only(clock):
+    controller = SubmissionController(max_attempts=3, backoff_base=0)
+    ca = FakeCa(TimeoutError('timed out'))
+
+    async def coro_factory(endpoint):
+        return ca(endpoint)
+
+    assert asyncio.run(controller.submit_async(coro_factory, 'host.example.test')) == '/results/default.crt'
+    assert len(ca.calls) == 2
+
+    ca = FakeCa(CaRequestError('answer lost', 'unknown'))
+    with pytest.raises(CaRequestError):
+        asyncio.run(controller.submit_async(coro_factory, 'other.example.test'))
+    assert len(ca.calls) == 1
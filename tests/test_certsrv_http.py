@@ -0,0 +1,138 @@
+"""
+certsrv_http engine against local certsrv stand-in(mock_certsrv):
+ - submit CSR -> request ID -> base64 cert download round trip
+ - denied/unavailable CA answers and their retry classification
+"""
+
+import os
+import stat
+
+import pytest
+import requests
+from cryptography import x509
+from cryptography.hazmat.primitives import serialization
+
+from project_static import http_templates
+from app_scripts.ca_controller import CaRequestError, SubmissionController, is_transient
+from app_scripts.certsrv_http import make_certsrv_session, submit_csr, download_cert, create_cert_http
+from app_scripts.crypto_backend import PythonBackend
+from app_scripts import mock_certsrv
+from app_scripts.mock_certsrv import MockCertsrv
+
+template = next(iter(http_templates))
+
+
+@pytest.fixture
+def csr(tmp_path):
+    key_pem, csr_pem = PythonBackend().make_csr('host.example.test', str(tmp_path), str(tmp_path),
+                                                sans=['host.example.test', 'alt.example.test'])
+    return {'path': str(tmp_path / 'host.example.test.csr'), 'pem': csr_pem, 'key_pem': key_pem}
+
+
+@pytest.fixture
+def session():
+    session = make_certsrv_session('user', 'password')
+    yield session
+    session.close()
+
+
+def _public_bytes(public_key):
+    return public_key.public_bytes(serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo)
+
+
+def test_submit_and_download_round_trip(csr, session):
+    with MockCertsrv(user='user') as mock:
+        req_id = submit_csr(session, mock.url, csr['pem'].decode(), http_templates[template])
+        cert_pem = download_cert(session, mock.url, req_id)
+
+    cert = x509.load_pem_x509_certificate(cert_pem.encode())
+    key = serialization.load_pem_private_key(csr['key_pem'], password=None)
+    assert req_id == '1'
+    assert _public_bytes(cert.public_key()) == _public_bytes(key.public_key())
+    assert cert.subject.rfc4514_string() == 'CN=host.example.test'
+    sans = cert.extensions.get_extension_for_class(x509.SubjectAlternativeName).value
+    assert sans.get_values_for_type(x509.DNSName) == ['host.example.test', 'alt.example.test']
+
+
+def test_create_cert_http_saves_cert_and_job_info(csr, session, tmp_path):
+    cert_info = {}
+    with MockCertsrv() as mock:
+        cert_path = create_cert_http(mock.url, csr['path'], template, 'host.example.test', 'crt', str(tmp_path),
+                                     session, http_templates, cert_info)
+
+    assert cert_path == f'{tmp_path}/host.example.test.crt'
+    with open(cert_path, 'rb') as file:
+        assert file.read() == cert_info['cer_pem']
+    assert stat.S_IMODE(os.stat(cert_path).st_mode) == 0o644
+    assert cert_info['ca_request_id'] == '1'
+    assert cert_info['ca_submitted']
+    assert set(cert_info['step_timings']) == {'submit', 'download'}
+
+
+def test_csr_buffer_is_submitted_instead_of_file(csr, session, tmp_path):
+    os.remove(csr['path'])
+    cert_info = {'csr_pem': csr['pem']}
+    with MockCertsrv() as mock:
+        cert_path = create_cert_http(mock.url, csr['path'], template, 'host.example.test', 'crt', str(tmp_path),
+                                     session, http_templates, cert_info)
+    assert os.path.isfile(cert_path)
+
+
+def test_unknown_template_is_not_submitted(csr, session, tmp_path):
+    with MockCertsrv() as mock:
+        with pytest.raises(Exception, match='TEMPLATE NOT IN LIST'):
+            create_cert_http(mock.url, csr['path'], 'No such template', 'host.example.test', 'crt', str(tmp_path),
+                             session, http_templates)
+        assert mock.requests == 0
+
+
+def test_denied_request_is_final(csr, session, tmp_path):
+    controller = SubmissionController(max_attempts=3, backoff_base=0.01)
+    with MockCertsrv(error_rate=1) as mock:
+        with pytest.raises(CaRequestError) as error:
+            controller.submit(lambda endpoint: create_cert_http(
+                mock.url, csr['path'], template, 'host.example.test', 'crt', str(tmp_path), session, http_templates
+            ), 'host.example.test')
+
+    assert error.value.outcome == 'denied'
+    assert 'Denied by Policy Module' in str(error.value)
+    assert not is_transient(error.value)
+    assert controller.retries == 0
+    assert controller.endpoints[0].breaker.state == 'closed'
+
+
+def test_unavailable_ca_is_retried(csr, session, tmp_path, monkeypatch):
+    with MockCertsrv(unavailable_rate=1) as mock:
+        with pytest.raises(requests.HTTPError) as error:
+            submit_csr(session, mock.url, csr['pem'].decode(), http_templates[template])
+    assert error.value.response.status_code == 503
+    assert is_transient(error.value)
+
+    # two 503 answers, then CA accepts
+    draws = iter([0.0, 0.0, 1.0])
+    monkeypatch.setattr(mock_certsrv.random, 'random', lambda: next(draws, 1.0))
+    controller = SubmissionController(max_attempts=5, backoff_base=0.01)
+    with MockCertsrv(unavailable_rate=0.5) as mock:
+        cert_path = controller.submit(lambda endpoint: create_cert_http(
+            mock.url, csr['path'], template, 'host.example.test', 'crt', str(tmp_path), session, http_templates
+        ), 'host.example.test')
+        # only accepted submission reaches CA: no duplicate requests
+        assert mock.requests == 1
+    assert controller.retries == 2
+    assert os.path.isfile(cert_path)
+
+
+def test_lost_answer_is_not_resubmitted(csr, session):
+    with MockCertsrv(latency=0.5) as mock:
+        with pytest.raises(CaRequestError) as error:
+            submit_csr(session, mock.url, csr['pem'].decode(), http_templates[template], timeout=0.1)
+    assert error.value.outcome == 'unknown'
+    assert not is_transient(error.value)
+
+
+def test_refused_connection_is_transient(csr, session):
+    with MockCertsrv() as mock:
+        url = mock.url
+    with pytest.raises(requests.ConnectionError) as error:
+        submit_csr(session, url, csr['pem'].decode(), http_templates[template], timeout=1)
+    assert is_transient(error.value)
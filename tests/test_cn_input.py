@@ -0,0 +1,106 @@
+"""
+CN input reader:
+ - plain/CSV/JSONL rows with options, comments & blank lines
+ - invalid rows skipped, reading goes on
+ - case-insensitive dedup, CN & SANs kept as given
+ - write_cn_rows output is read back the same
+"""
+
+import json
+
+import pytest
+
+from app_scripts.cn_input import parse_cn_row, parse_sans, read_cn_rows, validate_dns_name, write_cn_rows
+
+
+def _write(path, text):
+    path.write_text(text, encoding='utf-8')
+    return str(path)
+
+
+@pytest.mark.parametrize('name', ['host.example.test', '*.example.test', 'a-b.c1.example.test', 'localhost'])
+def test_valid_dns_names(name):
+    validate_dns_name(name)
+
+
+@pytest.mark.parametrize('name', ['', '*', '-host.example.test', 'host..example.test', 'host_1.example.test',
+                                  'host.example.test/x', 'a' * 64 + '.example.test', 'a.' * 127 + 'test'])
+def test_invalid_dns_names(name):
+    with pytest.raises(ValueError):
+        validate_dns_name(name)
+
+
+def test_parse_sans():
+    assert parse_sans('a.example.test; b.example.test,c.example.test d.example.test') == [
+        'a.example.test', 'b.example.test', 'c.example.test', 'd.example.test'
+    ]
+    assert parse_sans([' a.example.test ', '', 'B.example.test']) == ['a.example.test', 'B.example.test']
+    assert parse_sans(None) == []
+
+
+def test_plain_list(tmp_path):
+    path = _write(tmp_path / 'cns', '# comment\n\nhost1.example.test\n  host2.example.test  \nbad_name\n')
+    assert list(read_cn_rows(path)) == [{'cn': 'host1.example.test'}, {'cn': 'host2.example.test'}]
+
+
+def test_duplicates_are_case_insensitive_and_first_spelling_is_kept(tmp_path):
+    path = _write(tmp_path / 'cns', 'Host.Example.test\nhost.example.test\nHOST.EXAMPLE.TEST\nother.example.test\n')
+    assert list(read_cn_rows(path)) == [{'cn': 'Host.Example.test'}, {'cn': 'other.example.test'}]
+
+
+def test_csv_rows_with_options(tmp_path):
+    path = _write(tmp_path / 'cns.csv', (
+        'cn,sans,template,key_type,pfx_pass\n'
+        '# comment row\n'
+        'web.example.test,Web.example.test;www.example.test,WebServer,ecdsa-p256,secret\n'
+        'plain.example.test,,,,\n'
+        'badsan.example.test,bad_san,,,\n'
+        'badtemplate.example.test,,NoSuchTemplate,,\n'
+        'badkey.example.test,,,dsa1024,\n'
+    ))
+    rows = list(read_cn_rows(path, templates={'WebServer': 'Web Server'}, key_types=('rsa2048', 'ecdsa-p256')))
+    assert rows == [
+        {'cn': 'web.example.test', 'sans': ['Web.example.test', 'www.example.test'], 'template': 'WebServer',
+         'key_type': 'ecdsa-p256', 'pfx_pass': 'secret'},
+        {'cn': 'plain.example.test'}
+    ]
+
+
+def test_jsonl_rows_and_bad_lines(tmp_path):
+    path = _write(tmp_path / 'cns.jsonl', '\n'.join([
+        json.dumps({'cn': 'a.example.test', 'sans': ['a.example.test', 'alt.example.test']}),
+        '{not json',
+        json.dumps(['not', 'object']),
+        '# comment',
+        json.dumps({'cn': 'b.example.test', 'template': 'WebServer'}),
+    ]) + '\n')
+    assert list(read_cn_rows(path)) == [
+        {'cn': 'a.example.test', 'sans': ['a.example.test', 'alt.example.test']},
+        {'cn': 'b.example.test', 'template': 'WebServer'}
+    ]
+
+
+def test_input_format_overrides_extension(tmp_path):
+    path = _write(tmp_path / 'cns.txt', '{"cn": "a.example.test"}\n')
+    assert list(read_cn_rows(path, 'jsonl')) == [{'cn': 'a.example.test'}]
+
+
+def test_parse_cn_row_keeps_cn_as_given():
+    assert parse_cn_row({'cn': '  Mixed.Example.test ', 'sans': 'Alt.Example.test'}) == {
+        'cn': 'Mixed.Example.test', 'sans': ['Alt.Example.test']
+    }
+    with pytest.raises(ValueError, match='unknown template'):
+        parse_cn_row({'cn': 'a.example.test', 'template': 'x'}, templates={'WebServer': 'Web Server'})
+
+
+@pytest.mark.parametrize('file_name', ['cns', 'cns.csv', 'cns.jsonl'])
+def test_written_rows_are_read_back(tmp_path, file_name):
+    rows = [
+        {'cn': 'a.example.test', 'sans': ['a.example.test', 'b.example.test'], 'template': 'WebServer',
+         'key_type': 'rsa2048', 'pfx_pass': 'secret'},
+        {'cn': 'c.example.test'}
+    ]
+    path = str(tmp_path / file_name)
+    assert write_cn_rows(path, rows) == 2
+    expected = rows if file_name != 'cns' else [{'cn': row['cn']} for row in rows]
+    assert list(read_cn_rows(path)) == expected
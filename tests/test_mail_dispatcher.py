@@ -0,0 +1,112 @@
+"""
+mail_dispatcher against local SMTP stand-in(mock_smtp):
+ - one kept-alive connection & per-recipient digests(batching)
+ - reconnect & resend on dropped connection(retry)
+ - full queue, closed dispatcher & unreachable server(drop/fail, senders never raise)
+"""
+
+from time import monotonic, sleep
+
+from app_scripts.mail_dispatcher import MailDispatcher, cn_notifier
+from app_scripts.mock_smtp import MockSmtp
+
+
+def _wait_for(condition, timeout=5):
+    deadline = monotonic() + timeout
+    while not condition() and monotonic() < deadline:
+        sleep(0.02)
+    return condition()
+
+
+def _subjects(smtp):
+    return [
+        next(line[len('Subject: '):] for line in body.splitlines() if line.startswith('Subject: '))
+        for _, _, body in smtp.messages
+    ]
+
+
+def test_mails_and_digests_share_one_connection():
+    with MockSmtp() as smtp:
+        with MailDispatcher(smtp.host, smtp.port, 'pki@example.test', appname='PKI', digest_interval=0) as mailer:
+            for num in range(5):
+                mailer.notify(['a@example.test', 'b@example.test'], f'cn{num}.example.test: certificate issued')
+            assert mailer.send('admin@example.test', 'report', 'body')
+            assert mailer.send(['a@example.test', 'b@example.test'], 'report 2', 'body 2')
+
+    assert mailer.sent == 4
+    assert mailer.failed == mailer.dropped == 0
+    assert smtp.connections == mailer.connects == 1
+    subjects = _subjects(smtp)
+    assert subjects[:2] == ['report', 'report 2']
+    digests = [(rcpt, body) for _, rcpt, body in smtp.messages[2:]]
+    assert sorted(rcpt[0] for rcpt, _ in digests) == ['<a@example.test>', '<b@example.test>']
+    assert all(subject.startswith('PKI - 5 notifications') for subject in subjects[2:])
+    for _, body in digests:
+        assert all(f'cn{num}.example.test: certificate issued' in body for num in range(5))
+
+
+def test_digest_is_sent_every_interval():
+    with MockSmtp() as smtp:
+        with MailDispatcher(smtp.host, smtp.port, 'pki@example.test', digest_interval=0.2) as mailer:
+            mailer.notify('a@example.test', 'cn1.example.test: certificate issued')
+            assert _wait_for(lambda: len(smtp.messages) == 1)
+            mailer.notify('a@example.test', 'cn2.example.test: certificate issued')
+        assert len(smtp.messages) == 2
+
+    assert 'cn1.example.test' in smtp.messages[0][2] and 'cn2.example.test' not in smtp.messages[0][2]
+    assert 'cn2.example.test' in smtp.messages[1][2]
+
+
+def test_dropped_connection_is_reconnected():
+    with MockSmtp(drop_after=1) as smtp:
+        with MailDispatcher(smtp.host, smtp.port, 'pki@example.test', digest_interval=0) as mailer:
+            for num in range(3):
+                mailer.send('admin@example.test', f'mail {num}', 'body')
+                assert _wait_for(lambda: mailer.sent == num + 1)
+
+    assert _subjects(smtp) == ['mail 0', 'mail 1', 'mail 2']
+    assert mailer.failed == 0
+    assert smtp.connections == mailer.connects == 3
+
+
+def test_full_queue_drops_new_mails():
+    with MockSmtp() as smtp:
+        mailer = MailDispatcher(smtp.host, smtp.port, 'pki@example.test', digest_interval=0, queue_size=2)
+        # sender thread is not started yet: queue fills up
+        assert mailer.send('admin@example.test', 'mail 0', 'body')
+        assert mailer.send('admin@example.test', 'mail 1', 'body')
+        assert not mailer.send('admin@example.test', 'mail 2', 'body')
+        mailer.start()
+        mailer.close()
+        assert not mailer.send('admin@example.test', 'after close', 'body')
+
+    assert _subjects(smtp) == ['mail 0', 'mail 1']
+    assert mailer.dropped == 1
+    assert mailer.sent == 2
+
+
+def test_unreachable_server_fails_without_raising():
+    with MockSmtp() as smtp:
+        host, port = smtp.host, smtp.port
+    mailer = MailDispatcher(host, port, 'pki@example.test', digest_interval=0, timeout=1)
+    mailer.start()
+    assert mailer.send('admin@example.test', 'report', 'body')
+    mailer.close()
+
+    assert mailer.failed == 1
+    assert mailer.sent == 0
+
+
+def test_cn_notifier_lines():
+    with MockSmtp() as smtp:
+        with MailDispatcher(smtp.host, smtp.port, 'pki@example.test', digest_interval=0) as mailer:
+            listener = cn_notifier(mailer, 'a@example.test')
+            listener({'cn': 'ok.example.test', 'pfx': '/results/ok.example.test.pfx'}, 'pfx', 0, 1, None)
+            listener({'cn': 'ok.example.test'}, 'issue', 0, 1, None)
+            listener({'cn': 'bad.example.test'}, 'issue', 0, 1, Exception('CERTIFICATE NOT ISSUED\ndetails'))
+
+    assert len(smtp.messages) == 1
+    body = smtp.messages[0][2]
+    assert 'ok.example.test: certificate issued, pfx ready: /results/ok.example.test.pfx' in body
+    assert 'bad.example.test: FAILED at issue: CERTIFICATE NOT ISSUED' in body
+    assert 'details' not in body
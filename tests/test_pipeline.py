@@ -0,0 +1,190 @@
+"""
+Staged pipeline on plain stage funcs(no crypto, no CA):
+ - jobs flow through stages, skipped stages, failed_stage propagation, listeners & on_finish
+ - bounded queues(backpressure on feed) & priority queues
+ - worker BaseException/failed worker setup/failed feed never hang run()
+"""
+
+from threading import Event, Thread
+from time import sleep
+
+import pytest
+
+from app_scripts.pipeline import Pipeline, Stage
+
+
+def _run(pipeline, jobs, on_finish=None, timeout=10):
+    """
+    Pipeline.run on thread, fails test instead of hanging it.
+    """
+    outcome = {}
+
+    def target():
+        try:
+            outcome['results'] = pipeline.run(jobs, on_finish)
+        except BaseException as e:
+            outcome['error'] = e
+
+    thread = Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), 'pipeline run hangs'
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome['results']
+
+
+def _mark(name):
+    def func(job):
+        job.setdefault('done', []).append(name)
+    return func
+
+
+def _jobs(count, **fields):
+    return [{'cn': f'cn{num}.example.test', **fields} for num in range(count)]
+
+
+def test_jobs_go_through_all_stages():
+    stages = [Stage('keygen', _mark('keygen'), 2), Stage('issue', _mark('issue'), 3), Stage('pfx', _mark('pfx'))]
+    results = _run(Pipeline(stages, report_interval=0), _jobs(20))
+
+    assert sorted(job['cn'] for job in results) == sorted(job['cn'] for job in _jobs(20))
+    assert all(job['done'] == ['keygen', 'issue', 'pfx'] for job in results)
+    assert [(stage.done, stage.failed) for stage in stages] == [(20, 0)] * 3
+    assert all(stage.stats()['elapsed'] >= 0 for stage in stages)
+
+
+def test_failed_job_skips_next_stages():
+    def issue(job):
+        if job['cn'].startswith('cn1.'):
+            raise Exception('CERTIFICATE NOT ISSUED')
+        job.setdefault('done', []).append('issue')
+
+    events = []
+    stages = [Stage('keygen', _mark('keygen')), Stage('issue', issue), Stage('pfx', _mark('pfx'))]
+    pipeline = Pipeline(stages, 0, [lambda job, stage, started_at, duration, error: events.append(
+        (job['cn'], stage, duration >= 0, error)
+    )])
+    results = {job['cn']: job for job in _run(pipeline, _jobs(3))}
+
+    failed = results['cn1.example.test']
+    assert failed['failed_stage'] == 'issue'
+    assert str(failed['error']) == 'CERTIFICATE NOT ISSUED'
+    assert failed['done'] == ['keygen']
+    assert results['cn0.example.test']['done'] == ['keygen', 'issue', 'pfx']
+    assert 'error' not in results['cn0.example.test']
+    assert stages[1].failed == 1 and stages[2].done == 2
+    assert ('cn1.example.test', 'issue', True, failed['error']) in events
+    assert not any(cn == 'cn1.example.test' and stage == 'pfx' for cn, stage, _, _ in events)
+
+
+def test_skipped_stage_passes_job_on():
+    stages = [Stage('keygen', _mark('keygen')), Stage('issue', _mark('issue'))]
+    results = _run(Pipeline(stages, 0), _jobs(2, skip={'keygen'}))
+
+    assert all(job['done'] == ['issue'] for job in results)
+    assert stages[0].skipped == 2 and stages[0].done == 0
+
+
+def test_on_finish_gets_jobs_instead_of_results():
+    finished = []
+    results = _run(Pipeline([Stage('keygen', _mark('keygen'))], 0), _jobs(5), finished.append)
+
+    assert results == []
+    assert len(finished) == 5
+
+
+def test_bounded_queue_blocks_feed():
+    release = Event()
+    fed = []
+
+    def slow(job):
+        release.wait(5)
+
+    def feed():
+        for job in _jobs(10):
+            fed.append(job['cn'])
+            yield job
+
+    stage = Stage('issue', slow, workers=1, queue_size=2)
+    thread = Thread(target=_run, args=(Pipeline([stage], 0), feed()), daemon=True)
+    thread.start()
+    # 1 job in worker, 2 in queue, feed blocked putting the 4th
+    for _ in range(100):
+        if len(fed) >= 4:
+            break
+        sleep(0.02)
+    sleep(0.2)
+    assert len(fed) == 4
+    assert stage.queue.qsize() == 2
+
+    release.set()
+    thread.join(10)
+    assert len(fed) == 10 and stage.done == 10
+    assert stage.max_depth <= 2
+
+
+def test_priority_queue_takes_lower_priority_first():
+    started = Event()
+    all_fed = Event()
+    order = []
+
+    def work(job):
+        if not started.is_set():
+            started.set()
+            all_fed.wait(5)
+        order.append(job['cn'])
+
+    def feed():
+        yield {'cn': 'first', 'priority': 50}
+        started.wait(5)
+        yield from ({'cn': f'p{priority}', 'priority': priority} for priority in (90, 10, 50, 10, 0))
+        all_fed.set()
+
+    _run(Pipeline([Stage('issue', work, priority=True)], 0), feed())
+
+    # FIFO within same priority: second p10 is the one fed later
+    assert order == ['first', 'p0', 'p10', 'p10', 'p50', 'p90']
+
+
+def test_worker_base_exception_does_not_hang_run():
+    def issue(job):
+        if job['cn'] == 'cn1.example.test':
+            raise SystemExit('worker killed')
+        job.setdefault('done', []).append('issue')
+
+    stages = [Stage('keygen', _mark('keygen'), queue_size=1), Stage('issue', issue, queue_size=1),
+              Stage('pfx', _mark('pfx'))]
+    results = {job['cn']: job for job in _run(Pipeline(stages, 0), _jobs(6))}
+
+    assert len(results) == 6
+    assert isinstance(results['cn1.example.test']['error'], SystemExit)
+    assert results['cn0.example.test']['done'] == ['keygen', 'issue', 'pfx']
+    # rest of broken worker's share fails fast with the same error
+    assert all(results[f'cn{num}.example.test']['failed_stage'] == 'issue' for num in range(1, 6))
+    assert stages[1].done == 1 and stages[1].failed == 5
+
+
+def test_failed_worker_setup_fails_jobs():
+    def broken_context():
+        raise Exception('BROWSER NOT STARTED')
+
+    stage = Stage('issue', lambda job, state: None, 2, 1, broken_context)
+    results = _run(Pipeline([stage], 0), _jobs(4))
+
+    assert len(results) == 4
+    assert all(str(job['error']) == 'BROWSER NOT STARTED' for job in results)
+
+
+def test_failed_feed_stops_stages():
+    def feed():
+        yield from _jobs(3)
+        raise RuntimeError('CNS FILE READ FAILED')
+
+    stage = Stage('keygen', _mark('keygen'), workers=2)
+    pipeline = Pipeline([stage], 0)
+    with pytest.raises(RuntimeError):
+        _run(pipeline, feed())
+
+    assert len(pipeline.results) == 3
+    assert not any(thread.is_alive() for thread in stage._threads)
@@ -0,0 +1,180 @@
+"""
+Resume & renewal planning on real key/CSR/cert/PFX files(python backend):
+ - plan_job skips steps done in CN dir(CSR & cert must match key, PFX not older than cert)
+ - job store state instead of CN dir check, --force
+ - renewal source: latest previous run with valid key, CN dir as given(mixed case)
+"""
+
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+
+from app_scripts.crypto_backend import PythonBackend
+from app_scripts.job_store import JobStore
+from app_scripts.resume import plan_job, plan_renewal, previous_cn_dirs
+
+cn = 'host.example.test'
+key_type = 'ecdsa-p256'
+
+
+@pytest.fixture
+def backend():
+    return PythonBackend()
+
+
+def _make_csr(backend, cn_path, name=cn):
+    os.makedirs(cn_path, exist_ok=True)
+    return backend.make_csr(name, cn_path, cn_path, key_type=key_type)
+
+
+# self-signed cert of key PEM(resume only checks that cert public key matches key)
+def _make_cert(cn_path, key_pem, name=cn):
+    key = serialization.load_pem_private_key(key_pem, password=None)
+    subject = x509.Name([x509.NameAttribute(x509.NameOID.COMMON_NAME, name)])
+    now = datetime.now(timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(subject)
+        .issuer_name(subject)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now)
+        .not_valid_after(now + timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    cert_path = f'{cn_path}/{name}.crt'
+    with open(cert_path, 'wb') as file:
+        file.write(cert.public_bytes(serialization.Encoding.PEM))
+    return cert_path
+
+
+def test_new_cn_does_all_steps(backend, tmp_path):
+    job = plan_job(backend, str(tmp_path), cn, 'crt')
+    assert job == {
+        'cn': cn,
+        'cn_path': f'{tmp_path}/{cn}',
+        'key': f'{tmp_path}/{cn}/{cn}.key',
+        'csr': f'{tmp_path}/{cn}/{cn}.csr',
+        'skip': set()
+    }
+
+
+def test_key_and_csr_skip_keygen(backend, tmp_path):
+    _make_csr(backend, f'{tmp_path}/{cn}')
+    job = plan_job(backend, str(tmp_path), cn, 'crt')
+    assert job['skip'] == {'keygen'}
+    assert 'cer' not in job and not job.get('reuse_key')
+
+
+def test_key_without_csr_is_reused(backend, tmp_path):
+    cn_path = f'{tmp_path}/{cn}'
+    _make_csr(backend, cn_path)
+    os.remove(f'{cn_path}/{cn}.csr')
+    job = plan_job(backend, str(tmp_path), cn, 'crt')
+    assert job['skip'] == set()
+    assert job['reuse_key']
+
+
+def test_cert_of_key_skips_issue(backend, tmp_path):
+    cn_path = f'{tmp_path}/{cn}'
+    key_pem, _ = _make_csr(backend, cn_path)
+    cert_path = _make_cert(cn_path, key_pem)
+    job = plan_job(backend, str(tmp_path), cn, 'crt')
+    assert job['skip'] == {'keygen', 'issue'}
+    assert job['cer'] == cert_path
+
+
+def test_cert_of_other_key_is_issued_again(backend, tmp_path):
+    cn_path = f'{tmp_path}/{cn}'
+    _make_csr(backend, cn_path)
+    other_key = backend.generate_key(key_type)
+    _make_cert(cn_path, other_key)
+    job = plan_job(backend, str(tmp_path), cn, 'crt')
+    assert job['skip'] == {'keygen'}
+
+
+def test_pfx_older_than_cert_is_made_again(backend, tmp_path):
+    cn_path = f'{tmp_path}/{cn}'
+    key_pem, _ = _make_csr(backend, cn_path)
+    cert_path = _make_cert(cn_path, key_pem)
+    backend.make_pfx(cn, cert_path, f'{cn_path}/{cn}.key', cn_path, 'pass')
+    assert plan_job(backend, str(tmp_path), cn, 'crt')['skip'] == {'keygen', 'issue', 'pfx'}
+
+    # cert issued again after PFX was made
+    pfx_mtime = os.path.getmtime(f'{cn_path}/{cn}.pfx')
+    os.utime(cert_path, (pfx_mtime + 10, pfx_mtime + 10))
+    assert plan_job(backend, str(tmp_path), cn, 'crt')['skip'] == {'keygen', 'issue'}
+
+
+def test_force_redoes_all_steps(backend, tmp_path):
+    cn_path = f'{tmp_path}/{cn}'
+    key_pem, _ = _make_csr(backend, cn_path)
+    _make_cert(cn_path, key_pem)
+    job = plan_job(backend, str(tmp_path), cn, 'crt', force=True)
+    assert job['skip'] == set()
+    assert not job.get('reuse_key')
+
+
+def test_job_store_state_is_used(backend, tmp_path):
+    results_dir = str(tmp_path / 'RESULTS_01-01-2026')
+    cn_path = f'{results_dir}/{cn}'
+    key_pem, _ = _make_csr(backend, cn_path)
+    store = JobStore(str(tmp_path / 'jobs.db'), 'run1')
+    try:
+        job = plan_job(backend, results_dir, cn, 'crt', store=store)
+        store.record_stage(job, 'keygen', 0, 0.1)
+        job['cer'] = _make_cert(cn_path, key_pem)
+        store.record_stage(job, 'issue', 0, 0.1, Exception('CERTIFICATE NOT ISSUED'))
+
+        # failed at issue: cert file in CN dir is not trusted, issue is done again
+        job = plan_job(backend, results_dir, cn, 'crt', store=store)
+        assert job['skip'] == {'keygen'}
+        assert job['job_id']
+
+        # CSR recorded in store is gone: keygen again with kept key
+        os.remove(f'{cn_path}/{cn}.csr')
+        job = plan_job(backend, results_dir, cn, 'crt', store=store)
+        assert job['skip'] == set() and job['reuse_key']
+    finally:
+        store.close()
+
+
+def test_renewal_takes_latest_previous_key(backend, tmp_path):
+    old_key, _ = _make_csr(backend, f'{tmp_path}/RESULTS_01-01-2025/{cn}')
+    new_key, _ = _make_csr(backend, f'{tmp_path}/RESULTS_01-06-2025/{cn}')
+    current = tmp_path / 'RESULTS_01-01-2026'
+    current.mkdir()
+
+    cn_dirs = previous_cn_dirs(str(tmp_path), str(current))
+    assert cn_dirs[cn] == [f'{tmp_path}/RESULTS_01-06-2025/{cn}', f'{tmp_path}/RESULTS_01-01-2025/{cn}']
+
+    job = plan_renewal(backend, plan_job(backend, str(current), cn, 'crt'), cn_dirs, (key_type,))
+    assert job['renew_from'] == f'{tmp_path}/RESULTS_01-06-2025/{cn}'
+    assert job['renew_csr']
+
+    # SANs set for CN: CSR is made again with the same key
+    job = plan_renewal(backend, plan_job(backend, str(current), cn, 'crt'), cn_dirs, (key_type,),
+                       sans=['alt.example.test'])
+    assert job['renew_from'] and not job['renew_csr']
+
+
+def test_renewal_key_type_policy(backend, tmp_path):
+    _make_csr(backend, f'{tmp_path}/RESULTS_01-01-2025/{cn}')
+    current = tmp_path / 'RESULTS_01-01-2026'
+    cn_dirs = previous_cn_dirs(str(tmp_path), str(current))
+
+    job = plan_renewal(backend, plan_job(backend, str(current), cn, 'crt'), cn_dirs, ('rsa2048',))
+    assert 'renew_from' not in job
+
+
+def test_renewal_finds_mixed_case_cn_dir(backend, tmp_path):
+    name = 'Host.Example.test'
+    _make_csr(backend, f'{tmp_path}/RESULTS_01-01-2025/{name}', name)
+    current = tmp_path / 'RESULTS_01-01-2026'
+    cn_dirs = previous_cn_dirs(str(tmp_path), str(current))
+
+    job = plan_renewal(backend, plan_job(backend, str(current), name, 'crt'), cn_dirs, (key_type,))
+    assert job['renew_from'] == f'{tmp_path}/RESULTS_01-01-2025/{name}'